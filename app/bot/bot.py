@@ -1,9 +1,21 @@
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
 import os
 from app.config import settings
 from app.services.redis_service import redis_service
-from app.bot.middleware import LoggingMiddleware, UserRegistrationMiddleware
+from app.services.fashn_service import fashn_service
+from app.services.cloudinary_executor import cloudinary_executor
+from app.utils.image_processing import image_processor
+from app.services.tryon_queue import tryon_queue
+from app.services.telegram_sender import telegram_sender
+from app.services.loop_monitor import loop_monitor
+from app.bot.middleware import (
+    LoggingMiddleware, UserRegistrationMiddleware, user_redis_sync, user_lanes, db_session_middleware,
+    handler_metrics, fsm_cache_scope
+)
+from app.bot.storage import RedisFSMStorage
 from app.bot.handlers import register_handlers
 from app.database.base import Base
 from app.database.connection import engine
@@ -43,6 +55,25 @@ async def init_database():
         logger.warning("⚠️ Bot will continue without database functionality")
 
 
+def create_fsm_storage(current_settings, redis_connected: bool) -> BaseStorage:
+    """
+    Создать хранилище FSM согласно настройкам
+    
+    RedisFSMStorage позволяет запускать несколько процессов бота без
+    привязки пользователя к процессу. Если Redis недоступен, используется
+    MemoryStorage (состояния сбрасываются при деплое).
+    """
+    if current_settings.fsm_storage == "redis" and redis_connected:
+        logger.info("✅ Using RedisFSMStorage for FSM")
+        return RedisFSMStorage(
+            redis=redis_service,
+            state_ttl=current_settings.fsm_state_ttl
+        )
+    
+    logger.info("✅ Using MemoryStorage for FSM (states will reset on deploy)")
+    return MemoryStorage()
+
+
 async def create_bot():
     """Создание и настройка бота"""
     # Получаем настройки в зависимости от окружения
@@ -51,36 +82,56 @@ async def create_bot():
     # Инициализируем базу данных
     await init_database()
     
-    # Подключаем Redis ДЛЯ ДАННЫХ (не для FSM)
+    # Подключаем Redis для данных пользователей и FSM
     redis_url = os.getenv("REDIS_URL", current_settings.redis_url)
+    redis_connected = False
     
     if redis_url and "localhost" not in redis_url and "127.0.0.1" not in redis_url:
         try:
             await redis_service.connect()
+            redis_connected = True
             logger.info(f"✅ Redis connected for user data: {redis_url}")
+            
+            # Однократный перенос данных пользователей из JSON в hash
+            await redis_service.migrate_user_data_to_hash()
         except Exception as e:
             logger.error(f"❌ Failed to connect to Redis: {e}")
             logger.warning("⚠️ Bot will work without Redis persistence")
     else:
         logger.warning("⚠️ Redis URL not configured, data will not persist")
     
-    # FSM использует MemoryStorage (сбрасывается при деплое)
-    from aiogram.fsm.storage.memory import MemoryStorage
-    storage = MemoryStorage()
-    logger.info("✅ Using MemoryStorage for FSM (states will reset on deploy)")
+    storage = create_fsm_storage(current_settings, redis_connected)
     
     # Создаем бота
     bot = Bot(
         token=current_settings.bot_token,
         parse_mode=ParseMode.HTML
     )
+    # Все исходящие сообщения (и из webhook сервера) идут через общий планировщик
+    telegram_sender.bind(bot)
     
     # Создаем диспетчер
     dp = Dispatcher(storage=storage)
     
+    # FSMContextMiddleware диспетчера читает состояние (raw_state) еще до
+    # обработчиков, поэтому очередь пользователя и кеш FSM ставим перед ним
+    dp.update.outer_middleware.unregister(dp.fsm)
+    # Обновления одного пользователя обрабатываются по очереди, разных - параллельно
+    dp.update.outer_middleware(user_lanes)
+    # Чтения FSM кешируются только в пределах обновления
+    dp.update.outer_middleware(fsm_cache_scope)
+    dp.update.outer_middleware(dp.fsm)
+    
+    # Время обработки по обработчикам (включая остальные middleware)
+    dp.message.middleware(handler_metrics)
+    dp.callback_query.middleware(handler_metrics)
+    
     # Добавляем middleware
     dp.message.middleware(LoggingMiddleware())
     dp.callback_query.middleware(LoggingMiddleware())
+    # Одна сессия БД на обновление - ее использует и регистрация пользователя
+    dp.message.middleware(db_session_middleware)
+    dp.callback_query.middleware(db_session_middleware)
     dp.message.middleware(UserRegistrationMiddleware())
     dp.callback_query.middleware(UserRegistrationMiddleware())
     
@@ -103,30 +154,58 @@ async def get_bot():
     return bot, dp
 
 
-async def start_bot():
-    """Запуск бота"""
+async def startup_bot():
+    """
+    Создать бота и запустить фоновые сервисы
+    
+    Общая часть запуска для long polling и webhook режимов.
+    """
     bot, dp = await get_bot()
     
+    # Задержка event loop для /metrics
+    await loop_monitor.start()
+    
+    # Открываем общий пул HTTP соединений к Fashn
+    await fashn_service.start()
+    
+    # Запускаем воркеры очереди try-on задач
     try:
-        logger.info("Starting bot...")
-        
-        # Обработка конфликта Telegram API
-        try:
-            await dp.start_polling(bot)
-        except Exception as telegram_error:
-            if "Conflict: terminated by other getUpdates request" in str(telegram_error):
-                logger.error("❌ Telegram API Conflict: Another bot instance is running")
-                logger.info("🔄 Waiting 5 seconds before retry...")
-                import asyncio
-                await asyncio.sleep(5)
-                logger.info("🔄 Retrying bot start...")
-                await dp.start_polling(bot)
-            else:
-                raise telegram_error
-                
+        await tryon_queue.start(bot)
+    except Exception as e:
+        logger.error(f"❌ Failed to start try-on queue: {e}")
+    
+    return bot, dp
+
+
+async def shutdown_bot():
+    """Остановить фоновые сервисы и закрыть соединения"""
+    await tryon_queue.stop()
+    await loop_monitor.stop()
+    if bot is not None:
+        await bot.session.close()
+    await user_redis_sync.flush()
+    await fashn_service.close()
+    cloudinary_executor.shutdown()
+    image_processor.shutdown()
+    await redis_service.disconnect()
+    # Дописать записи, оставшиеся в очереди логирования
+    await logger.complete()
+
+
+async def start_bot():
+    """
+    Запуск бота в режиме long polling
+    
+    Используется, когда webhook Telegram не настроен (локальная разработка).
+    """
+    try:
+        bot, dp = await startup_bot()
+        logger.info("Starting bot (long polling)...")
+        # getUpdates не работает, пока установлен webhook
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
     except Exception as e:
         logger.error(f"Error starting bot: {e}")
         raise
     finally:
-        await bot.session.close()
-        await redis_service.disconnect()
\ No newline at end of file
+        await shutdown_bot()
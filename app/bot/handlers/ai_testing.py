@@ -3,6 +3,8 @@ from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
 from app.bot.states import UserStates
 from app.bot.keyboards import MainKeyboard
+from app.bot.middleware import KnownUser
+from sqlalchemy.ext.asyncio import AsyncSession
 from loguru import logger
 
 
@@ -16,7 +18,7 @@ from loguru import logger
 
 
 
-async def handle_general_text_messages(message: Message, state: FSMContext):
+async def handle_general_text_messages(message: Message, state: FSMContext, known_user: KnownUser, session: AsyncSession):
     """Обработчик общих текстовых сообщений"""
     from .commands import (
         profile_command, help_command, upload_user_photo_command, 
@@ -40,20 +42,20 @@ async def handle_general_text_messages(message: Message, state: FSMContext):
     # Обработка кнопок главного меню (только в состоянии authorized)
     if current_state == UserStates.authorized:
         if text == "👤 Мой профиль":
-            await profile_command(message, state)
+            await profile_command(message, state, known_user, session)
         elif text == "📷 Загрузить фото пользователя":
             await upload_user_photo_command(message, state)
         elif text == "👗 Загрузить фото одежды":
             await upload_clothing_photo_command(message, state)
         elif text == "👗 Тест Fashn":
-            await test_fashn_command(message, state)
+            await test_fashn_command(message, state, known_user, session)
         elif text == "💳 Подписка":
             await message.answer(
                 "💳 <b>Управление подпиской</b>\n\nЭта функция будет доступна в следующих версиях бота.",
                 reply_markup=MainKeyboard.get_main_menu()
             )
         elif text == "🧹 Очистить данные":
-            await clear_command(message, state)
+            await clear_command(message, state, known_user, session)
         elif text == "❓ Помощь":
             await help_command(message, state)
         else:
@@ -67,20 +69,20 @@ async def handle_general_text_messages(message: Message, state: FSMContext):
         await state.set_state(UserStates.authorized)
         
         if text == "👤 Мой профиль":
-            await profile_command(message, state)
+            await profile_command(message, state, known_user, session)
         elif text == "📷 Загрузить фото пользователя":
             await upload_user_photo_command(message, state)
         elif text == "👗 Загрузить фото одежды":
             await upload_clothing_photo_command(message, state)
         elif text == "👗 Тест Fashn":
-            await test_fashn_command(message, state)
+            await test_fashn_command(message, state, known_user, session)
         elif text == "💳 Подписка":
             await message.answer(
                 "💳 <b>Управление подпиской</b>\n\nЭта функция будет доступна в следующих версиях бота.",
                 reply_markup=MainKeyboard.get_main_menu()
             )
         elif text == "🧹 Очистить данные":
-            await clear_command(message, state)
+            await clear_command(message, state, known_user, session)
         elif text == "❓ Помощь":
             await help_command(message, state)
         else:
@@ -92,20 +94,20 @@ async def handle_general_text_messages(message: Message, state: FSMContext):
     else:
         # В других состояниях - обрабатываем команды
         if text == "👤 Мой профиль":
-            await profile_command(message, state)
+            await profile_command(message, state, known_user, session)
         elif text == "📷 Загрузить фото пользователя":
             await upload_user_photo_command(message, state)
         elif text == "👗 Загрузить фото одежды":
             await upload_clothing_photo_command(message, state)
         elif text == "👗 Тест Fashn":
-            await test_fashn_command(message, state)
+            await test_fashn_command(message, state, known_user, session)
         elif text == "💳 Подписка":
             await message.answer(
                 "💳 <b>Управление подпиской</b>\n\nЭта функция будет доступна в следующих версиях бота.",
                 reply_markup=MainKeyboard.get_main_menu()
             )
         elif text == "🧹 Очистить данные":
-            await clear_command(message, state)
+            await clear_command(message, state, known_user, session)
         elif text == "❓ Помощь":
             await help_command(message, state)
         else:
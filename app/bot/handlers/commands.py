@@ -5,6 +5,9 @@ from aiogram.fsm.context import FSMContext
 from app.bot.states import UserStates
 from app.bot.keyboards import MainKeyboard
 from app.services.ai_logging_service import ai_logging_service
+from app.bot.middleware import KnownUser
+from app.models.user import User
+from sqlalchemy.ext.asyncio import AsyncSession
 from loguru import logger
 import asyncio
 from datetime import datetime
@@ -95,7 +98,7 @@ async def help_command(message: Message, state: FSMContext):
     logger.info(f"User {message.from_user.id} requested help")
 
 
-async def profile_command(message: Message, state: FSMContext):
+async def profile_command(message: Message, state: FSMContext, known_user: KnownUser, session: AsyncSession):
     """
     Обработчик команды /profile
     
@@ -107,11 +110,11 @@ async def profile_command(message: Message, state: FSMContext):
     Args:
         message: Сообщение от пользователя
         state: FSM контекст для управления состояниями
+        known_user: Известный пользователь (UserRegistrationMiddleware)
+        session: Сессия БД обновления (DatabaseSessionMiddleware)
     """
-    from app.database.async_session import get_async_session
-    from app.models.user import User
     from app.models.photo import UserPhoto, PhotoType
-    from sqlalchemy import select, func, delete
+    from sqlalchemy import select, func
     
     # Очищаем состояние
     await state.clear()
@@ -119,59 +122,53 @@ async def profile_command(message: Message, state: FSMContext):
     user = message.from_user
     
     try:
-        # Получаем информацию о пользователе из БД
-        async with get_async_session() as session:
-            # Получаем пользователя
+        # Строка пользователя - ради актуальных счетчиков и подписки.
+        # Фиктивный пользователь (БД недоступна при регистрации) не имеет id
+        db_user = await session.get(User, known_user.id) if known_user.id is not None else None
+        registered = db_user is not None
+        
+        # Количество загруженных фото по типам - одним запросом
+        if registered:
+            logger.info(f"Profile: Looking for photos with user_id = {db_user.id}")
             result = await session.execute(
-                select(User).where(User.telegram_id == user.id)
+                select(UserPhoto.photo_type, func.count(UserPhoto.id))
+                .where(UserPhoto.user_id == db_user.id)
+                .group_by(UserPhoto.photo_type)
             )
-            db_user = result.scalar_one_or_none()
-            
-            # Получаем количество загруженных фото
-            if db_user:
-                logger.info(f"Profile: Looking for photos with user_id = {db_user.id}")
-                user_photo_count = await session.scalar(
-                    select(func.count(UserPhoto.id)).where(
-                        UserPhoto.user_id == db_user.id,
-                        UserPhoto.photo_type == PhotoType.USER_PHOTO
-                    )
-                ) or 0
-                
-                clothing_count = await session.scalar(
-                    select(func.count(UserPhoto.id)).where(
-                        UserPhoto.user_id == db_user.id,
-                        UserPhoto.photo_type == PhotoType.CLOTHING
-                    )
-                ) or 0
-                
-                logger.info(f"Profile: Found {user_photo_count} user photos, {clothing_count} clothing photos")
-            else:
-                user_photo_count = 0
-                clothing_count = 0
-                logger.info("Profile: No user found in database")
-            
-            # Проверяем наличие фото в Redis (приоритет над БД)
-            from app.services.redis_service import redis_service
-            redis_data = await redis_service.get_user_data(user.id)
-            
-            has_user_photo_redis = bool(redis_data and redis_data.get("user_photo_url"))
-            has_clothing_photo_redis = bool(redis_data and redis_data.get("clothing_photo_url"))
-            
-            # Используем данные из Redis или БД
-            user_photo_status = "✅ Да" if (user_photo_count > 0 or has_user_photo_redis) else "❌ Нет"
-            clothing_photo_status = "✅ Да" if (clothing_count > 0 or has_clothing_photo_redis) else "❌ Нет"
-            
-            # Формируем информацию о профиле
-            if db_user:
-                subscription_info = "🆓 Бесплатная" if db_user.subscription_type == "free" else f"💎 {db_user.subscription_type.title()}"
-                generation_count = db_user.generation_count or 0
-                created_at = db_user.created_at.strftime("%d.%m.%Y") if db_user.created_at else "Неизвестно"
-            else:
-                subscription_info = "🆓 Бесплатная"
-                generation_count = 0
-                created_at = "Неизвестно"
+            photo_counts = dict(result.all())
+            user_photo_count = photo_counts.get(PhotoType.USER_PHOTO, 0)
+            clothing_count = photo_counts.get(PhotoType.CLOTHING, 0)
             
-            profile_text = f"""
+            logger.info(f"Profile: Found {user_photo_count} user photos, {clothing_count} clothing photos")
+        else:
+            user_photo_count = 0
+            clothing_count = 0
+            logger.info("Profile: No user found in database")
+        
+        # Проверяем наличие фото в Redis (приоритет над БД)
+        from app.services.redis_service import redis_service
+        redis_data = await redis_service.get_user_fields(
+            user.id, ["user_photo_url", "clothing_photo_url"]
+        )
+        
+        has_user_photo_redis = bool(redis_data.get("user_photo_url"))
+        has_clothing_photo_redis = bool(redis_data.get("clothing_photo_url"))
+        
+        # Используем данные из Redis или БД
+        user_photo_status = "✅ Да" if (user_photo_count > 0 or has_user_photo_redis) else "❌ Нет"
+        clothing_photo_status = "✅ Да" if (clothing_count > 0 or has_clothing_photo_redis) else "❌ Нет"
+        
+        # Формируем информацию о профиле
+        if registered:
+            subscription_info = "🆓 Бесплатная" if db_user.subscription_type == "free" else f"💎 {db_user.subscription_type.title()}"
+            generation_count = db_user.generation_count or 0
+            created_at = db_user.created_at.strftime("%d.%m.%Y") if db_user.created_at else "Неизвестно"
+        else:
+            subscription_info = "🆓 Бесплатная"
+            generation_count = 0
+            created_at = "Неизвестно"
+        
+        profile_text = f"""
 👤 <b>Мой профиль</b>
 
 🆔 <b>ID:</b> {user.id}
@@ -186,15 +183,15 @@ async def profile_command(message: Message, state: FSMContext):
 • Одежда: {clothing_photo_status}
 
 {'✅ Профиль готов к использованию!' if (user_photo_count > 0 or has_user_photo_redis) and (clothing_count > 0 or has_clothing_photo_redis) else '⚠️ Загрузи фото для создания профиля'}
-            """
-            
-            await message.answer(
-                profile_text,
-                reply_markup=MainKeyboard.get_main_menu()
-            )
-            # Остаемся в состоянии authorized
-            await state.set_state(UserStates.authorized)
-            
+        """
+        
+        await message.answer(
+            profile_text,
+            reply_markup=MainKeyboard.get_main_menu()
+        )
+        # Остаемся в состоянии authorized
+        await state.set_state(UserStates.authorized)
+        
     except Exception as e:
         logger.error(f"Error getting profile info for user {user.id}: {e}")
         # Fallback информация без БД
@@ -225,60 +222,46 @@ async def profile_command(message: Message, state: FSMContext):
     logger.info(f"User {message.from_user.id} viewed profile")
 
 
-async def test_fashn_command(message: Message, state: FSMContext):
+async def test_fashn_command(message: Message, state: FSMContext, known_user: KnownUser, session: AsyncSession):
     """Обработчик команды /test_fashn"""
     user = message.from_user
     
     # Проверяем наличие фото пользователя и одежды
     try:
-        from app.database.async_session import get_async_session
-        from app.models.user import User
         from app.models.photo import UserPhoto, PhotoType
-        from sqlalchemy import select, and_
+        from sqlalchemy import select
         
-        async with get_async_session() as session:
-            # Сначала получаем пользователя из БД
-            user_result = await session.execute(
-                select(User).where(User.telegram_id == user.id)
+        if known_user.id is None:
+            await message.answer(
+                "❌ Пользователь не найден в базе данных. Используй /start для регистрации.",
+                reply_markup=MainKeyboard.get_main_menu()
             )
-            db_user = user_result.scalar_one_or_none()
-            
-            if not db_user:
-                await message.answer(
-                    "❌ Пользователь не найден в базе данных. Используй /start для регистрации.",
-                    reply_markup=MainKeyboard.get_main_menu()
-                )
-                return
-            
-            # Проверяем фото пользователя
-            user_photo_result = await session.execute(
-                select(UserPhoto).where(
-                    and_(UserPhoto.user_id == db_user.id, UserPhoto.photo_type == PhotoType.USER_PHOTO)
-                )
+            return
+        
+        # Фото пользователя и одежды - одним запросом
+        photos_result = await session.execute(
+            select(UserPhoto).where(
+                UserPhoto.user_id == known_user.id,
+                UserPhoto.photo_type.in_([PhotoType.USER_PHOTO, PhotoType.CLOTHING])
             )
-            user_photo = user_photo_result.scalar_one_or_none()
+        )
+        photos = {photo.photo_type: photo for photo in photos_result.scalars()}
+        user_photo = photos.get(PhotoType.USER_PHOTO)
+        clothing_photo = photos.get(PhotoType.CLOTHING)
+        
+        if not user_photo or not clothing_photo:
+            missing_photos = []
+            if not user_photo:
+                missing_photos.append("фото пользователя")
+            if not clothing_photo:
+                missing_photos.append("фото одежды")
             
-            # Проверяем фото одежды
-            clothing_photo_result = await session.execute(
-                select(UserPhoto).where(
-                    and_(UserPhoto.user_id == db_user.id, UserPhoto.photo_type == PhotoType.CLOTHING)
-                )
+            await message.answer(
+                f"❌ Сначала загрузи {', '.join(missing_photos)}!\n\nИспользуй команды:\n/upload_user_photo - загрузить фото пользователя\n/upload_clothing_photo - загрузить фото одежды",
+                reply_markup=MainKeyboard.get_main_menu()
             )
-            clothing_photo = clothing_photo_result.scalar_one_or_none()
+            return
             
-            if not user_photo or not clothing_photo:
-                missing_photos = []
-                if not user_photo:
-                    missing_photos.append("фото пользователя")
-                if not clothing_photo:
-                    missing_photos.append("фото одежды")
-                
-                await message.answer(
-                    f"❌ Сначала загрузи {', '.join(missing_photos)}!\n\nИспользуй команды:\n/upload_user_photo - загрузить фото пользователя\n/upload_clothing_photo - загрузить фото одежды",
-                    reply_markup=MainKeyboard.get_main_menu()
-                )
-                return
-                
     except Exception as e:
         logger.error(f"Error checking photos for user {user.id}: {e}")
         await message.answer(
@@ -287,9 +270,54 @@ async def test_fashn_command(message: Message, state: FSMContext):
         )
         return
     
-    # Импортируем FashnService
-    from app.services.fashn_service import fashn_service
-    from app.services.redis_service import redis_service
+    # Импортируем очередь try-on задач и кеш результатов
+    from app.services.tryon_queue import tryon_queue
+    from app.services.tryon_cache import tryon_cache
+    from app.services.tryon_singleflight import tryon_singleflight
+    
+    # Те же фото с теми же параметрами уже генерировались - отвечаем из кеша
+    fingerprint = None
+    try:
+        fingerprint = await tryon_cache.fingerprint(user_photo.photo_url, clothing_photo.photo_url)
+        cached_urls = await tryon_cache.get(fingerprint)
+    except Exception as e:
+        logger.warning(f"Try-on cache lookup failed for user {user.id}: {e}")
+        cached_urls = None
+    
+    if cached_urls:
+        from app.bot.results import send_result_photos
+        from app.services.telegram_sender import telegram_sender, RESULT
+        
+        await state.set_state(UserStates.authorized)
+        # Так же, как результат из webhook: альбомами, data URI - файлами
+        with telegram_sender.lane(RESULT):
+            await send_result_photos(
+                message.bot,
+                message.chat.id,
+                cached_urls,
+                caption="🎉 <b>Генерация завершена!</b>\n\nЭти фото уже обрабатывались, результат взят из кеша."
+            )
+        logger.info(f"User {user.id} got cached Fashn result")
+        return
+    
+    # Такой же запрос уже выполняется - ждем его результат вместо новой генерации
+    flight_key = tryon_singleflight.make_key(fingerprint, user_photo.photo_url, clothing_photo.photo_url)
+    try:
+        role = await tryon_singleflight.join(flight_key, user.id, message.chat.id)
+    except Exception as e:
+        logger.warning(f"Try-on coalescing unavailable for user {user.id}: {e}")
+        role, flight_key = tryon_singleflight.LEADER, None
+    
+    if role != tryon_singleflight.LEADER:
+        await state.set_state(UserStates.waiting_ai_response)
+        text = (
+            "⏳ <b>Этот запрос уже выполняется</b>\n\nРезультат придет сюда, как только генерация завершится."
+            if role == tryon_singleflight.FOLLOWER
+            else "⏳ <b>Твой запрос уже в работе</b>\n\nДождись результата, повторно отправлять не нужно."
+        )
+        await message.answer(text, reply_markup=MainKeyboard.get_main_menu())
+        logger.info(f"User {user.id} attached to running Fashn job ({role})")
+        return
     
     start_time = datetime.now()
     
@@ -301,43 +329,31 @@ async def test_fashn_command(message: Message, state: FSMContext):
         start_time=start_time
     )
     
-    await state.set_state(UserStates.waiting_ai_response)
-    await message.answer(
-        "👗 <b>Тестируем Fashn...</b>\n\nОтправляю твои фото в Fashn API для генерации try-on изображения.\nЭто может занять 30-60 секунд.",
-        reply_markup=MainKeyboard.get_main_menu()
-    )
-    
-    # Отправляем запрос в Fashn AI
-    success, response_message, prediction_id = await fashn_service.submit_tryon_request(
-        user_photo_url=user_photo.photo_url,
-        clothing_photo_url=clothing_photo.photo_url,
-        user_id=user.id
-    )
-    
-    if success and prediction_id:
-        # Сохраняем контекст для webhook обработки
-        await redis_service.set_json(
-            f"fashn_prediction:{prediction_id}",
-            {
-                "user_id": user.id,
-                "start_time": start_time.isoformat(),
-                "user_photo_url": user_photo.photo_url,
-                "clothing_photo_url": clothing_photo.photo_url
-            },
-            expire=3600  # 1 час
-        )
-        
-        await message.answer(
-            f"✅ <b>Запрос отправлен в Fashn AI!</b>\n\n{response_message}\n\nОжидайте результат через webhook...",
-            reply_markup=MainKeyboard.get_main_menu()
+    # Ставим задачу в очередь - запрос в Fashn отправит воркер
+    try:
+        job_id, queue_position = await tryon_queue.enqueue(
+            user_id=user.id,
+            chat_id=message.chat.id,
+            user_photo_url=user_photo.photo_url,
+            clothing_photo_url=clothing_photo.photo_url,
+            fingerprint=fingerprint,
+            flight_key=flight_key
         )
+    except Exception as e:
+        logger.error(f"Failed to enqueue Fashn job for user {user.id}: {e}")
         
-        logger.info(f"User {user.id} submitted Fashn request with prediction ID: {prediction_id}")
-    else:
-        # Обработка ошибок
+        # Подписчики не дождутся результата - сообщаем им об ошибке
+        try:
+            for subscriber in await tryon_singleflight.finish(flight_key):
+                await message.bot.send_message(
+                    chat_id=subscriber["chat_id"],
+                    text="❌ <b>Ошибка Fashn AI</b>\n\nНе удалось поставить задачу в очередь. Попробуй еще раз."
+                )
+        except Exception as finish_error:
+            logger.warning(f"Failed to release coalesced Fashn job: {finish_error}")
         await state.set_state(UserStates.authorized)
         await message.answer(
-            f"❌ <b>Ошибка Fashn AI</b>\n\n{response_message}",
+            "❌ <b>Ошибка Fashn AI</b>\n\nНе удалось поставить задачу в очередь. Попробуй еще раз.",
             reply_markup=MainKeyboard.get_main_menu()
         )
         
@@ -345,44 +361,47 @@ async def test_fashn_command(message: Message, state: FSMContext):
         await ai_logging_service.log_ai_response(
             user_id=user.id,
             service_name="Fashn",
-            response_data={"error": message},
+            response_data={"error": str(e)},
             processing_time=(datetime.now() - start_time).total_seconds(),
             success=False,
-            error_message=message
+            error_message=str(e)
         )
-        
-        logger.error(f"Fashn request failed for user {user.id}: {message}")
+        return
+    
+    await state.set_state(UserStates.waiting_ai_response)
+    await message.answer(
+        f"👗 <b>Тестируем Fashn...</b>\n\nТвоя задача в очереди, позиция: {queue_position}.\nКак только она будет отправлена в Fashn API, я сообщу. Генерация может занять 30-60 секунд.",
+        reply_markup=MainKeyboard.get_main_menu()
+    )
+    
+    logger.info(f"User {user.id} queued Fashn job {job_id} at position {queue_position}")
 
 
 
-async def clear_command(message: Message, state: FSMContext):
+async def clear_command(message: Message, state: FSMContext, known_user: KnownUser, session: AsyncSession):
     """Обработчик команды /clear - очищает фото из БД и данные из Redis"""
-    from app.database.async_session import get_async_session
-    from app.models.user import User
     from app.models.photo import UserPhoto
     from app.services.redis_service import redis_service
-    from sqlalchemy import select, delete
+    from sqlalchemy import delete
     
     user = message.from_user
     
     try:
         # Удаляем фото из БД
-        async with get_async_session() as session:
-            result = await session.execute(
-                select(User).where(User.telegram_id == user.id)
+        if known_user.id is not None:
+            await session.execute(
+                delete(UserPhoto).where(UserPhoto.user_id == known_user.id)
             )
-            db_user = result.scalar_one_or_none()
-            
-            if db_user:
-                await session.execute(
-                    delete(UserPhoto).where(UserPhoto.user_id == db_user.id)
-                )
-                await session.commit()
-                logger.info(f"User {user.id} cleared photos from database")
+            await session.commit()
+            logger.info(f"User {user.id} cleared photos from database")
         
         # Очищаем данные из Redis
         await redis_service.clear_user_data(user.id)
         
+        # Сбрасываем кеш middleware, чтобы базовые данные снова попали в Redis
+        from app.bot.middleware import user_cache
+        user_cache.pop(user.id)
+        
         # Очищаем FSM состояние
         await state.clear()
         
@@ -5,12 +5,13 @@ from app.bot.states import UserStates
 from app.bot.keyboards import MainKeyboard
 from app.services.file_service import file_service
 from app.models.photo import PhotoType
-from app.database.async_session import get_async_session
+from app.bot.middleware import KnownUser
+from sqlalchemy.ext.asyncio import AsyncSession
 from loguru import logger
 import asyncio
 
 
-async def handle_photo(message: Message, state: FSMContext):
+async def handle_photo(message: Message, state: FSMContext, known_user: KnownUser, session: AsyncSession):
     """Обработчик загруженных фото"""
     user = message.from_user
     current_state = await state.get_state()
@@ -21,9 +22,9 @@ async def handle_photo(message: Message, state: FSMContext):
     logger.info(f"User {user.id} uploaded photo, current state: {current_state}")
     
     if current_state == UserStates.waiting_user_photo:
-        await handle_user_photo(message, photo, state)
+        await handle_user_photo(message, photo, state, known_user, session)
     elif current_state == UserStates.waiting_clothing_photo:
-        await handle_clothing_photo(message, photo, state)
+        await handle_clothing_photo(message, photo, state, known_user, session)
     else:
         # Если фото загружено не в ожидаемом состоянии
         await message.answer(
@@ -32,11 +33,18 @@ async def handle_photo(message: Message, state: FSMContext):
         )
 
 
-async def handle_user_photo(message: Message, photo: PhotoSize, state: FSMContext):
+async def handle_user_photo(
+    message: Message, photo: PhotoSize, state: FSMContext, known_user: KnownUser, session: AsyncSession
+):
     """Обработка фото пользователя"""
     user = message.from_user
     
     try:
+        # Без записи в БД фото некуда сохранить - не скачиваем и не загружаем его
+        if known_user.id is None:
+            await message.answer("❌ Пользователь не найден в базе данных.")
+            return
+        
         # Обрабатываем фото через сервис
         cloudinary_url, public_id, error = await file_service.process_telegram_photo(
             message.bot, photo, user.id, PhotoType.USER_PHOTO
@@ -47,35 +55,21 @@ async def handle_user_photo(message: Message, photo: PhotoSize, state: FSMContex
             return
         
         # Сохраняем в БД
-        async with get_async_session() as session:
-            # Получаем пользователя из БД
-            from app.models.user import User
-            from sqlalchemy import select
-            
-            result = await session.execute(
-                select(User).where(User.telegram_id == user.id)
-            )
-            db_user = result.scalar_one_or_none()
-            
-            if db_user:
-                await file_service.save_photo_to_database(
-                    session, db_user.id, cloudinary_url, PhotoType.USER_PHOTO, public_id
-                )
-                
-                # Сохраняем URL фото в Redis
-                try:
-                    from app.services.redis_service import redis_service
-                    logger.info(f"Attempting to save photo URL to Redis for user {user.id}: {cloudinary_url}")
-                    result = await redis_service.update_user_field(user.id, "user_photo_url", cloudinary_url)
-                    logger.info(f"User {user.id} photo URL saved to Redis successfully: {result}")
-                except Exception as e:
-                    logger.error(f"Failed to save photo URL to Redis for user {user.id}: {e}")
-                    logger.error(f"Exception type: {type(e).__name__}")
-                    import traceback
-                    logger.error(f"Traceback: {traceback.format_exc()}")
-            else:
-                await message.answer("❌ Пользователь не найден в базе данных.")
-                return
+        await file_service.save_photo_to_database(
+            session, known_user.id, cloudinary_url, PhotoType.USER_PHOTO, public_id
+        )
+        
+        # Сохраняем URL фото в Redis
+        try:
+            from app.services.redis_service import redis_service
+            logger.info(f"Attempting to save photo URL to Redis for user {user.id}: {cloudinary_url}")
+            result = await redis_service.update_user_field(user.id, "user_photo_url", cloudinary_url)
+            logger.info(f"User {user.id} photo URL saved to Redis successfully: {result}")
+        except Exception as e:
+            logger.error(f"Failed to save photo URL to Redis for user {user.id}: {e}")
+            logger.error(f"Exception type: {type(e).__name__}")
+            import traceback
+            logger.error(f"Traceback: {traceback.format_exc()}")
         
         await message.answer("✅ Фото пользователя сохранено!")
         
@@ -93,11 +87,18 @@ async def handle_user_photo(message: Message, photo: PhotoSize, state: FSMContex
         await message.answer("❌ Произошла ошибка. Попробуй еще раз.")
 
 
-async def handle_clothing_photo(message: Message, photo: PhotoSize, state: FSMContext):
+async def handle_clothing_photo(
+    message: Message, photo: PhotoSize, state: FSMContext, known_user: KnownUser, session: AsyncSession
+):
     """Обработка фото одежды"""
     user = message.from_user
     
     try:
+        # Без записи в БД фото некуда сохранить - не скачиваем и не загружаем его
+        if known_user.id is None:
+            await message.answer("❌ Пользователь не найден в базе данных.")
+            return
+        
         # Обрабатываем фото через сервис
         cloudinary_url, public_id, error = await file_service.process_telegram_photo(
             message.bot, photo, user.id, PhotoType.CLOTHING
@@ -108,35 +109,21 @@ async def handle_clothing_photo(message: Message, photo: PhotoSize, state: FSMCo
             return
         
         # Сохраняем в БД
-        async with get_async_session() as session:
-            # Получаем пользователя из БД
-            from app.models.user import User
-            from sqlalchemy import select
-            
-            result = await session.execute(
-                select(User).where(User.telegram_id == user.id)
-            )
-            db_user = result.scalar_one_or_none()
-            
-            if db_user:
-                await file_service.save_photo_to_database(
-                    session, db_user.id, cloudinary_url, PhotoType.CLOTHING, public_id
-                )
-                
-                # Сохраняем URL фото в Redis
-                try:
-                    from app.services.redis_service import redis_service
-                    logger.info(f"Attempting to save clothing photo URL to Redis for user {user.id}: {cloudinary_url}")
-                    result = await redis_service.update_user_field(user.id, "clothing_photo_url", cloudinary_url)
-                    logger.info(f"User {user.id} clothing photo URL saved to Redis successfully: {result}")
-                except Exception as e:
-                    logger.error(f"Failed to save clothing photo URL to Redis for user {user.id}: {e}")
-                    logger.error(f"Exception type: {type(e).__name__}")
-                    import traceback
-                    logger.error(f"Traceback: {traceback.format_exc()}")
-            else:
-                await message.answer("❌ Пользователь не найден в базе данных.")
-                return
+        await file_service.save_photo_to_database(
+            session, known_user.id, cloudinary_url, PhotoType.CLOTHING, public_id
+        )
+        
+        # Сохраняем URL фото в Redis
+        try:
+            from app.services.redis_service import redis_service
+            logger.info(f"Attempting to save clothing photo URL to Redis for user {user.id}: {cloudinary_url}")
+            result = await redis_service.update_user_field(user.id, "clothing_photo_url", cloudinary_url)
+            logger.info(f"User {user.id} clothing photo URL saved to Redis successfully: {result}")
+        except Exception as e:
+            logger.error(f"Failed to save clothing photo URL to Redis for user {user.id}: {e}")
+            logger.error(f"Exception type: {type(e).__name__}")
+            import traceback
+            logger.error(f"Traceback: {traceback.format_exc()}")
         
         await message.answer("✅ Фото одежды сохранено!")
         
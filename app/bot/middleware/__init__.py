@@ -1,4 +1,12 @@
 from .logging import LoggingMiddleware
-from .user_registration import UserRegistrationMiddleware
+from .user_registration import UserRegistrationMiddleware, KnownUser, user_cache, user_redis_sync
+from .user_lanes import UserLaneMiddleware, user_lanes
+from .db_session import DatabaseSessionMiddleware, db_session_middleware
+from .metrics import HandlerMetricsMiddleware, handler_metrics
+from .fsm_cache import FSMCacheScopeMiddleware, fsm_cache_scope
 
-__all__ = ["LoggingMiddleware", "UserRegistrationMiddleware"]
+__all__ = [
+    "LoggingMiddleware", "UserRegistrationMiddleware", "KnownUser", "user_cache", "user_redis_sync",
+    "UserLaneMiddleware", "user_lanes", "DatabaseSessionMiddleware", "db_session_middleware",
+    "HandlerMetricsMiddleware", "handler_metrics", "FSMCacheScopeMiddleware", "fsm_cache_scope"
+]
@@ -0,0 +1,83 @@
+from aiogram import BaseMiddleware
+from aiogram.types import Message, CallbackQuery
+from typing import Callable, Dict, Any, Awaitable, List, Optional, Union
+from contextvars import ContextVar
+from sqlalchemy import event
+from app.database.async_session import get_async_session
+from app.database.connection import engine
+from loguru import logger
+
+
+# Счетчик запросов к БД текущего обновления
+_update_queries: ContextVar[Optional[List[int]]] = ContextVar("update_db_queries", default=None)
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    """Учесть запрос в счетчике текущего обновления"""
+    counter = _update_queries.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+class DatabaseSessionMiddleware(BaseMiddleware):
+    """
+    Одна сессия БД на обновление (unit of work)
+    
+    Сессия передается в обработчики как session и используется
+    UserRegistrationMiddleware при регистрации пользователя, поэтому
+    обработчики не открывают свои сессии.
+    Соединение берется из пула только при первом запросе. Количество запросов
+    к БД считается для каждого обновления.
+    """
+    
+    # Последняя корзина гистограммы - "и больше"
+    MAX_BUCKET = 5
+    
+    def __init__(self):
+        self._query_buckets = [0] * (self.MAX_BUCKET + 1)
+        self._stats = {"updates": 0, "queries": 0, "max_queries": 0}
+    
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Union[Message, CallbackQuery],
+        data: Dict[str, Any]
+    ) -> Any:
+        """Обработка события в одной сессии БД"""
+        counter = [0]
+        token = _update_queries.set(counter)
+        try:
+            async with get_async_session() as session:
+                data["session"] = session
+                return await handler(event, data)
+        finally:
+            _update_queries.reset(token)
+            self._observe(counter[0])
+            logger.debug("Update from user {} made {} DB queries", event.from_user.id, counter[0])
+    
+    def _observe(self, queries: int):
+        """Учесть количество запросов обновления"""
+        self._query_buckets[min(queries, self.MAX_BUCKET)] += 1
+        self._stats["updates"] += 1
+        self._stats["queries"] += queries
+        self._stats["max_queries"] = max(self._stats["max_queries"], queries)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Получить статистику запросов к БД на обновление
+        
+        Returns:
+            Dict со средним и максимальным числом запросов и распределением по количеству
+        """
+        stats: Dict[str, Any] = dict(self._stats)
+        stats["avg_queries"] = round(stats["queries"] / stats["updates"], 2) if stats["updates"] else 0.0
+        stats["queries_per_update"] = {
+            (f"{count}+" if count == self.MAX_BUCKET else str(count)): updates
+            for count, updates in enumerate(self._query_buckets)
+        }
+        return stats
+
+
+# Глобальный экземпляр
+db_session_middleware = DatabaseSessionMiddleware()
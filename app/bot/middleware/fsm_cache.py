@@ -0,0 +1,32 @@
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from typing import Callable, Dict, Any, Awaitable
+from app.bot.storage import RedisFSMStorage
+
+
+class FSMCacheScopeMiddleware(BaseMiddleware):
+    """
+    Кеш чтений FSM на время одного обновления
+    
+    Регистрируется после очереди пользователя и до FSMContextMiddleware
+    диспетчера, поэтому кеш начинается уже после завершения предыдущего
+    обновления этого пользователя, покрывает и чтение raw_state, и не
+    переживает текущее: следующее обновление (в любом процессе) читает
+    состояние из Redis заново.
+    """
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        """Обработка обновления с кешем чтений FSM"""
+        # fsm_storage появляется в data только после FSMContextMiddleware;
+        # кеш читает только RedisFSMStorage, остальным хранилищам он не мешает
+        with RedisFSMStorage.update_scope():
+            return await handler(event, data)
+
+
+# Глобальный экземпляр
+fsm_cache_scope = FSMCacheScopeMiddleware()
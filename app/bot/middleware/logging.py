@@ -2,10 +2,30 @@ from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery
 from loguru import logger
 from typing import Callable, Dict, Any, Awaitable, Union
+import os
+from app.config import settings
+from app.utils.logging_setup import sampled
+
+
+def _get_settings():
+    """Получить настройки в зависимости от окружения"""
+    if os.getenv("RAILWAY_ENVIRONMENT") or os.getenv("RAILWAY_PROJECT_ID"):
+        from app import config_prod
+        return config_prod.settings
+    return settings
 
 
 class LoggingMiddleware(BaseMiddleware):
-    """Middleware для логирования действий пользователей"""
+    """
+    Middleware для логирования действий пользователей
+    
+    Действия пишутся в лог выборочно (доля LOG_UPDATE_SAMPLE_RATE), ошибки -
+    всегда. Аргументы передаются отдельно от шаблона, поэтому строка
+    форматируется только если запись действительно попадает в лог.
+    """
+    
+    def __init__(self):
+        self.sample_rate = _get_settings().log_update_sample_rate
     
     async def __call__(
         self,
@@ -16,44 +36,44 @@ class LoggingMiddleware(BaseMiddleware):
         """Обработка события с логированием"""
         
         user_id = event.from_user.id
-        username = event.from_user.username or "Unknown"
-        first_name = event.from_user.first_name or "Unknown"
+        
+        if sampled(self.sample_rate):
+            self._log_event(event)
+        
+        try:
+            # Выполняем обработчик
+            result = await handler(event, data)
+            logger.debug("Handler completed successfully for user {}", user_id)
+            return result
+            
+        except Exception as e:
+            # Логируем ошибки
+            logger.opt(exception=e).error(
+                "Error processing event for user {} ({}): {}",
+                user_id, event.from_user.username or "Unknown", e
+            )
+            raise
+    
+    @staticmethod
+    def _log_event(event: Union[Message, CallbackQuery]):
+        """Записать действие пользователя"""
+        user = event.from_user
+        username = user.username or "Unknown"
+        first_name = user.first_name or "Unknown"
         
         if isinstance(event, Message):
             # Логируем сообщения
             if event.text:
-                logger.info(
-                    f"User {user_id} ({username}, {first_name}) sent message: {event.text[:100]}"
-                )
+                logger.info("User {} ({}, {}) sent message: {}", user.id, username, first_name, event.text[:100])
             elif event.photo:
-                logger.info(
-                    f"User {user_id} ({username}, {first_name}) sent photo"
-                )
+                logger.info("User {} ({}, {}) sent photo", user.id, username, first_name)
             elif event.document:
                 logger.info(
-                    f"User {user_id} ({username}, {first_name}) sent document: {event.document.file_name}"
+                    "User {} ({}, {}) sent document: {}", user.id, username, first_name, event.document.file_name
                 )
             else:
-                logger.info(
-                    f"User {user_id} ({username}, {first_name}) sent {event.content_type}"
-                )
+                logger.info("User {} ({}, {}) sent {}", user.id, username, first_name, event.content_type)
         
         elif isinstance(event, CallbackQuery):
             # Логируем нажатия кнопок
-            logger.info(
-                f"User {user_id} ({username}, {first_name}) pressed button: {event.data}"
-            )
-        
-        try:
-            # Выполняем обработчик
-            result = await handler(event, data)
-            logger.debug(f"Handler completed successfully for user {user_id}")
-            return result
-            
-        except Exception as e:
-            # Логируем ошибки
-            logger.error(
-                f"Error processing event for user {user_id} ({username}): {e}",
-                exc_info=True
-            )
-            raise
+            logger.info("User {} ({}, {}) pressed button: {}", user.id, username, first_name, event.data)
@@ -0,0 +1,47 @@
+from aiogram import BaseMiddleware
+from aiogram.types import Message, CallbackQuery
+from typing import Callable, Dict, Any, Awaitable, Union
+import time
+from app.services.loop_monitor import current_operation
+from app.utils.metrics import metrics
+
+
+handler_latency = metrics.histogram(
+    "telegram_handler_duration_seconds", "Update handling time per handler", ("handler", "result")
+)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Время обработки обновлений по обработчикам
+    
+    Регистрируется первым, поэтому время включает остальные middleware
+    (сессию БД, регистрацию пользователя). Метка handler - имя функции
+    обработчика; она же указывается как операция для блокирующих вызовов
+    в мониторе event loop.
+    """
+    
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Union[Message, CallbackQuery],
+        data: Dict[str, Any]
+    ) -> Any:
+        """Обработка события с измерением времени"""
+        handler_object = data.get("handler")
+        name = getattr(handler_object.callback, "__name__", "unknown") if handler_object else "unknown"
+        
+        token = current_operation.set(f"handler:{name}")
+        started = time.perf_counter()
+        result = "error"
+        try:
+            response = await handler(event, data)
+            result = "ok"
+            return response
+        finally:
+            handler_latency.observe(time.perf_counter() - started, name, result)
+            current_operation.reset(token)
+
+
+# Глобальный экземпляр
+handler_metrics = HandlerMetricsMiddleware()
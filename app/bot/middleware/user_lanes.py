@@ -0,0 +1,168 @@
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.types import TelegramObject, Update
+from typing import Callable, Dict, Any, Awaitable, Optional
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+import asyncio
+import os
+import time
+from app.config import settings
+from loguru import logger
+
+
+# Границы гистограммы ожидания в очереди пользователя (секунды)
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+# Очередь, которую уже занимает текущая задача (чтобы не ждать саму себя)
+_held_lane: ContextVar[Optional[int]] = ContextVar("held_user_lane", default=None)
+
+
+def _get_settings():
+    """Получить настройки в зависимости от окружения"""
+    if os.getenv("RAILWAY_ENVIRONMENT") or os.getenv("RAILWAY_PROJECT_ID"):
+        from app import config_prod
+        return config_prod.settings
+    return settings
+
+
+class _Lane:
+    """Очередь обновлений одного пользователя"""
+    
+    __slots__ = ("tail", "entries")
+    
+    def __init__(self):
+        # Future последнего вставшего в очередь обновления
+        self.tail: Optional[asyncio.Future] = None
+        self.entries = 0
+
+
+class UserLaneMiddleware(BaseMiddleware):
+    """
+    Последовательная обработка обновлений одного пользователя
+    
+    Обновления разных пользователей обрабатываются параллельно, а обновления
+    одного пользователя - строго по очереди, поэтому фото, отправленное сразу
+    после команды, обрабатывается уже после установки состояния FSM.
+    Очередь удаляется, как только в ней не остается обновлений. Если
+    предыдущее обновление обрабатывается дольше wait_timeout, следующее
+    выполняется, не дожидаясь его.
+    """
+    
+    def __init__(self):
+        self.wait_timeout = _get_settings().user_lane_wait_timeout
+        self._lanes: Dict[int, _Lane] = {}
+        self._wait_buckets = [0] * (len(WAIT_BUCKETS) + 1)
+        self._stats = {
+            "updates": 0,
+            "serialized": 0,
+            "waiting": 0,
+            "timeouts": 0,
+            "lanes_peak": 0,
+            "lanes_collected": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+        }
+    
+    @staticmethod
+    def lane_key(update: Update) -> Optional[int]:
+        """Ключ очереди: пользователь, а для событий без пользователя - чат"""
+        chat, user, _ = UserContextMiddleware.resolve_event_context(event=update)
+        if user is not None:
+            return user.id
+        if chat is not None:
+            return chat.id
+        return None
+    
+    @asynccontextmanager
+    async def lane(self, key: Optional[int]):
+        """Выполнить блок в очереди пользователя"""
+        if key is None or _held_lane.get() == key:
+            yield
+            return
+        
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane()
+            self._stats["lanes_peak"] = max(self._stats["lanes_peak"], len(self._lanes))
+        lane.entries += 1
+        
+        previous = lane.tail
+        done = asyncio.get_running_loop().create_future()
+        lane.tail = done
+        
+        started = time.monotonic()
+        self._stats["updates"] += 1
+        try:
+            if previous is not None and not previous.done():
+                self._stats["serialized"] += 1
+                self._stats["waiting"] += 1
+                try:
+                    # asyncio.wait не отменяет future предыдущего обновления
+                    await asyncio.wait({previous}, timeout=self.wait_timeout)
+                finally:
+                    self._stats["waiting"] -= 1
+                if not previous.done():
+                    self._stats["timeouts"] += 1
+                    logger.warning(f"Update of user {key} waited {self.wait_timeout}s in lane, running unordered")
+            self._observe_wait(time.monotonic() - started)
+            
+            token = _held_lane.set(key)
+            try:
+                yield
+            finally:
+                _held_lane.reset(token)
+        finally:
+            done.set_result(None)
+            lane.entries -= 1
+            if not lane.entries:
+                # Очередь без обновлений больше не нужна
+                del self._lanes[key]
+                self._stats["lanes_collected"] += 1
+    
+    def _observe_wait(self, wait: float):
+        """Учесть время ожидания в гистограмме"""
+        index = len(WAIT_BUCKETS)
+        for i, bound in enumerate(WAIT_BUCKETS):
+            if wait <= bound:
+                index = i
+                break
+        self._wait_buckets[index] += 1
+        self._stats["wait_time_total"] += wait
+        self._stats["wait_time_max"] = max(self._stats["wait_time_max"], wait)
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        """Обработка обновления в очереди пользователя"""
+        key = self.lane_key(event) if isinstance(event, Update) else None
+        async with self.lane(key):
+            return await handler(event, data)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Получить метрики очередей пользователей
+        
+        Returns:
+            Dict с числом активных очередей и гистограммой ожидания (накопительной, как в Prometheus)
+        """
+        stats: Dict[str, Any] = dict(self._stats)
+        stats["lanes"] = len(self._lanes)
+        stats["wait_time_avg"] = round(stats["wait_time_total"] / stats["updates"], 4) if stats["updates"] else 0.0
+        stats["wait_time_total"] = round(stats["wait_time_total"], 3)
+        stats["wait_time_max"] = round(stats["wait_time_max"], 3)
+        
+        histogram = {}
+        cumulative = 0
+        for bound, count in zip(WAIT_BUCKETS + (float("inf"),), self._wait_buckets):
+            cumulative += count
+            histogram["+Inf" if bound == float("inf") else str(bound)] = cumulative
+        stats["wait_histogram"] = histogram
+        return stats
+
+
+# Глобальный экземпляр
+user_lanes = UserLaneMiddleware()
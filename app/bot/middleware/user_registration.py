@@ -1,15 +1,104 @@
 from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery
-from typing import Callable, Dict, Any, Awaitable, Union
+from typing import Callable, Dict, Any, Awaitable, NamedTuple, Union, Optional
+import asyncio
+import os
+from app.config import settings
 from app.database.async_session import get_async_session
 from app.models.user import User
+from app.utils.cache import TTLCache
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from loguru import logger
 
 
+def _get_settings():
+    """Получить настройки в зависимости от окружения"""
+    if os.getenv("RAILWAY_ENVIRONMENT") or os.getenv("RAILWAY_PROJECT_ID"):
+        from app import config_prod
+        return config_prod.settings
+    return settings
+
+
+class UserRedisSync:
+    """
+    Отложенная синхронизация базовых данных пользователей в Redis
+    
+    Изменения накапливаются и записываются одним pipeline раз в
+    flush_interval секунд; несколько обновлений одного пользователя
+    за интервал схлопываются в одну запись.
+    """
+    
+    def __init__(self, flush_interval: float = 1.0):
+        self.flush_interval = flush_interval
+        self._pending: Dict[int, dict] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+    
+    def schedule(self, user: User):
+        """Поставить пользователя в очередь на запись в Redis"""
+        self._pending[user.telegram_id] = {
+            "telegram_id": user.telegram_id,
+            "username": user.username,
+            "first_name": user.first_name,
+            "subscription_type": user.subscription_type.value if user.subscription_type else "free",
+        }
+        
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+    
+    async def _flush_later(self):
+        """Подождать интервал и записать накопленные изменения"""
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+    
+    async def flush(self):
+        """Записать накопленные изменения в Redis (НЕ перезаписывая существующие поля)"""
+        if not self._pending:
+            return
+        
+        pending, self._pending = self._pending, {}
+        try:
+            from app.services.redis_service import redis_service
+            await redis_service.set_users_fields_if_missing(pending)
+            logger.debug(f"Synced {len(pending)} users to Redis")
+        except Exception as e:
+            logger.error(f"Failed to sync {len(pending)} users to Redis: {e}")
+            # Не прерываем работу, если Redis недоступен
+
+
+class KnownUser(NamedTuple):
+    """Неизменяемые данные известного пользователя (id None - пользователь не сохранен в БД)"""
+    
+    id: Optional[int]
+    username: Optional[str]
+    first_name: Optional[str]
+    last_name: Optional[str]
+    
+    @classmethod
+    def from_user(cls, user: User) -> "KnownUser":
+        return cls(user.id, user.username, user.first_name, user.last_name)
+
+
+_current_settings = _get_settings()
+
+# Общий кеш известных пользователей (telegram_id -> KnownUser) для всех экземпляров middleware.
+# ORM объекты не кешируются: счетчики и подписка меняются в других сессиях и процессах.
+user_cache = TTLCache(
+    max_size=_current_settings.user_cache_size,
+    ttl=_current_settings.user_cache_ttl
+)
+user_redis_sync = UserRedisSync(flush_interval=_current_settings.user_redis_flush_interval)
+
+
 class UserRegistrationMiddleware(BaseMiddleware):
-    """Middleware для автоматической регистрации пользователей"""
+    """
+    Middleware для автоматической регистрации пользователей
+    
+    Обработчики получают known_user (KnownUser): id строки пользователя и
+    данные профиля. Для известного пользователя с неизменившимся профилем
+    БД не запрашивается; обработчики, которым нужны счетчики или подписка,
+    загружают строку сами по known_user.id в сессии обновления.
+    """
     
     async def __call__(
         self,
@@ -19,35 +108,48 @@ class UserRegistrationMiddleware(BaseMiddleware):
     ) -> Any:
         """Обработка события с проверкой регистрации пользователя"""
         
-        user_id = event.from_user.id
+        telegram_user = event.from_user
         
-        try:
-            # Получаем сессию БД
-            async with get_async_session() as session:
-                # Проверяем, зарегистрирован ли пользователь
-                user = await self.get_or_create_user(session, event.from_user)
-                
-                # Добавляем пользователя в данные для обработчиков
-                data["user"] = user
-        except Exception as e:
-            logger.error(f"❌ Database error in user registration middleware: {e}")
-            # Создаем фиктивного пользователя для продолжения работы
-            from app.models.user import User
-            user = User(
-                telegram_id=event.from_user.id,
-                username=event.from_user.username,
-                first_name=event.from_user.first_name,
-                last_name=event.from_user.last_name
-            )
-            data["user"] = user
-            logger.warning("⚠️ Using fallback user object without database")
+        known_user = user_cache.get(telegram_user.id)
+        if known_user is None or self.profile_changed(known_user, telegram_user):
+            # Сессия обновления (DatabaseSessionMiddleware) или отдельная
+            session = data.get("session")
+            try:
+                if session is not None:
+                    user = await self.get_or_create_user(session, telegram_user)
+                else:
+                    async with get_async_session() as own_session:
+                        user = await self.get_or_create_user(own_session, telegram_user)
+                known_user = KnownUser.from_user(user)
+                user_cache.set(telegram_user.id, known_user)
+            except Exception as e:
+                logger.error(f"❌ Database error in user registration middleware: {e}")
+                if session is not None:
+                    await session.rollback()
+                # Фиктивный пользователь для продолжения работы (без id, не кешируется)
+                known_user = KnownUser(
+                    None, telegram_user.username, telegram_user.first_name, telegram_user.last_name
+                )
+                logger.warning("⚠️ Using fallback user object without database")
+        
+        # Добавляем пользователя в данные для обработчиков
+        data["known_user"] = known_user
         
         # Выполняем обработчик
         return await handler(event, data)
     
+    @staticmethod
+    def profile_changed(user: Union[User, KnownUser], telegram_user) -> bool:
+        """Проверить, отличаются ли данные Telegram от сохраненных"""
+        return (
+            user.username != telegram_user.username
+            or user.first_name != telegram_user.first_name
+            or user.last_name != telegram_user.last_name
+        )
+    
     async def get_or_create_user(
-        self, 
-        session: AsyncSession, 
+        self,
+        session: AsyncSession,
         telegram_user
     ) -> User:
         """Получить или создать пользователя"""
@@ -59,15 +161,16 @@ class UserRegistrationMiddleware(BaseMiddleware):
         user = result.scalar_one_or_none()
         
         if user:
-            # Пользователь найден, обновляем данные
-            user.username = telegram_user.username
-            user.first_name = telegram_user.first_name
-            user.last_name = telegram_user.last_name
-            await session.commit()
-            logger.info(f"User {telegram_user.id} updated in database")
+            # Пользователь найден, обновляем данные только если они изменились
+            if self.profile_changed(user, telegram_user):
+                user.username = telegram_user.username
+                user.first_name = telegram_user.first_name
+                user.last_name = telegram_user.last_name
+                await session.commit()
+                logger.info(f"User {telegram_user.id} updated in database")
             
-            # Обновляем данные в Redis
-            await self.save_user_to_redis(telegram_user.id, user)
+            # Обновляем данные в Redis (отложенно)
+            user_redis_sync.schedule(user)
             
             return user
         
@@ -85,34 +188,7 @@ class UserRegistrationMiddleware(BaseMiddleware):
         
         logger.info(f"New user {telegram_user.id} registered in database")
         
-        # Сохраняем/обновляем базовые данные в Redis
-        await self.save_user_to_redis(telegram_user.id, user)
+        # Сохраняем базовые данные в Redis (отложенно)
+        user_redis_sync.schedule(user)
         
         return user
-    
-    async def save_user_to_redis(self, telegram_user_id: int, user: User):
-        """Сохранить данные пользователя в Redis (НЕ перезаписывая существующие)"""
-        try:
-            from app.services.redis_service import redis_service
-            
-            # Получаем существующие данные из Redis
-            existing_data = await redis_service.get_user_data(telegram_user_id) or {}
-            logger.info(f"Existing Redis data for user {telegram_user_id}: {existing_data}")
-            
-            # Обновляем только базовые поля, сохраняя URL фото и другие данные
-            updated_data = {
-                "telegram_id": user.telegram_id,
-                "username": user.username,
-                "first_name": user.first_name,
-                "subscription_type": user.subscription_type.value if user.subscription_type else "free",
-            }
-            
-            # Объединяем существующие данные с новыми (существующие имеют приоритет)
-            final_data = {**updated_data, **existing_data}
-            logger.info(f"Final Redis data for user {telegram_user_id}: {final_data}")
-            
-            await redis_service.set_user_data(telegram_user_id, final_data)
-            logger.info(f"User {telegram_user_id} data updated in Redis (preserving existing data)")
-        except Exception as e:
-            logger.error(f"Failed to save user {telegram_user_id} to Redis: {e}")
-            # Не прерываем работу, если Redis недоступен
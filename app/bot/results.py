@@ -0,0 +1,53 @@
+from typing import List, Optional, Union
+
+from aiogram import Bot
+from aiogram.types import InputMediaPhoto
+
+from app.utils.input_files import Base64InputFile
+
+
+ALBUM_SIZE = 10  # Максимум фото в альбоме Telegram
+
+
+def as_photo(output: str, filename: str) -> Union[str, Base64InputFile]:
+    """Подготовить результат к отправке: base64 декодируется порциями, URL передается как есть"""
+    if output.startswith("data:image/"):
+        return Base64InputFile(output, filename=filename)
+    return output
+
+
+async def send_result_photos(bot: Bot, chat_id: int, outputs: List[str], caption: Optional[str] = None):
+    """
+    Отправить результаты генерации
+    
+    Несколько результатов отправляются альбомами до ALBUM_SIZE фото
+    (подпись у первого фото), а не отдельными сообщениями; результаты
+    в виде data URI отправляются как файлы.
+    
+    Args:
+        bot: Бот для отправки
+        chat_id: Чат получателя
+        outputs: URL или data URI результатов
+        caption: Подпись к первому фото
+    """
+    for start in range(0, len(outputs), ALBUM_SIZE):
+        batch = outputs[start:start + ALBUM_SIZE]
+        batch_caption = caption if start == 0 else None
+        
+        if len(batch) == 1:
+            # Альбом должен содержать минимум 2 фото
+            await bot.send_photo(
+                chat_id=chat_id,
+                photo=as_photo(batch[0], f"result_{start + 1}.png"),
+                caption=batch_caption
+            )
+            continue
+        
+        media = [
+            InputMediaPhoto(
+                media=as_photo(output, f"result_{start + i}.png"),
+                caption=batch_caption if i == 1 else None
+            )
+            for i, output in enumerate(batch, 1)
+        ]
+        await bot.send_media_group(chat_id=chat_id, media=media)
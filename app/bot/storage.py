@@ -0,0 +1,147 @@
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from loguru import logger
+
+from app.services.redis_service import RedisService, redis_service
+
+
+# Кеш чтений текущего обновления: key -> (state, data); None - вне обновления
+_update_cache: ContextVar[Optional[Dict[str, Tuple[Optional[str], Dict[str, Any]]]]] = ContextVar(
+    "fsm_update_cache", default=None
+)
+
+
+class RedisFSMStorage(BaseStorage):
+    """
+    FSM хранилище в Redis с кешем чтения на время обновления
+    
+    Состояние и данные хранятся в Redis через общее подключение RedisService,
+    поэтому несколько процессов бота видят одно и то же состояние пользователя.
+    Состояние и данные читаются и пишутся одним pipeline запросом. Внутри
+    update_scope() прочитанное значение кешируется до конца обновления;
+    между обновлениями кеш не живет, поэтому состояние, установленное другим
+    процессом, видно сразу.
+    """
+    
+    def __init__(
+        self,
+        redis: RedisService = redis_service,
+        prefix: str = "fsm",
+        state_ttl: Optional[int] = None
+    ):
+        """
+        Args:
+            redis: Сервис Redis с общим подключением
+            prefix: Префикс ключей в Redis
+            state_ttl: Время жизни ключей в Redis (None = постоянно)
+        """
+        self.redis = redis
+        self.prefix = prefix
+        self.state_ttl = state_ttl
+        self._stats = {"hits": 0, "misses": 0}
+    
+    @staticmethod
+    @contextmanager
+    def update_scope() -> Iterator[None]:
+        """Кешировать чтения до конца блока (обработки одного обновления)"""
+        token = _update_cache.set({})
+        try:
+            yield
+        finally:
+            _update_cache.reset(token)
+    
+    def _build_key(self, key: StorageKey) -> str:
+        """Собрать базовый ключ Redis для пользователя"""
+        return f"{self.prefix}:{key.bot_id}:{key.chat_id}:{key.user_id}:{key.destiny}"
+    
+    async def _load(self, key: StorageKey) -> Tuple[Optional[str], Dict[str, Any]]:
+        """Загрузить состояние и данные (кеш, затем Redis одним запросом)"""
+        redis_key = self._build_key(key)
+        cache = _update_cache.get()
+        if cache is not None and redis_key in cache:
+            self._stats["hits"] += 1
+            return cache[redis_key]
+        self._stats["misses"] += 1
+        
+        state, raw_data = await self.redis.mget([f"{redis_key}:state", f"{redis_key}:data"])
+        
+        data: Dict[str, Any] = {}
+        if raw_data:
+            try:
+                data = json.loads(raw_data)
+            except json.JSONDecodeError:
+                logger.warning(f"Invalid FSM data in Redis for {redis_key}")
+        
+        if cache is not None:
+            cache[redis_key] = (state, data)
+        return state, data
+    
+    async def _store(self, key: StorageKey, **parts: Any):
+        """
+        Записать переданные части (state и/или data) в Redis одним pipeline
+        
+        Пишутся только переданные части, чтобы не перезаписать изменения,
+        сделанные другим процессом.
+        """
+        redis_key = self._build_key(key)
+        
+        async with self.redis.pipeline() as pipe:
+            if "state" in parts:
+                if parts["state"] is None:
+                    pipe.delete(f"{redis_key}:state")
+                else:
+                    pipe.set(f"{redis_key}:state", parts["state"], ex=self.state_ttl)
+            
+            if "data" in parts:
+                if not parts["data"]:
+                    pipe.delete(f"{redis_key}:data")
+                else:
+                    pipe.set(f"{redis_key}:data", json.dumps(parts["data"]), ex=self.state_ttl)
+        
+        cache = _update_cache.get()
+        if cache is None:
+            return
+        if "state" in parts and "data" in parts:
+            cache[redis_key] = (parts["state"], parts["data"])
+        elif redis_key in cache:
+            state, data = cache[redis_key]
+            cache[redis_key] = (parts.get("state", state), parts.get("data", data))
+    
+    @staticmethod
+    def _state_name(state: StateType) -> Optional[str]:
+        """Привести состояние к строке"""
+        return state.state if isinstance(state, State) else state
+    
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        """Установить состояние"""
+        await self._store(key, state=self._state_name(state))
+    
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        """Получить состояние"""
+        state, _ = await self._load(key)
+        return state
+    
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        """Установить данные"""
+        await self._store(key, data=data.copy())
+    
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        """Получить данные"""
+        _, data = await self._load(key)
+        return data.copy()
+    
+    async def set_state_and_data(self, key: StorageKey, state: StateType, data: Dict[str, Any]) -> None:
+        """Установить состояние и данные одним запросом"""
+        await self._store(key, state=self._state_name(state), data=data.copy())
+    
+    def get_cache_stats(self) -> Dict[str, int]:
+        """Получить статистику кеша чтений"""
+        return dict(self._stats)
+    
+    async def close(self) -> None:
+        """Подключением к Redis владеет RedisService - закрывать нечего"""
@@ -0,0 +1,195 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import time
+from typing import Any, Dict, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
+from loguru import logger
+
+from app.config import settings
+from app.bot.middleware import UserLaneMiddleware, user_lanes
+from app.bot.webhook_handlers import webhook_latency
+
+
+class TelegramWebhook:
+    """
+    Прием обновлений Telegram через webhook на FastAPI приложении
+    
+    Telegram отправляет обновления на TELEGRAM_WEBHOOK_URL с секретным
+    заголовком X-Telegram-Bot-Api-Secret-Token. Обновление передается в
+    Dispatcher в фоне, а Telegram сразу получает ответ, поэтому несколько
+    реплик за балансировщиком обрабатывают обновления параллельно.
+    Одновременно обрабатывается не больше telegram_update_concurrency
+    обновлений; при переполнении очереди возвращается 503 и Telegram
+    повторит доставку позже.
+    """
+    
+    PATH = "/webhook/telegram"
+    SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+    
+    def __init__(self):
+        # Определяем, какая конфигурация использовать
+        if os.getenv("RAILWAY_ENVIRONMENT") or os.getenv("RAILWAY_PROJECT_ID"):
+            from app import config_prod
+            self.settings = config_prod.settings
+        else:
+            self.settings = settings
+        
+        self.url = self.settings.telegram_webhook_url
+        # Без явного секрета используем производный от токена (одинаковый на всех репликах)
+        self.secret = self.settings.telegram_webhook_secret or hashlib.sha256(
+            f"telegram-webhook:{self.settings.bot_token}".encode()
+        ).hexdigest()
+        self.max_connections = self.settings.telegram_webhook_max_connections
+        self.concurrency = self.settings.telegram_update_concurrency
+        self.max_pending = self.settings.telegram_update_max_pending
+        
+        self.bot: Optional[Bot] = None
+        self.dp: Optional[Dispatcher] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._stats = {
+            "received": 0,
+            "processed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "unauthorized": 0,
+            "pending_peak": 0,
+            "processing_time_total": 0.0,
+            "processing_time_max": 0.0,
+        }
+    
+    @property
+    def enabled(self) -> bool:
+        """Включен ли режим webhook (иначе бот работает через long polling)"""
+        return bool(self.url)
+    
+    async def start(self):
+        """Запустить бота и зарегистрировать webhook в Telegram"""
+        from app.bot.bot import startup_bot
+        
+        self.bot, self.dp = await startup_bot()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        
+        # Каждая реплика устанавливает одинаковый webhook - повторный вызов безопасен
+        await self.bot.set_webhook(
+            url=self.url,
+            secret_token=self.secret,
+            max_connections=self.max_connections,
+            allowed_updates=self.dp.resolve_used_update_types(),
+        )
+        logger.info(
+            f"✅ Telegram webhook set to {self.url} "
+            f"(concurrency={self.concurrency}, max_connections={self.max_connections})"
+        )
+    
+    async def stop(self, timeout: float = 10.0):
+        """Дождаться обработки принятых обновлений и остановить бота"""
+        from app.bot.bot import shutdown_bot
+        
+        if self._tasks:
+            logger.info(f"Waiting for {len(self._tasks)} Telegram updates to finish...")
+            await asyncio.wait(self._tasks, timeout=timeout)
+        for task in self._tasks:
+            task.cancel()
+        # Webhook не удаляем - его продолжают обслуживать другие реплики
+        await shutdown_bot()
+    
+    async def handle(self, request: Request) -> JSONResponse:
+        """
+        Принять обновление от Telegram
+        
+        Args:
+            request: FastAPI Request объект
+        
+        Returns:
+            JSONResponse: 200 - обновление принято, 503 - очередь переполнена
+        """
+        token = request.headers.get(self.SECRET_HEADER, "")
+        if not hmac.compare_digest(token, self.secret):
+            self._stats["unauthorized"] += 1
+            raise HTTPException(status_code=403, detail="Invalid secret token")
+        
+        if self.bot is None or self.dp is None:
+            raise HTTPException(status_code=503, detail="Bot is not started")
+        
+        if len(self._tasks) >= self.max_pending:
+            # Telegram повторит доставку позже
+            self._stats["rejected"] += 1
+            logger.warning(f"Telegram update queue is full ({len(self._tasks)}), rejecting update")
+            return JSONResponse(status_code=503, content={"status": "busy"})
+        
+        update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        self._stats["received"] += 1
+        
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self._stats["pending_peak"] = max(self._stats["pending_peak"], len(self._tasks))
+        
+        return JSONResponse(status_code=200, content={"status": "ok"})
+    
+    async def _process(self, update: Update):
+        """Обработать обновление с ограничением параллельности"""
+        # Очередь пользователя занимается до слота обработки, чтобы ожидающие
+        # обновления одного пользователя не занимали слоты других
+        async with user_lanes.lane(UserLaneMiddleware.lane_key(update)):
+            async with self._semaphore:
+                started = time.monotonic()
+                result = "processed"
+                try:
+                    await self.dp.feed_update(self.bot, update)
+                    self._stats["processed"] += 1
+                except Exception as e:
+                    result = "failed"
+                    self._stats["failed"] += 1
+                    logger.error(f"Error processing Telegram update {update.update_id}: {e}")
+                finally:
+                    elapsed = time.monotonic() - started
+                    webhook_latency.observe(elapsed, "telegram", result)
+                    self._stats["processing_time_total"] += elapsed
+                    self._stats["processing_time_max"] = max(self._stats["processing_time_max"], elapsed)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Получить счетчики обработки обновлений
+        
+        Returns:
+            Dict с количеством принятых, обработанных и отклоненных обновлений
+        """
+        stats: Dict[str, Any] = dict(self._stats)
+        finished = stats["processed"] + stats["failed"]
+        stats["processing_time_avg"] = round(stats["processing_time_total"] / finished, 3) if finished else 0.0
+        stats["processing_time_max"] = round(stats["processing_time_max"], 3)
+        del stats["processing_time_total"]
+        stats["pending"] = len(self._tasks)
+        stats["enabled"] = self.enabled
+        return stats
+
+
+# Глобальный экземпляр
+telegram_webhook = TelegramWebhook()
+
+
+def setup_telegram_routes(app: FastAPI):
+    """Настраивает маршруты для webhook'а Telegram"""
+    
+    @app.post(TelegramWebhook.PATH)
+    async def telegram_webhook_endpoint(request: Request):
+        """Endpoint для обновлений Telegram"""
+        return await telegram_webhook.handle(request)
+    
+    @app.get(f"{TelegramWebhook.PATH}/health")
+    async def telegram_webhook_health():
+        """Health check для webhook'а Telegram"""
+        return {
+            "status": "ok",
+            "service": "telegram_webhook",
+            "updates": telegram_webhook.get_stats(),
+            "user_lanes": user_lanes.get_stats()
+        }
@@ -5,9 +5,25 @@ import json
 from loguru import logger
 from app.services.fashn_service import fashn_service
 from app.services.redis_service import redis_service
-from aiogram import Bot
+from app.services.cloudinary_executor import cloudinary_executor
+from app.utils.image_processing import image_processor
+from app.services.fashn_rate_limiter import fashn_governor
+from app.services.prediction_reconciler import prediction_reconciler, TERMINAL_STATUSES
+from app.services.tryon_cache import tryon_cache
+from app.services.tryon_singleflight import tryon_singleflight
+from app.services.fashn_webhook_stream import fashn_webhook_stream
+from app.utils.input_files import Base64InputFile
+from app.services.telegram_sender import telegram_sender, RESULT
+from app.bot.results import send_result_photos
 import os
+import time
 from app.config import settings
+from app.utils.metrics import metrics
+
+
+webhook_latency = metrics.histogram(
+    "webhook_processing_duration_seconds", "Webhook processing time", ("source", "result")
+)
 
 
 class WebhookHandler:
@@ -20,13 +36,28 @@ class WebhookHandler:
             self.settings = config_prod.settings
         else:
             self.settings = settings
-            
-        self.bot = Bot(token=self.settings.bot_token)
+    
+    async def start(self):
+        """Запустить фоновую доставку результатов (потребители webhook'ов и опрос статуса)"""
+        try:
+            await fashn_webhook_stream.start(self.deliver_prediction)
+        except Exception as e:
+            # Без Redis webhook'и обрабатываются сразу в endpoint
+            logger.error(f"❌ Failed to start Fashn webhook consumers: {e}")
+        await prediction_reconciler.start(self.deliver_prediction)
+    
+    async def stop(self):
+        """Остановить фоновую доставку результатов"""
+        await prediction_reconciler.stop()
+        await fashn_webhook_stream.stop()
     
     async def handle_fashn_webhook(self, request: Request) -> JSONResponse:
         """
         Обрабатывает webhook от Fashn AI
         
+        Webhook сохраняется в Redis Stream, а результат доставляется
+        потребителями асинхронно, поэтому Fashn получает ответ сразу.
+        
         Args:
             request: FastAPI Request объект
             
@@ -34,41 +65,32 @@ class WebhookHandler:
             JSONResponse: Ответ для Fashn AI
         """
         try:
-            # Получаем данные webhook
-            webhook_data = await request.json()
-            logger.info(f"Received Fashn webhook: {webhook_data}")
+            # Получаем данные webhook (тело разбирается один раз и сохраняется как есть)
+            body = await request.body()
+            webhook_data = json.loads(body)
             
-            # Извлекаем prediction ID
-            prediction_id = webhook_data.get("id")
-            if not prediction_id:
+            # Извлекаем prediction ID (тело может быть не объектом - тогда это ошибка клиента)
+            if not isinstance(webhook_data, dict) or not webhook_data.get("id"):
                 logger.error("No prediction ID in webhook data")
                 return JSONResponse({"error": "No prediction ID"}, status_code=400)
             
-            # Получаем контекст пользователя из Redis
-            user_context = await redis_service.get_json(f"fashn_prediction:{prediction_id}")
-            if not user_context:
-                logger.warning(f"No user context found for prediction {prediction_id}")
-                return JSONResponse({"error": "No user context"}, status_code=404)
+            logger.info(f"Received Fashn webhook: {webhook_data.get('id')}, status: {webhook_data.get('status')}")
             
-            user_id = user_context.get("user_id")
-            if not user_id:
-                logger.error(f"No user_id in context for prediction {prediction_id}")
-                return JSONResponse({"error": "No user_id in context"}, status_code=400)
-            
-            # Обрабатываем webhook через FashnService
-            success, message = await fashn_service.process_webhook_callback(webhook_data)
+            try:
+                message_id = await fashn_webhook_stream.publish(webhook_data, raw_payload=body)
+                return JSONResponse({"status": "accepted", "message_id": message_id}, status_code=202)
+            except Exception as e:
+                # Redis недоступен - обрабатываем webhook сразу, как раньше
+                logger.warning(f"Failed to queue Fashn webhook, processing inline: {e}")
             
-            if success:
-                # Отправляем результат пользователю
-                await self._send_result_to_user(user_id, webhook_data, message)
-            else:
-                # Отправляем ошибку пользователю
-                await self._send_error_to_user(user_id, message)
+            result = await self.deliver_prediction(webhook_data)
             
-            # Очищаем контекст из Redis
-            await redis_service.delete(f"fashn_prediction:{prediction_id}")
+            if result == "no_context":
+                return JSONResponse({"error": "No user context"}, status_code=404)
+            if result == "no_user":
+                return JSONResponse({"error": "No user_id in context"}, status_code=400)
             
-            return JSONResponse({"status": "processed"})
+            return JSONResponse({"status": result})
             
         except json.JSONDecodeError:
             logger.error("Invalid JSON in webhook data")
@@ -77,79 +99,135 @@ class WebhookHandler:
             logger.error(f"Error processing Fashn webhook: {e}")
             return JSONResponse({"error": "Internal server error"}, status_code=500)
     
-    async def _send_result_to_user(self, user_id: int, webhook_data: Dict[str, Any], message: str):
-        """Отправляет результат пользователю"""
-        try:
-            output_urls = webhook_data.get("output", [])
+    async def deliver_prediction(self, prediction_data: Dict[str, Any]) -> str:
+        """
+        Доставляет результат генерации пользователю (webhook или опрос статуса)
+        
+        Args:
+            prediction_data: Данные генерации в формате webhook Fashn AI
             
-            if output_urls:
-                # Проверяем, является ли первый результат base64
-                first_output = output_urls[0]
-                if first_output.startswith("data:image/"):
-                    # Это base64 - конвертируем в файл
-                    import base64
-                    import io
-                    from aiogram.types import BufferedInputFile
-                    
-                    # Извлекаем base64 данные
-                    header, data = first_output.split(",", 1)
-                    image_data = base64.b64decode(data)
-                    
-                    # Создаем BufferedInputFile
-                    photo_file = BufferedInputFile(image_data, filename="result.png")
-                    
-                    await self.bot.send_photo(
-                        chat_id=user_id,
-                        photo=photo_file,
-                        caption=f"🎉 <b>Генерация завершена!</b>\n\n{message}"
-                    )
-                else:
-                    # Это URL - отправляем как обычно
-                    await self.bot.send_photo(
+        Returns:
+            str: processed, duplicate, in_progress, pending, no_context или no_user
+        """
+        started = time.perf_counter()
+        result = "failed"
+        try:
+            result = await self._deliver_prediction(prediction_data)
+            return result
+        finally:
+            webhook_latency.observe(time.perf_counter() - started, "fashn", result)
+    
+    async def _deliver_prediction(self, prediction_data: Dict[str, Any]) -> str:
+        """Доставляет результат генерации (см. deliver_prediction)"""
+        prediction_id = prediction_data.get("id")
+        
+        # Получаем контекст пользователя из Redis
+        user_context = await redis_service.get_json(f"fashn_prediction:{prediction_id}")
+        if not user_context:
+            logger.warning(f"No user context found for prediction {prediction_id}")
+            return "no_context"
+        
+        user_id = user_context.get("user_id")
+        if not user_id:
+            logger.error(f"No user_id in context for prediction {prediction_id}")
+            return "no_user"
+        
+        # Промежуточные статусы не доставляем - результат придет позже
+        if prediction_data.get("status") not in TERMINAL_STATUSES:
+            logger.info(f"Prediction {prediction_id} is still {prediction_data.get('status')}")
+            return "pending"
+        
+        # Webhook и опрос статуса не должны доставить результат дважды
+        claim_state = await prediction_reconciler.claim(prediction_id)
+        if claim_state == "delivered":
+            logger.info(f"Prediction {prediction_id} already delivered, skipping")
+            return "duplicate"
+        if claim_state:
+            logger.info(f"Prediction {prediction_id} is being delivered elsewhere")
+            return "in_progress"
+        
+        try:
+            await self._deliver_claimed(prediction_id, prediction_data, user_context)
+        except Exception:
+            # Доставку можно будет повторить
+            await prediction_reconciler.release(prediction_id)
+            raise
+        
+        await prediction_reconciler.complete(prediction_id)
+        return "processed"
+    
+    async def _deliver_claimed(self, prediction_id: str, prediction_data: Dict[str, Any], user_context: Dict[str, Any]):
+        """Отправляет результат владельцу и ожидающим чатам, затем очищает контекст"""
+        user_id = user_context["user_id"]
+        
+        # Обрабатываем результат через FashnService
+        success, message = await fashn_service.process_webhook_callback(prediction_data, user_context)
+        
+        if success:
+            # Сохраняем результат в кеш для повторных запросов с теми же фото
+            try:
+                await tryon_cache.set(user_context.get("fingerprint"), prediction_data.get("output", []))
+            except Exception as e:
+                logger.warning(f"Failed to cache result for prediction {prediction_id}: {e}")
+        
+        # Одинаковые запросы, ожидавшие эту генерацию, получают тот же ответ
+        try:
+            subscribers = await tryon_singleflight.finish(user_context.get("flight_key"))
+        except Exception as e:
+            logger.warning(f"Failed to collect coalesced chats for prediction {prediction_id}: {e}")
+            subscribers = []
+        
+        for chat_id in [user_id] + [subscriber["chat_id"] for subscriber in subscribers]:
+            if success:
+                # Отправляем результат пользователю
+                await self._send_result_to_user(chat_id, prediction_data, message)
+            else:
+                # Отправляем ошибку пользователю
+                await self._send_error_to_user(chat_id, message)
+        
+        # Очищаем контекст из Redis
+        await redis_service.delete(f"fashn_prediction:{prediction_id}")
+    
+    async def _send_result_to_user(self, user_id: int, webhook_data: Dict[str, Any], message: str):
+        """
+        Отправляет результат пользователю
+        
+        Несколько результатов отправляются альбомами (send_result_photos).
+        Отправка идет через общий бот с приоритетом результатов (лимиты
+        Telegram и повторы при RetryAfter соблюдает планировщик отправки).
+        """
+        bot = await telegram_sender.get_bot()
+        with telegram_sender.lane(RESULT):
+            try:
+                output_urls = webhook_data.get("output", [])
+                
+                if not output_urls:
+                    await bot.send_message(
                         chat_id=user_id,
-                        photo=first_output,
-                        caption=f"🎉 <b>Генерация завершена!</b>\n\n{message}"
+                        text=f"✅ <b>Генерация завершена</b>\n\n{message}"
                     )
+                    return
                 
-                # Если есть дополнительные изображения, отправляем их
-                for i, url in enumerate(output_urls[1:], 2):
-                    if url.startswith("data:image/"):
-                        # Обрабатываем base64
-                        header, data = url.split(",", 1)
-                        image_data = base64.b64decode(data)
-                        photo_file = BufferedInputFile(image_data, filename=f"result_{i}.png")
-                        await self.bot.send_photo(
-                            chat_id=user_id,
-                            photo=photo_file,
-                            caption=f"📸 <b>Дополнительный результат {i}</b>"
-                        )
-                    else:
-                        # Обычный URL
-                        await self.bot.send_photo(
-                            chat_id=user_id,
-                            photo=url,
-                            caption=f"📸 <b>Дополнительный результат {i}</b>"
-                        )
-            else:
-                await self.bot.send_message(
+                await send_result_photos(
+                    bot, user_id, output_urls, caption=f"🎉 <b>Генерация завершена!</b>\n\n{message}"
+                )
+                    
+            except Exception as e:
+                logger.error(f"Error sending result to user {user_id}: {e}")
+                await bot.send_message(
                     chat_id=user_id,
-                    text=f"✅ <b>Генерация завершена</b>\n\n{message}"
+                    text="❌ <b>Ошибка отправки результата</b>\n\nПопробуйте еще раз или обратитесь в поддержку."
                 )
-                
-        except Exception as e:
-            logger.error(f"Error sending result to user {user_id}: {e}")
-            await self.bot.send_message(
-                chat_id=user_id,
-                text="❌ <b>Ошибка отправки результата</b>\n\nПопробуйте еще раз или обратитесь в поддержку."
-            )
     
     async def _send_error_to_user(self, user_id: int, error_message: str):
         """Отправляет ошибку пользователю"""
         try:
-            await self.bot.send_message(
-                chat_id=user_id,
-                text=f"❌ <b>Ошибка генерации</b>\n\n{error_message}\n\nПопробуйте еще раз или обратитесь в поддержку."
-            )
+            bot = await telegram_sender.get_bot()
+            with telegram_sender.lane(RESULT):
+                await bot.send_message(
+                    chat_id=user_id,
+                    text=f"❌ <b>Ошибка генерации</b>\n\n{error_message}\n\nПопробуйте еще раз или обратитесь в поддержку."
+                )
         except Exception as e:
             logger.error(f"Error sending error to user {user_id}: {e}")
 
@@ -169,4 +247,22 @@ def setup_webhook_routes(app: FastAPI):
     @app.get("/webhook/fashn/health")
     async def webhook_health():
         """Health check для webhook endpoint"""
-        return {"status": "ok", "service": "fashn_webhook"}
+        try:
+            result_cache = await tryon_cache.get_stats()
+        except Exception as e:
+            result_cache = {"error": str(e)}
+        
+        return {
+            "status": "ok",
+            "service": "fashn_webhook",
+            "http_pool": fashn_service.get_pool_stats(),
+            "cloudinary_pool": cloudinary_executor.get_stats(),
+            "image_pool": image_processor.get_stats(),
+            "rate_limiter": fashn_governor.get_stats(),
+            "reconciler": prediction_reconciler.get_stats(),
+            "result_cache": result_cache,
+            "coalescing": tryon_singleflight.get_stats(),
+            "webhook_stream": fashn_webhook_stream.get_stats(),
+            "base64_delivery": dict(Base64InputFile.stats),
+            "telegram_sends": telegram_sender.get_stats()
+        }
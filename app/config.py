@@ -9,10 +9,29 @@ class Settings(BaseSettings):
     
     # Database
     database_url: str = "sqlite:///./virtual_tryon.db"  # SQLite по умолчанию
+    database_echo: bool = False  # Логировать все SQL запросы
+    
+    # Пул соединений PostgreSQL
+    db_pool_size: int = 10
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30.0
+    db_pool_pre_ping: bool = True
+    db_pool_recycle: int = 1800
+    db_statement_timeout_ms: int = 30000
+    db_prepared_statement_cache_size: int = 500
     
     # Redis
     redis_url: str = "redis://localhost:6379"
     
+    # FSM storage: "redis" (общее для всех процессов) или "memory"
+    fsm_storage: str = "redis"
+    fsm_state_ttl: Optional[int] = None
+    
+    # Кеш пользователей в middleware регистрации
+    user_cache_size: int = 10000
+    user_cache_ttl: float = 300.0
+    user_redis_flush_interval: float = 1.0
+    
     # AI APIs
     replicate_api_token: Optional[str] = None
     openai_api_key: Optional[str] = None
@@ -34,6 +53,78 @@ class Settings(BaseSettings):
     fashn_output_format: str = "png"
     fashn_return_base64: bool = False
     
+    # Fashn HTTP connection pool
+    fashn_http_pool_limit: int = 100
+    fashn_http_pool_limit_per_host: int = 20
+    fashn_http_dns_cache_ttl: int = 300
+    fashn_http_keepalive_timeout: float = 30.0
+    fashn_http_connect_timeout: float = 10.0
+    fashn_http_total_timeout: float = 60.0
+    
+    # Fashn client-side rate limit (общий для всех процессов через Redis)
+    fashn_rate_limit_per_second: float = 5.0
+    fashn_rate_limit_min_per_second: float = 0.2
+    fashn_rate_limit_burst: int = 10
+    fashn_max_in_flight: int = 10
+    fashn_rate_limit_timeout: float = 30.0
+    
+    # Try-on job queue
+    tryon_queue_workers: int = 4
+    tryon_queue_max_attempts: int = 5
+    tryon_queue_backoff_base: float = 2.0
+    tryon_queue_backoff_max: float = 60.0
+    tryon_queue_user_concurrency: int = 1
+    tryon_queue_global_concurrency: int = 8
+    
+    # Опрос статуса генераций, по которым не пришел webhook
+    fashn_poll_after: float = 120.0
+    fashn_poll_interval: float = 30.0
+    fashn_poll_batch_size: int = 20
+    fashn_poll_concurrency: int = 4
+    fashn_poll_max_age: float = 3300.0
+    
+    # Кеш результатов try-on (URL результатов Fashn временные, TTL не больше суток)
+    tryon_cache_enabled: bool = True
+    tryon_cache_ttl: int = 86400
+    tryon_cache_max_entries: int = 10000
+    
+    # Объединение одинаковых запросов try-on (время жизни блокировки, сек)
+    tryon_singleflight_ttl: int = 3600
+    
+    # Метрики запросов к ИИ (окно гистограмм и время хранения, сек)
+    ai_metrics_enabled: bool = True
+    ai_metrics_window: int = 3600
+    ai_metrics_retention: int = 7 * 86400
+    
+    # Асинхронная обработка webhook'ов Fashn через Redis Stream
+    fashn_webhook_stream_maxlen: int = 10000
+    fashn_webhook_consumers: int = 2
+    fashn_webhook_claim_idle: float = 60.0
+    fashn_webhook_max_deliveries: int = 5
+    
+    # Исходящие сообщения Telegram (глобальный лимит, сообщений в секунду)
+    telegram_global_rate: float = 30.0
+    telegram_global_burst: int = 30
+    telegram_send_max_retries: int = 5
+    
+    # Webhook Telegram (без URL бот работает через long polling)
+    telegram_webhook_url: Optional[str] = None
+    telegram_webhook_secret: Optional[str] = None
+    telegram_webhook_max_connections: int = 40
+    telegram_update_concurrency: int = 32
+    telegram_update_max_pending: int = 256
+    # Максимальное ожидание предыдущего обновления пользователя (сек)
+    user_lane_wait_timeout: float = 60.0
+    
+    # Измерение задержки event loop (период, сек)
+    loop_monitor_interval: float = 0.5
+    # Callback дольше порога считается блокирующим (0 - не отслеживать) и период сводки в логе
+    loop_slow_callback_threshold: float = 0.1
+    loop_monitor_summary_interval: float = 300.0
+    
+    # Токен для служебных endpoint'ов /admin (без токена они отключены)
+    admin_api_token: Optional[str] = None
+    
     # Payment Systems
     yoomoney_shop_id: Optional[str] = None
     yoomoney_secret_key: Optional[str] = None
@@ -42,12 +133,32 @@ class Settings(BaseSettings):
     cloudinary_cloud_name: Optional[str] = None
     cloudinary_api_key: Optional[str] = None
     cloudinary_api_secret: Optional[str] = None
+    cloudinary_max_workers: int = 4
+    cloudinary_max_queue: int = 32
+    cloudinary_upload_timeout: float = 60.0
+    cloudinary_api_timeout: float = 15.0
+    
+    # Обработка изображений перед загрузкой (пул thread | process)
+    image_pool_backend: str = "thread"
+    image_pool_max_workers: int = 2
+    image_pool_max_queue: int = 16
+    image_processing_timeout: float = 30.0
+    image_max_side: int = 2048  # Большая сторона после уменьшения (px)
+    image_output_format: str = "JPEG"  # JPEG | WEBP
+    image_output_quality: int = 90
     
     # App Settings
     debug: bool = True
     host: str = "0.0.0.0"
     port: int = 8000
     
+    # Логирование (уровни по модулям: "app.services.redis_service=WARNING,app.bot=DEBUG")
+    log_level: str = "INFO"
+    log_module_levels: str = ""
+    log_format: str = "text"  # text | json
+    log_update_sample_rate: float = 1.0  # Доля обновлений, попадающих в лог
+    log_queue_size: int = 10000  # Записи в очереди вывода (при переполнении отбрасываются)
+    
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
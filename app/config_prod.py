@@ -14,10 +14,29 @@ class ProductionSettings(BaseSettings):
     
     # Database configuration - Railway PostgreSQL
     database_url: str = os.getenv("DATABASE_URL", "sqlite:///./virtual_tryon.db")
+    database_echo: bool = os.getenv("DATABASE_ECHO", "false").lower() == "true"
+    
+    # Пул соединений PostgreSQL
+    db_pool_size: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    db_max_overflow: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    db_pool_timeout: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    db_pool_pre_ping: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+    db_pool_recycle: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    db_statement_timeout_ms: int = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+    db_prepared_statement_cache_size: int = int(os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", "500"))
     
     # Redis configuration - Railway Redis
     redis_url: str = os.getenv("REDIS_URL", "redis://localhost:6379")
     
+    # FSM storage: "redis" (общее для всех процессов) или "memory"
+    fsm_storage: str = os.getenv("FSM_STORAGE", "redis")
+    fsm_state_ttl: Optional[int] = int(os.getenv("FSM_STATE_TTL")) if os.getenv("FSM_STATE_TTL") else None
+    
+    # Кеш пользователей в middleware регистрации
+    user_cache_size: int = int(os.getenv("USER_CACHE_SIZE", "10000"))
+    user_cache_ttl: float = float(os.getenv("USER_CACHE_TTL", "300"))
+    user_redis_flush_interval: float = float(os.getenv("USER_REDIS_FLUSH_INTERVAL", "1"))
+    
     # Bot token validation
     if not bot_token:
         raise ValueError("BOT_TOKEN environment variable is required for production")
@@ -43,6 +62,78 @@ class ProductionSettings(BaseSettings):
     fashn_output_format: str = os.getenv("FASHN_OUTPUT_FORMAT", "png")
     fashn_return_base64: bool = os.getenv("FASHN_RETURN_BASE64", "false").lower() == "true"
     
+    # Fashn HTTP connection pool
+    fashn_http_pool_limit: int = int(os.getenv("FASHN_HTTP_POOL_LIMIT", "100"))
+    fashn_http_pool_limit_per_host: int = int(os.getenv("FASHN_HTTP_POOL_LIMIT_PER_HOST", "20"))
+    fashn_http_dns_cache_ttl: int = int(os.getenv("FASHN_HTTP_DNS_CACHE_TTL", "300"))
+    fashn_http_keepalive_timeout: float = float(os.getenv("FASHN_HTTP_KEEPALIVE_TIMEOUT", "30"))
+    fashn_http_connect_timeout: float = float(os.getenv("FASHN_HTTP_CONNECT_TIMEOUT", "10"))
+    fashn_http_total_timeout: float = float(os.getenv("FASHN_HTTP_TOTAL_TIMEOUT", "60"))
+    
+    # Fashn client-side rate limit (общий для всех процессов через Redis)
+    fashn_rate_limit_per_second: float = float(os.getenv("FASHN_RATE_LIMIT_PER_SECOND", "5"))
+    fashn_rate_limit_min_per_second: float = float(os.getenv("FASHN_RATE_LIMIT_MIN_PER_SECOND", "0.2"))
+    fashn_rate_limit_burst: int = int(os.getenv("FASHN_RATE_LIMIT_BURST", "10"))
+    fashn_max_in_flight: int = int(os.getenv("FASHN_MAX_IN_FLIGHT", "10"))
+    fashn_rate_limit_timeout: float = float(os.getenv("FASHN_RATE_LIMIT_TIMEOUT", "30"))
+    
+    # Try-on job queue
+    tryon_queue_workers: int = int(os.getenv("TRYON_QUEUE_WORKERS", "4"))
+    tryon_queue_max_attempts: int = int(os.getenv("TRYON_QUEUE_MAX_ATTEMPTS", "5"))
+    tryon_queue_backoff_base: float = float(os.getenv("TRYON_QUEUE_BACKOFF_BASE", "2"))
+    tryon_queue_backoff_max: float = float(os.getenv("TRYON_QUEUE_BACKOFF_MAX", "60"))
+    tryon_queue_user_concurrency: int = int(os.getenv("TRYON_QUEUE_USER_CONCURRENCY", "1"))
+    tryon_queue_global_concurrency: int = int(os.getenv("TRYON_QUEUE_GLOBAL_CONCURRENCY", "8"))
+    
+    # Опрос статуса генераций, по которым не пришел webhook
+    fashn_poll_after: float = float(os.getenv("FASHN_POLL_AFTER", "120"))
+    fashn_poll_interval: float = float(os.getenv("FASHN_POLL_INTERVAL", "30"))
+    fashn_poll_batch_size: int = int(os.getenv("FASHN_POLL_BATCH_SIZE", "20"))
+    fashn_poll_concurrency: int = int(os.getenv("FASHN_POLL_CONCURRENCY", "4"))
+    fashn_poll_max_age: float = float(os.getenv("FASHN_POLL_MAX_AGE", "3300"))
+    
+    # Кеш результатов try-on (URL результатов Fashn временные, TTL не больше суток)
+    tryon_cache_enabled: bool = os.getenv("TRYON_CACHE_ENABLED", "true").lower() == "true"
+    tryon_cache_ttl: int = int(os.getenv("TRYON_CACHE_TTL", "86400"))
+    tryon_cache_max_entries: int = int(os.getenv("TRYON_CACHE_MAX_ENTRIES", "10000"))
+    
+    # Объединение одинаковых запросов try-on (время жизни блокировки, сек)
+    tryon_singleflight_ttl: int = int(os.getenv("TRYON_SINGLEFLIGHT_TTL", "3600"))
+    
+    # Метрики запросов к ИИ (окно гистограмм и время хранения, сек)
+    ai_metrics_enabled: bool = os.getenv("AI_METRICS_ENABLED", "true").lower() == "true"
+    ai_metrics_window: int = int(os.getenv("AI_METRICS_WINDOW", "3600"))
+    ai_metrics_retention: int = int(os.getenv("AI_METRICS_RETENTION", str(7 * 86400)))
+    
+    # Асинхронная обработка webhook'ов Fashn через Redis Stream
+    fashn_webhook_stream_maxlen: int = int(os.getenv("FASHN_WEBHOOK_STREAM_MAXLEN", "10000"))
+    fashn_webhook_consumers: int = int(os.getenv("FASHN_WEBHOOK_CONSUMERS", "2"))
+    fashn_webhook_claim_idle: float = float(os.getenv("FASHN_WEBHOOK_CLAIM_IDLE", "60"))
+    fashn_webhook_max_deliveries: int = int(os.getenv("FASHN_WEBHOOK_MAX_DELIVERIES", "5"))
+    
+    # Исходящие сообщения Telegram (глобальный лимит, сообщений в секунду)
+    telegram_global_rate: float = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+    telegram_global_burst: int = int(os.getenv("TELEGRAM_GLOBAL_BURST", "30"))
+    telegram_send_max_retries: int = int(os.getenv("TELEGRAM_SEND_MAX_RETRIES", "5"))
+    
+    # Webhook Telegram (без URL бот работает через long polling)
+    telegram_webhook_url: Optional[str] = os.getenv("TELEGRAM_WEBHOOK_URL")
+    telegram_webhook_secret: Optional[str] = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+    telegram_webhook_max_connections: int = int(os.getenv("TELEGRAM_WEBHOOK_MAX_CONNECTIONS", "40"))
+    telegram_update_concurrency: int = int(os.getenv("TELEGRAM_UPDATE_CONCURRENCY", "32"))
+    telegram_update_max_pending: int = int(os.getenv("TELEGRAM_UPDATE_MAX_PENDING", "256"))
+    # Максимальное ожидание предыдущего обновления пользователя (сек)
+    user_lane_wait_timeout: float = float(os.getenv("USER_LANE_WAIT_TIMEOUT", "60"))
+    
+    # Измерение задержки event loop (период, сек)
+    loop_monitor_interval: float = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.5"))
+    # Callback дольше порога считается блокирующим (0 - не отслеживать) и период сводки в логе
+    loop_slow_callback_threshold: float = float(os.getenv("LOOP_SLOW_CALLBACK_THRESHOLD", "0.1"))
+    loop_monitor_summary_interval: float = float(os.getenv("LOOP_MONITOR_SUMMARY_INTERVAL", "300"))
+    
+    # Токен для служебных endpoint'ов /admin (без токена они отключены)
+    admin_api_token: Optional[str] = os.getenv("ADMIN_API_TOKEN")
+    
     # Payment systems (placeholders for now)
     yoomoney_shop_id: Optional[str] = os.getenv("YOOMONEY_SHOP_ID")
     yoomoney_secret_key: Optional[str] = os.getenv("YOOMONEY_SECRET_KEY")
@@ -53,11 +144,31 @@ class ProductionSettings(BaseSettings):
     cloudinary_cloud_name: Optional[str] = os.getenv("CLOUDINARY_CLOUD_NAME")
     cloudinary_api_key: Optional[str] = os.getenv("CLOUDINARY_API_KEY")
     cloudinary_api_secret: Optional[str] = os.getenv("CLOUDINARY_API_SECRET")
+    cloudinary_max_workers: int = int(os.getenv("CLOUDINARY_MAX_WORKERS", "4"))
+    cloudinary_max_queue: int = int(os.getenv("CLOUDINARY_MAX_QUEUE", "32"))
+    cloudinary_upload_timeout: float = float(os.getenv("CLOUDINARY_UPLOAD_TIMEOUT", "60"))
+    cloudinary_api_timeout: float = float(os.getenv("CLOUDINARY_API_TIMEOUT", "15"))
+    
+    # Обработка изображений перед загрузкой (пул thread | process)
+    image_pool_backend: str = os.getenv("IMAGE_POOL_BACKEND", "thread")
+    image_pool_max_workers: int = int(os.getenv("IMAGE_POOL_MAX_WORKERS", "2"))
+    image_pool_max_queue: int = int(os.getenv("IMAGE_POOL_MAX_QUEUE", "16"))
+    image_processing_timeout: float = float(os.getenv("IMAGE_PROCESSING_TIMEOUT", "30"))
+    image_max_side: int = int(os.getenv("IMAGE_MAX_SIDE", "2048"))
+    image_output_format: str = os.getenv("IMAGE_OUTPUT_FORMAT", "JPEG")
+    image_output_quality: int = int(os.getenv("IMAGE_OUTPUT_QUALITY", "90"))
     
     # Environment
     environment: str = "production"
     debug: bool = False
     
+    # Логирование (уровни по модулям: "app.services.redis_service=WARNING,app.bot=DEBUG")
+    log_level: str = os.getenv("LOG_LEVEL", "INFO")
+    log_module_levels: str = os.getenv("LOG_MODULE_LEVELS", "")
+    log_format: str = os.getenv("LOG_FORMAT", "text")  # text | json
+    log_update_sample_rate: float = float(os.getenv("LOG_UPDATE_SAMPLE_RATE", "0.1"))  # Доля обновлений, попадающих в лог
+    log_queue_size: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # Записи в очереди вывода (при переполнении отбрасываются)
+    
     class Config:
         env_file = ".env"
         case_sensitive = False
@@ -1,4 +1,4 @@
-from .connection import engine, async_session
+from .connection import engine, async_session, get_pool_stats
 from .base import Base
 
-__all__ = ["engine", "async_session", "Base"]
+__all__ = ["engine", "async_session", "get_pool_stats", "Base"]
@@ -1,19 +1,96 @@
+import os
+import time
+from typing import Any, Dict
+from sqlalchemy import event, exc
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from app.config import settings
+from app.utils.metrics import metrics
+
+# Определяем, какая конфигурация использовать
+if os.getenv("RAILWAY_ENVIRONMENT") or os.getenv("RAILWAY_PROJECT_ID"):
+    from app import config_prod
+    settings = config_prod.settings
 
 # Исправляем URL для SQLite с async
 database_url = settings.database_url
 if database_url.startswith("sqlite:///"):
     database_url = database_url.replace("sqlite:///", "sqlite+aiosqlite:///")
+# Для PostgreSQL используем асинхронный драйвер asyncpg
+elif database_url.startswith("postgres://"):
+    database_url = database_url.replace("postgres://", "postgresql+asyncpg://", 1)
+elif database_url.startswith("postgresql://"):
+    database_url = database_url.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+
+db_pool_wait = metrics.histogram("db_pool_wait_seconds", "Time waiting for a database connection from the pool")
+db_query_latency = metrics.histogram("db_query_duration_seconds", "Database statement latency", ("statement",))
+
+# Время ожидания соединения из пула
+_pool_wait = {"checkouts": 0, "timeouts": 0, "wait_time_total": 0.0, "wait_time_max": 0.0}
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Пул соединений, измеряющий время получения соединения"""
+    
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            _pool_wait["timeouts"] += 1
+            raise
+        finally:
+            wait = time.perf_counter() - started
+            db_pool_wait.observe(wait)
+            _pool_wait["checkouts"] += 1
+            _pool_wait["wait_time_total"] += wait
+            _pool_wait["wait_time_max"] = max(_pool_wait["wait_time_max"], wait)
+
+
+engine_options: Dict[str, Any] = {}
+if database_url.startswith("postgresql+asyncpg://"):
+    engine_options = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "pool_recycle": settings.db_pool_recycle,
+        "connect_args": {
+            # Кеш подготовленных запросов (0 - отключить, например за pgbouncer)
+            "prepared_statement_cache_size": settings.db_prepared_statement_cache_size,
+            "statement_cache_size": settings.db_prepared_statement_cache_size,
+            # Ограничение времени запроса на сервере
+            "server_settings": {"statement_timeout": str(settings.db_statement_timeout_ms)},
+        },
+    }
 
 # Create async engine
 engine = create_async_engine(
     database_url,
-    echo=settings.debug,
-    future=True
+    echo=settings.database_echo,
+    future=True,
+    **engine_options
 )
 
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    """Запомнить время начала запроса"""
+    conn.info["query_started"] = time.perf_counter()
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _observe_query(conn, cursor, statement, parameters, context, executemany):
+    """Учесть длительность запроса (метка - тип запроса: SELECT, INSERT, ...)"""
+    started = conn.info.pop("query_started", None)
+    if started is None:
+        return
+    db_query_latency.observe(time.perf_counter() - started, statement.lstrip().split(None, 1)[0].upper())
+
+
 # Create async session factory
 async_session = async_sessionmaker(
     engine,
@@ -22,5 +99,31 @@ async_session = async_sessionmaker(
 )
 
 
+def get_pool_stats() -> Dict[str, Any]:
+    """
+    Получить состояние пула соединений с БД
+    
+    Returns:
+        Dict с числом занятых соединений, переполнением и временем ожидания
+    """
+    pool = engine.pool
+    if not isinstance(pool, InstrumentedQueuePool):
+        return {"pool": type(pool).__name__, "status": pool.status()}
+    
+    checkouts = _pool_wait["checkouts"]
+    return {
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "max_overflow": settings.db_max_overflow,
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "checkouts": checkouts,
+        "timeouts": _pool_wait["timeouts"],
+        "wait_time_avg": round(_pool_wait["wait_time_total"] / checkouts, 4) if checkouts else 0.0,
+        "wait_time_max": round(_pool_wait["wait_time_max"], 4),
+    }
+
+
 class Base(DeclarativeBase):
     pass
\ No newline at end of file
@@ -0,0 +1,173 @@
+"""
+Служебные endpoint'ы мониторинга (метрики Prometheus, состояние пулов соединений и т.д.)
+"""
+
+import hmac
+import os
+from typing import Optional, Sequence
+
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+from starlette.routing import BaseRoute, Match
+
+from app.database.connection import get_pool_stats
+from app.bot.middleware import db_session_middleware, user_lanes
+from app.bot.telegram_webhook import telegram_webhook
+from app.services.ai_metrics import ai_metrics
+from app.services.cloudinary_executor import cloudinary_executor
+from app.services.fashn_service import fashn_service
+from app.services.loop_monitor import loop_monitor, current_operation
+from app.services.telegram_sender import telegram_sender
+from app.utils.image_processing import image_processor
+from app.utils.metrics import metrics
+from app.config import settings
+
+
+def _get_settings():
+    """Получить настройки в зависимости от окружения"""
+    if os.getenv("RAILWAY_ENVIRONMENT") or os.getenv("RAILWAY_PROJECT_ID"):
+        from app import config_prod
+        return config_prod.settings
+    return settings
+
+
+class OperationMiddleware:
+    """
+    Указывает маршрут запроса как операцию для монитора event loop
+    
+    Операция - шаблон маршрута ("GET /admin/ai/users/{user_id}"), а не
+    фактический путь, поэтому число операций (меток метрик и мест в сводке)
+    ограничено числом маршрутов; неизвестные пути сводятся к "<METHOD> unmatched".
+    """
+    
+    def __init__(self, app, routes: Sequence[BaseRoute] = ()):
+        self.app = app
+        # Список маршрутов приложения (тот же объект - маршруты, добавленные позже, тоже видны)
+        self.routes = routes
+    
+    def _operation(self, scope) -> str:
+        """Шаблон маршрута, который обработает запрос"""
+        partial = None
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return f"{scope['method']} {getattr(route, 'path', route.name)}"
+            if match == Match.PARTIAL and partial is None:
+                partial = route
+        if partial is not None:
+            # Путь найден, но метод не подходит (405)
+            return f"{scope['method']} {getattr(partial, 'path', partial.name)}"
+        return f"{scope['method']} unmatched"
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = current_operation.set(self._operation(scope))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_operation.reset(token)
+
+
+def check_admin_token(token: Optional[str]):
+    """Проверить токен служебных endpoint'ов (без ADMIN_API_TOKEN они отключены)"""
+    expected = _get_settings().admin_api_token
+    if not expected:
+        raise HTTPException(status_code=404, detail="Admin API is disabled")
+    if not token or not hmac.compare_digest(token, expected):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+def register_gauges():
+    """Показатели текущего состояния (вычисляются только при запросе /metrics)"""
+    metrics.gauge(
+        "telegram_send_queue_depth", "Outbound Telegram messages waiting to be sent",
+        lambda: telegram_sender.get_stats()["queue_depth"]
+    )
+    metrics.gauge(
+        "telegram_send_paused_seconds", "Remaining flood-control pause for outbound Telegram messages",
+        lambda: telegram_sender.get_stats()["paused_for"]
+    )
+    metrics.gauge(
+        "telegram_updates_pending", "Telegram webhook updates accepted but not processed yet",
+        lambda: telegram_webhook.get_stats()["pending"]
+    )
+    metrics.gauge("user_lanes_active", "Users with updates in processing", lambda: user_lanes.get_stats()["lanes"])
+    metrics.gauge(
+        "db_pool_connections", "Database pool connections by state",
+        lambda: {
+            (state,): value for state, value in get_pool_stats().items()
+            if state in ("checked_out", "checked_in", "overflow")
+        },
+        ("state",)
+    )
+    metrics.gauge(
+        "cloudinary_queue_depth", "Cloudinary calls running or waiting for a worker",
+        lambda: cloudinary_executor.get_stats()["queue_depth"]
+    )
+    metrics.gauge(
+        "image_processing_queue_depth", "Image jobs running or waiting for a worker",
+        lambda: image_processor.get_stats()["queue_depth"]
+    )
+    metrics.gauge(
+        "fashn_requests_in_flight", "Fashn API requests in flight",
+        lambda: fashn_service.get_pool_stats()["requests_in_flight"]
+    )
+    metrics.gauge(
+        "event_loop_lag_last_seconds", "Last measured event loop lag",
+        lambda: loop_monitor.get_stats()["lag_last"]
+    )
+
+
+def setup_monitoring_routes(app: FastAPI):
+    """Настраивает маршруты мониторинга"""
+    register_gauges()
+    app.add_middleware(OperationMiddleware, routes=app.router.routes)
+    
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def prometheus_metrics():
+        """Метрики в текстовом формате Prometheus"""
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+    
+    @app.get("/health/database")
+    async def database_health():
+        """Состояние пула соединений с БД и число запросов на обновление"""
+        return {
+            "status": "ok",
+            "service": "database",
+            "pool": get_pool_stats(),
+            "queries_per_update": db_session_middleware.get_stats()
+        }
+    
+    @app.get("/health/ai")
+    async def ai_health(
+        hours: float = 24,
+        service: Optional[str] = None,
+        model: Optional[str] = None,
+        mode: Optional[str] = None
+    ):
+        """Время генерации (p50/p95/p99) и ошибки по модели и режиму за последние hours часов"""
+        return {
+            "status": "ok",
+            "service": "ai_metrics",
+            "recorder": ai_metrics.get_stats(),
+            **(await ai_metrics.get_summary(hours, service=service, model=model, mode=mode))
+        }
+    
+    @app.get("/admin/ai/users/{user_id}")
+    async def ai_user_admin(user_id: int, x_admin_token: Optional[str] = Header(None)):
+        """Счетчики генераций пользователя"""
+        check_admin_token(x_admin_token)
+        return await ai_metrics.get_user_stats(user_id)
+    
+    @app.get("/admin/event-loop")
+    async def event_loop_admin(limit: int = 20, x_admin_token: Optional[str] = Header(None)):
+        """Задержка event loop и места, дольше всего блокировавшие его (со стеком)"""
+        check_admin_token(x_admin_token)
+        return {
+            "status": "ok",
+            "service": "event_loop",
+            "loop": loop_monitor.get_stats(),
+            "offenders": loop_monitor.get_offenders(limit)
+        }
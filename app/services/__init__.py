@@ -1,6 +1,21 @@
 from .redis_service import RedisService
 from .file_service import FileService
 from .ai_logging_service import AILoggingService
+from .ai_metrics import AIMetricsStore
 from .fashn_service import FashnService
+from .cloudinary_executor import CloudinaryExecutor
+from .tryon_queue import TryOnQueue
+from .fashn_rate_limiter import FashnRateGovernor
+from .prediction_reconciler import PredictionReconciler
+from .tryon_cache import TryOnResultCache
+from .tryon_singleflight import TryOnSingleFlight
+from .fashn_webhook_stream import FashnWebhookStream
+from .telegram_sender import TelegramSendScheduler
+from .loop_monitor import EventLoopMonitor
 
-__all__ = ["RedisService", "FileService", "AILoggingService", "FashnService"]
+__all__ = [
+    "RedisService", "FileService", "AILoggingService", "AIMetricsStore", "FashnService",
+    "CloudinaryExecutor", "TryOnQueue", "FashnRateGovernor", "PredictionReconciler",
+    "TryOnResultCache", "TryOnSingleFlight", "FashnWebhookStream", "TelegramSendScheduler",
+    "EventLoopMonitor"
+]
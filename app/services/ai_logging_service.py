@@ -5,7 +5,13 @@ import json
 
 
 class AILoggingService:
-    """Сервис для логирования запросов к ИИ сервисам"""
+    """
+    Сервис для логирования запросов к ИИ сервисам
+    
+    Ключевые поля передаются в запись через logger.bind() (попадают в JSON при
+    LOG_FORMAT=json), а полные данные запроса/ответа сериализуются лениво -
+    только если включен уровень DEBUG.
+    """
     
     @staticmethod
     async def log_ai_request(
@@ -15,15 +21,16 @@ class AILoggingService:
         start_time: datetime
     ):
         """Логирование запроса к ИИ сервису"""
-        log_data = {
-            "user_id": user_id,
-            "service_name": service_name,
-            "request_data": request_data,
-            "start_time": start_time.isoformat(),
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        logger.info(f"AI Request: {json.dumps(log_data, ensure_ascii=False)}")
+        log = logger.bind(event="ai_request", user_id=user_id, service=service_name)
+        log.info("AI Request: {} for user {}", service_name, user_id)
+        log.opt(lazy=True).debug(
+            "AI Request data: {}",
+            lambda: json.dumps({
+                "request_data": request_data,
+                "start_time": start_time.isoformat(),
+                "timestamp": datetime.now().isoformat()
+            }, ensure_ascii=False, default=str)
+        )
     
     @staticmethod
     async def log_ai_response(
@@ -35,20 +42,27 @@ class AILoggingService:
         error_message: str = None
     ):
         """Логирование ответа от ИИ сервиса"""
-        log_data = {
-            "user_id": user_id,
-            "service_name": service_name,
-            "response_data": response_data,
-            "processing_time_seconds": processing_time,
-            "success": success,
-            "error_message": error_message,
-            "timestamp": datetime.now().isoformat()
-        }
+        log = logger.bind(
+            event="ai_response",
+            user_id=user_id,
+            service=service_name,
+            processing_time_seconds=processing_time,
+            success=success
+        )
         
         if success:
-            logger.info(f"AI Response: {json.dumps(log_data, ensure_ascii=False)}")
+            log.info("AI Response: {} for user {} in {:.2f}s", service_name, user_id, processing_time)
+            log.opt(lazy=True).debug(
+                "AI Response data: {}",
+                lambda: json.dumps(response_data, ensure_ascii=False, default=str)
+            )
         else:
-            logger.error(f"AI Error: {json.dumps(log_data, ensure_ascii=False)}")
+            # Ошибки редки - пишем полные данные
+            log.error(
+                "AI Error: {} for user {} after {:.2f}s: {} {}",
+                service_name, user_id, processing_time, error_message,
+                json.dumps(response_data, ensure_ascii=False, default=str)
+            )
     
     @staticmethod
     async def log_ai_quality_metrics(
@@ -59,16 +73,16 @@ class AILoggingService:
         user_feedback: str = None
     ):
         """Логирование метрик качества ИИ сервиса"""
-        log_data = {
-            "user_id": user_id,
-            "service_name": service_name,
-            "quality_score": quality_score,
-            "processing_time_seconds": processing_time,
-            "user_feedback": user_feedback,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        logger.info(f"AI Quality Metrics: {json.dumps(log_data, ensure_ascii=False)}")
+        logger.bind(
+            event="ai_quality",
+            user_id=user_id,
+            service=service_name,
+            quality_score=quality_score,
+            processing_time_seconds=processing_time
+        ).info(
+            "AI Quality Metrics: {} for user {}: score={}, time={:.2f}s, feedback={}",
+            service_name, user_id, quality_score, processing_time, user_feedback
+        )
 
 
 # Создаем экземпляр сервиса
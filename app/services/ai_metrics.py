@@ -0,0 +1,262 @@
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from app.config import settings
+from app.services.redis_service import redis_service
+
+
+# Границы гистограммы времени генерации (секунды от отправки до webhook)
+LATENCY_BUCKETS = (5, 10, 15, 20, 25, 30, 35, 40, 45, 60, 90, 120, 180, 300, 600)
+
+
+class AIMetricsStore:
+    """
+    Метрики запросов к ИИ сервисам в Redis
+    
+    Для каждой серии (сервис, модель, режим) хранятся почасовые окна:
+    гистограмма времени генерации, число успешных и неудачных генераций и
+    счетчики ошибок по имени (error.name Fashn). Окна живут retention секунд,
+    поэтому гистограммы скользящие: сводка за N часов складывает последние
+    окна. Отдельно для каждого пользователя ведутся счетчики генераций.
+    Данные общие для всех процессов и позволяют выбрать fashn_mode по
+    фактическому времени и доле ошибок.
+    """
+    
+    SERIES_KEY = "ai_metrics:series"
+    LATENCY_KEY = "ai_metrics:latency:{series}:{window}"
+    ERRORS_KEY = "ai_metrics:errors:{series}:{window}"
+    USER_KEY = "ai_metrics:user:{user_id}"
+    
+    def __init__(self):
+        # Определяем, какая конфигурация использовать
+        if os.getenv("RAILWAY_ENVIRONMENT") or os.getenv("RAILWAY_PROJECT_ID"):
+            from app import config_prod
+            self.settings = config_prod.settings
+        else:
+            self.settings = settings
+        
+        self.enabled = self.settings.ai_metrics_enabled
+        self.window = self.settings.ai_metrics_window
+        self.retention = self.settings.ai_metrics_retention
+        
+        self._stats = {"recorded": 0, "record_errors": 0}
+    
+    @staticmethod
+    def series_name(service: str, model: str, mode: str) -> str:
+        """Имя серии метрик"""
+        return f"{service}|{model}|{mode}"
+    
+    @staticmethod
+    def _bucket(latency: float) -> str:
+        """Поле корзины гистограммы для времени генерации"""
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                return f"b{i}"
+        return f"b{len(LATENCY_BUCKETS)}"
+    
+    def _windows(self, hours: float) -> List[int]:
+        """Начала окон за последние hours часов (не дольше времени хранения)"""
+        span = min(hours * 3600, self.retention)
+        current = int(time.time() // self.window) * self.window
+        count = max(int(span // self.window), 1)
+        return [current - i * self.window for i in range(count)]
+    
+    async def record(
+        self,
+        service: str,
+        model: str,
+        mode: str,
+        user_id: Optional[int],
+        latency: Optional[float],
+        success: bool,
+        error_name: Optional[str] = None
+    ):
+        """
+        Учесть завершенную генерацию
+        
+        Args:
+            service: Название ИИ сервиса
+            model: Модель (fashn_model_name)
+            mode: Режим генерации (fashn_mode)
+            user_id: ID пользователя
+            latency: Время от отправки запроса до результата (сек), если известно
+            success: Генерация завершилась успешно
+            error_name: Имя ошибки сервиса для неудачной генерации
+        """
+        if not self.enabled:
+            return
+        
+        series = self.series_name(service, model, mode)
+        window = int(time.time() // self.window) * self.window
+        latency_key = self.LATENCY_KEY.format(series=series, window=window)
+        ttl = self.retention + self.window
+        outcome = "success" if success else "failed"
+        
+        try:
+            async with redis_service.pipeline(transaction=False) as pipe:
+                pipe.sadd(self.SERIES_KEY, series)
+                pipe.hincrby(latency_key, outcome, 1)
+                if latency is not None:
+                    pipe.hincrby(latency_key, self._bucket(latency), 1)
+                    pipe.hincrby(latency_key, "count", 1)
+                    pipe.hincrbyfloat(latency_key, "sum", latency)
+                pipe.expire(latency_key, ttl)
+                
+                if not success:
+                    errors_key = self.ERRORS_KEY.format(series=series, window=window)
+                    pipe.hincrby(errors_key, error_name or "Unknown", 1)
+                    pipe.expire(errors_key, ttl)
+                
+                if user_id:
+                    user_key = self.USER_KEY.format(user_id=user_id)
+                    pipe.hincrby(user_key, "requests", 1)
+                    pipe.hincrby(user_key, outcome, 1)
+                    if latency is not None:
+                        pipe.hincrby(user_key, "latency_count", 1)
+                        pipe.hincrbyfloat(user_key, "latency_sum", latency)
+                    pipe.hset(user_key, "last_at", int(time.time()))
+                    pipe.expire(user_key, self.retention)
+            self._stats["recorded"] += 1
+        except Exception as e:
+            # Метрики не должны мешать доставке результата
+            self._stats["record_errors"] += 1
+            logger.warning(f"Failed to record AI metrics for {series}: {e}")
+    
+    @staticmethod
+    def _percentile(buckets: List[int], count: int, quantile: float) -> Optional[float]:
+        """Оценить перцентиль по гистограмме (линейно внутри корзины)"""
+        if not count:
+            return None
+        rank = quantile * count
+        cumulative = 0
+        lower = 0.0
+        for i, observed in enumerate(buckets):
+            if i == len(LATENCY_BUCKETS):
+                # Последняя корзина не ограничена сверху
+                return float(LATENCY_BUCKETS[-1])
+            upper = float(LATENCY_BUCKETS[i])
+            if observed and cumulative + observed >= rank:
+                return round(lower + (upper - lower) * (rank - cumulative) / observed, 2)
+            cumulative += observed
+            lower = upper
+        return float(LATENCY_BUCKETS[-1])
+    
+    async def get_summary(
+        self,
+        hours: float = 24,
+        service: Optional[str] = None,
+        model: Optional[str] = None,
+        mode: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Получить сводку по сериям за последние hours часов
+        
+        Args:
+            hours: Период сводки
+            service, model, mode: Необязательные фильтры серий
+        
+        Returns:
+            Dict со списком серий: число генераций, доля ошибок, p50/p95/p99,
+            накопительная гистограмма и ошибки по имени
+        """
+        async with redis_service.pipeline(transaction=False) as pipe:
+            pipe.smembers(self.SERIES_KEY)
+            series_names = sorted((await pipe.execute())[0])
+        selected = []
+        for name in series_names:
+            series_service, series_model, series_mode = name.split("|", 2)
+            if service and series_service != service:
+                continue
+            if model and series_model != model:
+                continue
+            if mode and series_mode != mode:
+                continue
+            selected.append((name, series_service, series_model, series_mode))
+        
+        windows = self._windows(hours)
+        async with redis_service.pipeline(transaction=False) as pipe:
+            for name, *_ in selected:
+                for window in windows:
+                    pipe.hgetall(self.LATENCY_KEY.format(series=name, window=window))
+                    pipe.hgetall(self.ERRORS_KEY.format(series=name, window=window))
+            results = await pipe.execute() if selected else []
+        
+        summaries = []
+        per_series = len(windows) * 2
+        for index, (name, series_service, series_model, series_mode) in enumerate(selected):
+            chunk = results[index * per_series:(index + 1) * per_series]
+            buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+            totals = {"success": 0, "failed": 0, "count": 0, "sum": 0.0}
+            errors: Dict[str, int] = {}
+            for latency_hash, errors_hash in zip(chunk[::2], chunk[1::2]):
+                for field, value in latency_hash.items():
+                    if field.startswith("b"):
+                        buckets[int(field[1:])] += int(value)
+                    elif field in totals:
+                        totals[field] += float(value) if field == "sum" else int(value)
+                for error_name, value in errors_hash.items():
+                    errors[error_name] = errors.get(error_name, 0) + int(value)
+            
+            generations = totals["success"] + totals["failed"]
+            if not generations:
+                continue
+            
+            count = totals["count"]
+            histogram = {}
+            cumulative = 0
+            for bound, observed in zip(LATENCY_BUCKETS + (float("inf"),), buckets):
+                cumulative += observed
+                histogram["+Inf" if bound == float("inf") else str(bound)] = cumulative
+            
+            summaries.append({
+                "service": series_service,
+                "model": series_model,
+                "mode": series_mode,
+                "generations": generations,
+                "success": totals["success"],
+                "failed": totals["failed"],
+                "error_rate": round(totals["failed"] / generations, 3),
+                "latency": {
+                    "count": count,
+                    "avg": round(totals["sum"] / count, 2) if count else None,
+                    "p50": self._percentile(buckets, count, 0.5),
+                    "p95": self._percentile(buckets, count, 0.95),
+                    "p99": self._percentile(buckets, count, 0.99),
+                    "histogram": histogram,
+                },
+                "errors": dict(sorted(errors.items(), key=lambda item: -item[1])),
+            })
+        
+        return {"hours": hours, "window_seconds": self.window, "series": summaries}
+    
+    async def get_user_stats(self, user_id: int) -> Dict[str, Any]:
+        """
+        Получить счетчики генераций пользователя за время хранения
+        
+        Returns:
+            Dict с числом генераций, успешных/неудачных и средним временем
+        """
+        async with redis_service.pipeline(transaction=False) as pipe:
+            pipe.hgetall(self.USER_KEY.format(user_id=user_id))
+            raw = (await pipe.execute())[0]
+        latency_count = int(raw.get("latency_count", 0))
+        latency_sum = float(raw.get("latency_sum", 0))
+        return {
+            "user_id": user_id,
+            "requests": int(raw.get("requests", 0)),
+            "success": int(raw.get("success", 0)),
+            "failed": int(raw.get("failed", 0)),
+            "latency_avg": round(latency_sum / latency_count, 2) if latency_count else None,
+            "last_at": int(raw["last_at"]) if "last_at" in raw else None,
+        }
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить счетчики записи метрик этого процесса"""
+        return dict(self._stats)
+
+
+# Глобальный экземпляр
+ai_metrics = AIMetricsStore()
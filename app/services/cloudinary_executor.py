@@ -0,0 +1,242 @@
+import asyncio
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+
+import cloudinary
+import cloudinary.api
+import cloudinary.uploader
+from loguru import logger
+
+from app.config import settings
+from app.utils.metrics import metrics
+
+
+cloudinary_latency = metrics.histogram(
+    "cloudinary_call_duration_seconds", "Cloudinary SDK call duration in the thread pool", ("call",)
+)
+cloudinary_wait = metrics.histogram(
+    "cloudinary_queue_wait_seconds", "Time a Cloudinary call waited for a free worker"
+)
+
+
+class CloudinaryBusy(Exception):
+    """Очередь пула Cloudinary заполнена"""
+
+
+class CloudinaryExecutor:
+    """
+    Ограниченный пул потоков для синхронного Cloudinary SDK
+    
+    Cloudinary SDK блокирующий, поэтому все вызовы выполняются в отдельных
+    потоках, чтобы не останавливать event loop бота и webhook сервера.
+    Одновременно выполняется не больше max_workers вызовов, ждать может не
+    больше max_queue; при заполненной очереди вызов сразу отклоняется с
+    CloudinaryBusy. Вызов, не уложившийся в таймаут, занимает слот, пока
+    поток не вернется, а загрузка, завершившаяся после таймаута, удаляется.
+    """
+    
+    def __init__(self):
+        # Определяем, какая конфигурация использовать
+        if os.getenv("RAILWAY_ENVIRONMENT") or os.getenv("RAILWAY_PROJECT_ID"):
+            from app import config_prod
+            self.settings = config_prod.settings
+        else:
+            self.settings = settings
+        
+        self.max_workers = self.settings.cloudinary_max_workers
+        self.max_queue = self.settings.cloudinary_max_queue
+        self.upload_timeout = self.settings.cloudinary_upload_timeout
+        self.api_timeout = self.settings.cloudinary_api_timeout
+        
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._configured = False
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "timeouts": 0,
+            "waiting": 0,
+            "running": 0,
+            "queue_depth_peak": 0,
+            "wait_time_total": 0.0,
+        }
+    
+    @property
+    def is_configured(self) -> bool:
+        """Настроен ли Cloudinary"""
+        return bool(self.settings.cloudinary_cloud_name and self.settings.cloudinary_api_key)
+    
+    def _ensure_started(self):
+        """Создать пул потоков при первом использовании"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="cloudinary"
+            )
+            # Слот занят, пока поток выполняет вызов (в том числе после таймаута)
+            self._slots = asyncio.Semaphore(self.max_workers)
+        
+        if not self._configured and self.is_configured:
+            cloudinary.config(
+                cloud_name=self.settings.cloudinary_cloud_name,
+                api_key=self.settings.cloudinary_api_key,
+                api_secret=self.settings.cloudinary_api_secret
+            )
+            self._configured = True
+    
+    async def run(
+        self,
+        func: Callable[..., Any],
+        *args,
+        timeout: Optional[float] = None,
+        on_late: Optional[Callable[[Any], None]] = None,
+        **kwargs
+    ) -> Any:
+        """
+        Выполнить синхронную функцию Cloudinary SDK в пуле потоков
+        
+        Args:
+            func: Синхронная функция SDK
+            timeout: Таймаут ожидания результата в секундах
+            on_late: Вызывается в потоке пула с результатом, который пришел после таймаута
+        
+        Returns:
+            Результат функции
+        
+        Raises:
+            CloudinaryBusy: Если очередь заполнена
+            asyncio.TimeoutError: Если вызов не завершился за timeout
+        """
+        self._ensure_started()
+        stats = self._stats
+        if stats["waiting"] >= self.max_queue:
+            stats["rejected"] += 1
+            raise CloudinaryBusy(f"Cloudinary queue is full ({self.max_queue})")
+        
+        stats["submitted"] += 1
+        stats["waiting"] += 1
+        stats["queue_depth_peak"] = max(
+            stats["queue_depth_peak"], stats["waiting"] + stats["running"]
+        )
+        
+        enqueued_at = time.monotonic()
+        try:
+            await self._slots.acquire()
+        finally:
+            stats["waiting"] -= 1
+        
+        stats["running"] += 1
+        started = time.monotonic()
+        stats["wait_time_total"] += started - enqueued_at
+        cloudinary_wait.observe(started - enqueued_at)
+        name = getattr(func, "__name__", "call")
+        loop = asyncio.get_running_loop()
+        try:
+            job = self._executor.submit(partial(func, *args, **kwargs))
+        except Exception:
+            self._release(self._slots, started, name)
+            stats["failed"] += 1
+            raise
+        # Слот освобождается, только когда поток действительно завершил вызов
+        slots = self._slots
+        job.add_done_callback(lambda _: self._release_threadsafe(loop, slots, started, name))
+        
+        try:
+            result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(job)), timeout=timeout)
+        except asyncio.TimeoutError:
+            stats["timeouts"] += 1
+            stats["failed"] += 1
+            logger.warning(f"Cloudinary call {name} timed out after {timeout}s")
+            if on_late is not None:
+                job.add_done_callback(partial(self._handle_late, on_late))
+            raise
+        except Exception:
+            stats["failed"] += 1
+            raise
+        
+        stats["completed"] += 1
+        return result
+    
+    def _release(self, slots: asyncio.Semaphore, started: float, name: str):
+        """Освободить слот завершившегося вызова"""
+        self._stats["running"] -= 1
+        slots.release()
+        cloudinary_latency.observe(time.monotonic() - started, name)
+    
+    def _release_threadsafe(
+        self, loop: asyncio.AbstractEventLoop, slots: asyncio.Semaphore, started: float, name: str
+    ):
+        """Освободить слот из потока пула"""
+        try:
+            loop.call_soon_threadsafe(self._release, slots, started, name)
+        except RuntimeError:
+            # Loop уже закрыт (остановка приложения)
+            pass
+    
+    @staticmethod
+    def _handle_late(on_late: Callable[[Any], None], job: Future):
+        """Передать результат, пришедший после таймаута"""
+        if job.cancelled() or job.exception() is not None:
+            return
+        try:
+            on_late(job.result())
+        except Exception as e:
+            logger.warning(f"Failed to handle late Cloudinary result: {e}")
+    
+    @staticmethod
+    def _destroy_late_upload(result: Dict[str, Any]):
+        """Удалить файл, загрузка которого завершилась после таймаута"""
+        public_id = result.get("public_id")
+        if not public_id:
+            return
+        # Вызывающий код уже использовал запасной URL - файл никому не нужен
+        cloudinary.uploader.destroy(public_id)
+        logger.warning(f"Deleted Cloudinary upload {public_id} that finished after timeout")
+    
+    async def upload(self, file: Any, **options) -> Dict[str, Any]:
+        """Загрузить файл в Cloudinary"""
+        return await self.run(
+            cloudinary.uploader.upload,
+            file,
+            timeout=self.upload_timeout,
+            on_late=self._destroy_late_upload,
+            **options
+        )
+    
+    async def destroy(self, public_id: str) -> Dict[str, Any]:
+        """Удалить файл из Cloudinary"""
+        return await self.run(cloudinary.uploader.destroy, public_id, timeout=self.api_timeout)
+    
+    async def resource(self, public_id: str) -> Dict[str, Any]:
+        """Получить информацию о файле в Cloudinary"""
+        return await self.run(cloudinary.api.resource, public_id, timeout=self.api_timeout)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Получить метрики пула потоков
+        
+        Returns:
+            Dict со счетчиками вызовов и глубиной очереди
+        """
+        stats = dict(self._stats)
+        stats["max_workers"] = self.max_workers
+        stats["max_queue"] = self.max_queue
+        stats["queue_depth"] = stats["waiting"] + stats["running"]
+        return stats
+    
+    def shutdown(self):
+        """Остановить пул потоков"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._slots = None
+            logger.info("Cloudinary executor stopped")
+
+
+# Глобальный экземпляр
+cloudinary_executor = CloudinaryExecutor()
@@ -0,0 +1,298 @@
+import asyncio
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional, Tuple
+
+from loguru import logger
+
+from app.config import settings
+from app.services.redis_service import redis_service
+
+
+# Token bucket: списывает токен или возвращает время ожидания
+_ACQUIRE_TOKEN_SCRIPT = """
+local now = tonumber(ARGV[1])
+local default_rate = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'rate', 'blocked_until')
+local rate = tonumber(data[3]) or default_rate
+local tokens = tonumber(data[1]) or burst
+local ts = tonumber(data[2]) or now
+local blocked_until = tonumber(data[4]) or 0
+
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if blocked_until > now then
+    wait = blocked_until - now
+elseif tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now), 'rate', tostring(rate))
+redis.call('EXPIRE', KEYS[1], 3600)
+return {tostring(wait), tostring(tokens), tostring(rate)}
+"""
+
+# Адаптация скорости: уменьшение при 429, плавное восстановление при успехе
+_ADJUST_RATE_SCRIPT = """
+local default_rate = tonumber(ARGV[1])
+local factor = tonumber(ARGV[2])
+local step = tonumber(ARGV[3])
+local min_rate = tonumber(ARGV[4])
+local max_rate = tonumber(ARGV[5])
+local blocked_until = tonumber(ARGV[6])
+local rate = tonumber(redis.call('HGET', KEYS[1], 'rate')) or default_rate
+
+rate = math.max(min_rate, math.min(max_rate, rate * factor + step))
+redis.call('HSET', KEYS[1], 'rate', tostring(rate))
+if blocked_until > 0 then
+    local current = tonumber(redis.call('HGET', KEYS[1], 'blocked_until')) or 0
+    if blocked_until > current then
+        redis.call('HSET', KEYS[1], 'blocked_until', tostring(blocked_until))
+    end
+end
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(rate)
+"""
+
+
+class FashnRateGovernor:
+    """
+    Ограничитель скорости и параллельности запросов к Fashn API
+    
+    Token bucket и счетчик запросов "в полете" хранятся в Redis, поэтому
+    лимит общий для всех процессов. При ответах 429 (и заголовке Retry-After)
+    скорость уменьшается вдвое, при успешных ответах плавно восстанавливается
+    до настроенного значения. Если Redis недоступен, используется локальный
+    token bucket этого процесса.
+    """
+    
+    BUCKET_KEY = "fashn:ratelimit"
+    IN_FLIGHT_KEY = "fashn:inflight"
+    IN_FLIGHT_LEASE = 120  # Слот считается занятым не дольше этого времени
+    
+    THROTTLE_FACTOR = 0.5
+    RECOVERY_STEP = 0.1
+    
+    def __init__(self):
+        # Определяем, какая конфигурация использовать
+        if os.getenv("RAILWAY_ENVIRONMENT") or os.getenv("RAILWAY_PROJECT_ID"):
+            from app import config_prod
+            self.settings = config_prod.settings
+        else:
+            self.settings = settings
+        
+        self.max_rate = self.settings.fashn_rate_limit_per_second
+        self.min_rate = self.settings.fashn_rate_limit_min_per_second
+        self.burst = self.settings.fashn_rate_limit_burst
+        self.max_in_flight = self.settings.fashn_max_in_flight
+        self.acquire_timeout = self.settings.fashn_rate_limit_timeout
+        
+        self._acquire_script = None
+        self._adjust_script = None
+        
+        # Локальный bucket на случай недоступности Redis
+        self._local_tokens = float(self.burst)
+        self._local_ts = time.monotonic()
+        self._local_rate = self.max_rate
+        self._local_blocked_until = 0.0
+        # Создается при первом использовании внутри работающего event loop
+        self._local_in_flight_semaphore: Optional[asyncio.Semaphore] = None
+        
+        self._stats = {
+            "tokens": float(self.burst),
+            "rate": self.max_rate,
+            "in_flight": 0,
+            "waiters": 0,
+            "throttle_events": 0,
+            "wait_time_total": 0.0,
+            "redis_fallbacks": 0,
+        }
+    
+    def _local_in_flight(self) -> asyncio.Semaphore:
+        """Получить локальный семафор запросов в работе, создав его при первом использовании"""
+        if self._local_in_flight_semaphore is None:
+            self._local_in_flight_semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._local_in_flight_semaphore
+    
+    async def _client(self):
+        """Получить клиент Redis и зарегистрировать скрипты"""
+        if not redis_service.redis:
+            await redis_service.connect()
+        if self._acquire_script is None:
+            self._acquire_script = redis_service.redis.register_script(_ACQUIRE_TOKEN_SCRIPT)
+            self._adjust_script = redis_service.redis.register_script(_ADJUST_RATE_SCRIPT)
+        return redis_service.redis
+    
+    def _take_local_token(self) -> Tuple[float, float, float]:
+        """Локальный token bucket (та же логика, что и в Redis скрипте)"""
+        now = time.monotonic()
+        self._local_tokens = min(self.burst, self._local_tokens + (now - self._local_ts) * self._local_rate)
+        self._local_ts = now
+        
+        if self._local_blocked_until > now:
+            return self._local_blocked_until - now, self._local_tokens, self._local_rate
+        if self._local_tokens >= 1:
+            self._local_tokens -= 1
+            return 0.0, self._local_tokens, self._local_rate
+        return (1 - self._local_tokens) / self._local_rate, self._local_tokens, self._local_rate
+    
+    async def _take_token(self) -> float:
+        """Попробовать взять токен; вернуть время ожидания (0 - токен получен)"""
+        try:
+            await self._client()
+            wait, tokens, rate = await self._acquire_script(
+                keys=[self.BUCKET_KEY],
+                args=[time.time(), self.max_rate, self.burst]
+            )
+            wait, tokens, rate = float(wait), float(tokens), float(rate)
+        except Exception as e:
+            self._stats["redis_fallbacks"] += 1
+            logger.debug(f"Fashn rate limiter falls back to local bucket: {e}")
+            wait, tokens, rate = self._take_local_token()
+        
+        self._stats["tokens"] = tokens
+        self._stats["rate"] = rate
+        return wait
+    
+    async def _take_in_flight_slot(self, slot_id: str) -> Optional[str]:
+        """
+        Занять слот для запроса "в полете" (общий лимит для всех процессов)
+        
+        Returns:
+            "redis" или "local" - где занят слот, None - лимит исчерпан
+        """
+        now = time.time()
+        try:
+            async with redis_service.pipeline() as pipe:
+                pipe.zremrangebyscore(self.IN_FLIGHT_KEY, 0, now - self.IN_FLIGHT_LEASE)
+                pipe.zadd(self.IN_FLIGHT_KEY, {slot_id: now})
+                pipe.zcard(self.IN_FLIGHT_KEY)
+                pipe.expire(self.IN_FLIGHT_KEY, self.IN_FLIGHT_LEASE)
+                in_flight = (await pipe.execute())[2]
+        except Exception as e:
+            self._stats["redis_fallbacks"] += 1
+            logger.debug(f"Fashn in-flight limiter falls back to local semaphore: {e}")
+            if self._local_in_flight().locked():
+                return None
+            await self._local_in_flight().acquire()
+            return "local"
+        
+        if in_flight <= self.max_in_flight:
+            return "redis"
+        
+        await redis_service.redis.zrem(self.IN_FLIGHT_KEY, slot_id)
+        return None
+    
+    async def _release_in_flight_slot(self, slot_id: str, mode: str):
+        """Освободить слот запроса"""
+        if mode == "local":
+            self._local_in_flight().release()
+            return
+        try:
+            await redis_service.redis.zrem(self.IN_FLIGHT_KEY, slot_id)
+        except Exception as e:
+            logger.warning(f"Failed to release Fashn in-flight slot: {e}")
+    
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Дождаться разрешения на запрос к Fashn API
+        
+        Raises:
+            asyncio.TimeoutError: Если разрешение не получено за acquire_timeout
+        """
+        slot_id = uuid.uuid4().hex
+        deadline = time.monotonic() + self.acquire_timeout
+        started_at = time.monotonic()
+        stats = self._stats
+        
+        stats["waiters"] += 1
+        try:
+            # Сначала токен скорости, затем слот параллельности
+            while True:
+                wait = await self._take_token()
+                if wait <= 0:
+                    break
+                if time.monotonic() + wait > deadline:
+                    raise asyncio.TimeoutError("Fashn rate limit wait timeout")
+                await asyncio.sleep(wait)
+            
+            while True:
+                slot_mode = await self._take_in_flight_slot(slot_id)
+                if slot_mode:
+                    break
+                if time.monotonic() + 0.1 > deadline:
+                    raise asyncio.TimeoutError("Fashn in-flight limit wait timeout")
+                await asyncio.sleep(0.1)
+        finally:
+            stats["waiters"] -= 1
+            stats["wait_time_total"] += time.monotonic() - started_at
+        
+        stats["in_flight"] += 1
+        try:
+            yield
+        finally:
+            stats["in_flight"] -= 1
+            await self._release_in_flight_slot(slot_id, slot_mode)
+    
+    async def observe_response(self, status: int, retry_after: Optional[str] = None):
+        """
+        Адаптировать скорость по ответу Fashn API
+        
+        Args:
+            status: HTTP статус ответа
+            retry_after: Значение заголовка Retry-After (секунды)
+        """
+        if status == 429:
+            self._stats["throttle_events"] += 1
+            blocked_for = 0.0
+            if retry_after:
+                try:
+                    blocked_for = float(retry_after)
+                except ValueError:
+                    blocked_for = 0.0
+            logger.warning(f"Fashn API throttled the client, backing off for {blocked_for:.1f}s")
+            await self._adjust_rate(self.THROTTLE_FACTOR, 0.0, blocked_for)
+        elif status < 400 and self._stats["rate"] < self.max_rate:
+            await self._adjust_rate(1.0, self.RECOVERY_STEP, 0.0)
+    
+    async def _adjust_rate(self, factor: float, step: float, blocked_for: float):
+        """Изменить текущую скорость (в Redis или локально)"""
+        try:
+            await self._client()
+            blocked_until = time.time() + blocked_for if blocked_for else 0
+            rate = await self._adjust_script(
+                keys=[self.BUCKET_KEY],
+                args=[self.max_rate, factor, step, self.min_rate, self.max_rate, blocked_until]
+            )
+            self._stats["rate"] = float(rate)
+        except Exception as e:
+            self._stats["redis_fallbacks"] += 1
+            logger.debug(f"Fashn rate limiter adjusts local bucket: {e}")
+            self._local_rate = max(self.min_rate, min(self.max_rate, self._local_rate * factor + step))
+            if blocked_for:
+                self._local_blocked_until = max(self._local_blocked_until, time.monotonic() + blocked_for)
+            self._stats["rate"] = self._local_rate
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Получить метрики ограничителя
+        
+        Returns:
+            Dict с последними известными токенами и скоростью, числом ожидающих
+            и событиями троттлинга
+        """
+        stats = dict(self._stats)
+        stats["max_rate"] = self.max_rate
+        stats["burst"] = self.burst
+        stats["max_in_flight"] = self.max_in_flight
+        return stats
+
+
+# Глобальный экземпляр
+fashn_governor = FashnRateGovernor()
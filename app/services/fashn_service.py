@@ -1,11 +1,22 @@
 import aiohttp
 import asyncio
+from contextlib import asynccontextmanager
 from typing import Optional, Dict, Any, Tuple
 from datetime import datetime
 from loguru import logger
 import os
+import time
+from urllib.parse import urlsplit
 from app.config import settings
 from app.services.ai_logging_service import ai_logging_service
+from app.services.ai_metrics import ai_metrics
+from app.services.fashn_rate_limiter import fashn_governor
+from app.utils.metrics import metrics
+
+
+fashn_latency = metrics.histogram(
+    "fashn_request_duration_seconds", "Fashn API request latency", ("endpoint", "status")
+)
 
 
 class FashnService:
@@ -26,6 +37,119 @@ class FashnService:
         
         if not self.api_key:
             logger.warning("⚠️ FASHN_API_KEY not configured")
+        
+        # Общая HTTP сессия с пулом соединений (создается в start())
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Блокировка создается в работающем event loop (в Python 3.9 она привязывается к loop при создании)
+        self._session_lock: Optional[asyncio.Lock] = None
+        self._pool_stats = {
+            "sessions_created": 0,
+            "requests_total": 0,
+            "requests_in_flight": 0,
+            "requests_in_flight_peak": 0,
+        }
+    
+    def _lock(self) -> asyncio.Lock:
+        """Получить блокировку сессии, создав ее при первом использовании"""
+        if self._session_lock is None:
+            self._session_lock = asyncio.Lock()
+        return self._session_lock
+    
+    async def start(self):
+        """Открыть общую HTTP сессию (вызывается при запуске бота/webhook сервера)"""
+        async with self._lock():
+            if self._session and not self._session.closed:
+                return
+            
+            connector = aiohttp.TCPConnector(
+                limit=self.settings.fashn_http_pool_limit,
+                limit_per_host=self.settings.fashn_http_pool_limit_per_host,
+                ttl_dns_cache=self.settings.fashn_http_dns_cache_ttl,
+                use_dns_cache=True,
+                keepalive_timeout=self.settings.fashn_http_keepalive_timeout,
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=self.settings.fashn_http_total_timeout,
+                connect=self.settings.fashn_http_connect_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=timeout,
+            )
+            self._pool_stats["sessions_created"] += 1
+            logger.info(
+                f"✅ Fashn HTTP session opened (limit={self.settings.fashn_http_pool_limit}, "
+                f"per_host={self.settings.fashn_http_pool_limit_per_host})"
+            )
+    
+    async def close(self):
+        """Закрыть общую HTTP сессию (вызывается при остановке)"""
+        async with self._lock():
+            if self._session and not self._session.closed:
+                await self._session.close()
+                logger.info("Fashn HTTP session closed")
+            self._session = None
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Получить общую HTTP сессию, открыв ее при необходимости"""
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+    
+    @asynccontextmanager
+    async def _request(self, method: str, url: str, **kwargs):
+        """
+        Выполнить запрос через общую сессию
+        
+        Запрос ждет разрешения ограничителя скорости, а ответ используется
+        для адаптации скорости (429 / Retry-After).
+        """
+        session = await self._get_session()
+        stats = self._pool_stats
+        
+        async with fashn_governor.slot():
+            stats["requests_total"] += 1
+            stats["requests_in_flight"] += 1
+            stats["requests_in_flight_peak"] = max(
+                stats["requests_in_flight_peak"], stats["requests_in_flight"]
+            )
+            # Метка - операция API (run, status, credits) без идентификаторов
+            endpoint = urlsplit(url).path.rsplit("/v1/", 1)[-1].split("/")[0]
+            status = "error"
+            started = time.perf_counter()
+            try:
+                async with session.request(method, url, **kwargs) as response:
+                    status = str(response.status)
+                    await fashn_governor.observe_response(
+                        response.status, response.headers.get("Retry-After")
+                    )
+                    yield response
+            finally:
+                stats["requests_in_flight"] -= 1
+                fashn_latency.observe(time.perf_counter() - started, endpoint, status)
+    
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """
+        Получить счетчики использования пула соединений
+        
+        Returns:
+            Dict со счетчиками запросов и состоянием коннектора
+        """
+        stats = dict(self._pool_stats)
+        stats["limit"] = self.settings.fashn_http_pool_limit
+        stats["limit_per_host"] = self.settings.fashn_http_pool_limit_per_host
+        
+        connector = self._session.connector if self._session and not self._session.closed else None
+        if connector is not None:
+            # aiohttp не предоставляет публичного API для состояния пула
+            stats["connections_acquired"] = len(getattr(connector, "_acquired", ()))
+            stats["connections_idle"] = sum(
+                len(conns) for conns in getattr(connector, "_conns", {}).values()
+            )
+        else:
+            stats["connections_acquired"] = 0
+            stats["connections_idle"] = 0
+        return stats
     
     async def submit_tryon_request(
         self, 
@@ -44,11 +168,31 @@ class FashnService:
         Returns:
             Tuple[success, message, prediction_id]
         """
+        success, message, prediction_id, _ = await self.submit_tryon_request_detailed(
+            user_photo_url, clothing_photo_url, user_id
+        )
+        return success, message, prediction_id
+    
+    async def submit_tryon_request_detailed(
+        self, 
+        user_photo_url: str, 
+        clothing_photo_url: str,
+        user_id: int
+    ) -> Tuple[bool, str, Optional[str], bool]:
+        """
+        Отправляет запрос на генерацию try-on и сообщает, можно ли его повторить
+        
+        Повторять имеет смысл временные ошибки: 429 (кроме нехватки кредитов),
+        5xx и сетевые ошибки.
+        
+        Returns:
+            Tuple[success, message, prediction_id, retryable]
+        """
         if not self.api_key:
-            return False, "❌ Fashn API ключ не настроен", None
+            return False, "❌ Fashn API ключ не настроен", None, False
             
         if not self.webhook_url:
-            return False, "❌ Webhook URL не настроен", None
+            return False, "❌ Webhook URL не настроен", None, False
         
         start_time = datetime.now()
         
@@ -75,80 +219,86 @@ class FashnService:
         )
         
         try:
-            async with aiohttp.ClientSession() as session:
-                # Подготавливаем данные запроса
-                payload = {
-                    "model_name": self.model_name,
-                    "inputs": {
-                        "model_image": user_photo_url,
-                        "garment_image": clothing_photo_url,
-                        "category": self.settings.fashn_category,
-                        "segmentation_free": self.settings.fashn_segmentation_free,
-                        "moderation_level": self.settings.fashn_moderation_level,
-                        "garment_photo_type": self.settings.fashn_garment_photo_type,
-                        "mode": self.settings.fashn_mode,
-                        "seed": self.settings.fashn_seed,
-                        "num_samples": self.settings.fashn_num_samples,
-                        "output_format": self.settings.fashn_output_format,
-                        "return_base64": self.settings.fashn_return_base64
-                    }
-                }
-                
-                headers = {
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {self.api_key}"
+            # Подготавливаем данные запроса
+            payload = {
+                "model_name": self.model_name,
+                "inputs": {
+                    "model_image": user_photo_url,
+                    "garment_image": clothing_photo_url,
+                    "category": self.settings.fashn_category,
+                    "segmentation_free": self.settings.fashn_segmentation_free,
+                    "moderation_level": self.settings.fashn_moderation_level,
+                    "garment_photo_type": self.settings.fashn_garment_photo_type,
+                    "mode": self.settings.fashn_mode,
+                    "seed": self.settings.fashn_seed,
+                    "num_samples": self.settings.fashn_num_samples,
+                    "output_format": self.settings.fashn_output_format,
+                    "return_base64": self.settings.fashn_return_base64
                 }
+            }
+            
+            headers = {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {self.api_key}"
+            }
+            
+            # Добавляем webhook URL к запросу
+            webhook_url = f"{self.api_url}/v1/run?webhook_url={self.webhook_url}"
+            
+            logger.info(f"Submitting Fashn request for user {user_id}")
+            
+            async with self._request("POST", webhook_url, json=payload, headers=headers) as response:
+                response_data = await response.json()
                 
-                # Добавляем webhook URL к запросу
-                webhook_url = f"{self.api_url}/v1/run?webhook_url={self.webhook_url}"
-                
-                logger.info(f"Submitting Fashn request for user {user_id}")
-                
-                async with session.post(webhook_url, json=payload, headers=headers) as response:
-                    response_data = await response.json()
+                if response.status == 200:
+                    prediction_id = response_data.get("id")
+                    if prediction_id:
+                        logger.info(f"Fashn request submitted successfully. Prediction ID: {prediction_id}")
+                        return True, f"✅ Запрос отправлен в Fashn AI. ID: {prediction_id}", prediction_id, False
+                    else:
+                        error_msg = response_data.get("error", "Неизвестная ошибка")
+                        return False, f"❌ Ошибка Fashn API: {error_msg}", None, False
+                else:
+                    # Обработка API-level ошибок
+                    error_data = response_data.get("error", "Неизвестная ошибка")
+                    error_message = response_data.get("message", str(error_data))
                     
-                    if response.status == 200:
-                        prediction_id = response_data.get("id")
-                        if prediction_id:
-                            logger.info(f"Fashn request submitted successfully. Prediction ID: {prediction_id}")
-                            return True, f"✅ Запрос отправлен в Fashn AI. ID: {prediction_id}", prediction_id
+                    if response.status == 400:
+                        return False, f"❌ Неверный запрос: {error_message}", None, False
+                    elif response.status == 401:
+                        return False, "❌ Неверный API ключ Fashn", None, False
+                    elif response.status == 404:
+                        return False, "❌ Ресурс не найден", None, False
+                    elif response.status == 429:
+                        if "OutOfCredits" in str(error_data):
+                            return False, "❌ Недостаточно кредитов в Fashn", None, False
                         else:
-                            error_msg = response_data.get("error", "Неизвестная ошибка")
-                            return False, f"❌ Ошибка Fashn API: {error_msg}", None
+                            return False, "❌ Превышен лимит запросов. Попробуйте позже", None, True
+                    elif response.status == 500:
+                        return False, "❌ Внутренняя ошибка сервера Fashn", None, True
                     else:
-                        # Обработка API-level ошибок
-                        error_data = response_data.get("error", "Неизвестная ошибка")
-                        error_message = response_data.get("message", str(error_data))
+                        retryable = response.status >= 500
+                        return False, f"❌ Ошибка Fashn API ({response.status}): {error_message}", None, retryable
                         
-                        if response.status == 400:
-                            return False, f"❌ Неверный запрос: {error_message}", None
-                        elif response.status == 401:
-                            return False, "❌ Неверный API ключ Fashn", None
-                        elif response.status == 404:
-                            return False, "❌ Ресурс не найден", None
-                        elif response.status == 429:
-                            if "OutOfCredits" in str(error_data):
-                                return False, "❌ Недостаточно кредитов в Fashn", None
-                            else:
-                                return False, "❌ Превышен лимит запросов. Попробуйте позже", None
-                        elif response.status == 500:
-                            return False, "❌ Внутренняя ошибка сервера Fashn", None
-                        else:
-                            return False, f"❌ Ошибка Fashn API ({response.status}): {error_message}", None
-                            
-        except aiohttp.ClientError as e:
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             logger.error(f"Network error during Fashn request: {e}")
-            return False, "❌ Ошибка сети при обращении к Fashn API", None
+            return False, "❌ Ошибка сети при обращении к Fashn API", None, True
         except Exception as e:
             logger.error(f"Unexpected error during Fashn request: {e}")
-            return False, f"❌ Неожиданная ошибка: {str(e)}", None
+            return False, f"❌ Неожиданная ошибка: {str(e)}", None, False
     
-    async def process_webhook_callback(self, webhook_data: Dict[str, Any]) -> Tuple[bool, str]:
+    async def process_webhook_callback(
+        self,
+        webhook_data: Dict[str, Any],
+        user_context: Optional[Dict[str, Any]] = None
+    ) -> Tuple[bool, str]:
         """
         Обрабатывает webhook callback от Fashn AI
         
         Args:
             webhook_data: Данные webhook от Fashn AI
+            user_context: Контекст генерации из fashn_prediction:{id}
+                (пользователь, время отправки, модель и режим)
             
         Returns:
             Tuple[success, message]
@@ -160,20 +310,31 @@ class FashnService:
             
             logger.info(f"Processing Fashn webhook: {prediction_id}, status: {status}")
             
+            user_context = user_context or {}
+            user_id = user_context.get("user_id", 0)
+            # Время от отправки запроса до результата
+            latency = None
+            if user_context.get("start_time"):
+                latency = (datetime.now() - datetime.fromisoformat(user_context["start_time"])).total_seconds()
+            model = user_context.get("model_name", self.model_name)
+            mode = user_context.get("mode", self.settings.fashn_mode)
+            
             if status == "completed":
                 output_urls = webhook_data.get("output", [])
                 if output_urls:
                     # Логируем успешный ответ
                     await ai_logging_service.log_ai_response(
-                        user_id=0,  # TODO: Получить user_id из контекста
+                        user_id=user_id,
                         service_name="Fashn",
                         response_data={"output_urls": output_urls},
-                        processing_time=0,  # TODO: Вычислить время обработки
+                        processing_time=latency or 0,
                         success=True
                     )
+                    await ai_metrics.record("Fashn", model, mode, user_id, latency, success=True)
                     
                     return True, f"✅ Генерация завершена! Результат: {output_urls[0]}"
                 else:
+                    await ai_metrics.record("Fashn", model, mode, user_id, latency, success=False, error_name="EmptyOutput")
                     return False, "❌ Генерация завершена, но результат не получен"
                     
             elif status == "failed":
@@ -182,13 +343,14 @@ class FashnService:
                 
                 # Логируем ошибку
                 await ai_logging_service.log_ai_response(
-                    user_id=0,  # TODO: Получить user_id из контекста
+                    user_id=user_id,
                     service_name="Fashn",
                     response_data={"error": error_name, "message": error_message},
-                    processing_time=0,
+                    processing_time=latency or 0,
                     success=False,
                     error_message=error_message
                 )
+                await ai_metrics.record("Fashn", model, mode, user_id, latency, success=False, error_name=error_name)
                 
                 # Обработка различных типов ошибок
                 if error_name == "ImageLoadError":
@@ -211,6 +373,37 @@ class FashnService:
             logger.error(f"Error processing Fashn webhook: {e}")
             return False, f"❌ Ошибка обработки webhook: {str(e)}"
     
+    async def get_prediction_status(self, prediction_id: str) -> Tuple[bool, str, Optional[Dict[str, Any]]]:
+        """
+        Получает статус генерации (используется, если webhook не пришел)
+        
+        Args:
+            prediction_id: ID генерации в Fashn AI
+        
+        Returns:
+            Tuple[success, message, status_data] - status_data имеет тот же
+            формат, что и данные webhook (id, status, output, error)
+        """
+        if not self.api_key:
+            return False, "❌ Fashn API ключ не настроен", None
+        
+        try:
+            headers = {
+                "Authorization": f"Bearer {self.api_key}"
+            }
+            
+            async with self._request("GET", f"{self.api_url}/v1/status/{prediction_id}", headers=headers) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    data.setdefault("id", prediction_id)
+                    return True, f"⏳ Статус: {data.get('status')}", data
+                else:
+                    return False, f"❌ Ошибка получения статуса: {response.status}", None
+        
+        except Exception as e:
+            logger.error(f"Error getting Fashn prediction status {prediction_id}: {e}")
+            return False, f"❌ Ошибка получения статуса: {str(e)}", None
+    
     async def get_credits_balance(self) -> Tuple[bool, str, Optional[int]]:
         """
         Получает баланс кредитов Fashn AI
@@ -222,18 +415,17 @@ class FashnService:
             return False, "❌ Fashn API ключ не настроен", None
             
         try:
-            async with aiohttp.ClientSession() as session:
-                headers = {
-                    "Authorization": f"Bearer {self.api_key}"
-                }
-                
-                async with session.get(f"{self.api_url}/v1/credits", headers=headers) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        credits = data.get("credits", 0)
-                        return True, f"✅ Кредитов: {credits}", credits
-                    else:
-                        return False, f"❌ Ошибка получения баланса: {response.status}", None
+            headers = {
+                "Authorization": f"Bearer {self.api_key}"
+            }
+            
+            async with self._request("GET", f"{self.api_url}/v1/credits", headers=headers) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    credits = data.get("credits", 0)
+                    return True, f"✅ Кредитов: {credits}", credits
+                else:
+                    return False, f"❌ Ошибка получения баланса: {response.status}", None
                         
         except Exception as e:
             logger.error(f"Error getting Fashn credits: {e}")
@@ -0,0 +1,200 @@
+import asyncio
+import json
+import os
+import socket
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from loguru import logger
+from redis.exceptions import ResponseError
+
+from app.config import settings
+from app.services.redis_service import redis_service
+
+
+class FashnWebhookStream:
+    """
+    Надежный прием webhook'ов Fashn через Redis Stream
+    
+    Endpoint только сохраняет webhook в stream и сразу отвечает, а доставку
+    результата выполняют потребители группы. Сообщение подтверждается (XACK)
+    только после успешной обработки, поэтому webhook не теряется при падении
+    процесса (at-least-once): неподтвержденные сообщения забираются другими
+    потребителями через XAUTOCLAIM. Повторная доставка пользователю
+    исключается закреплением по prediction_id в обработчике.
+    """
+    
+    STREAM_KEY = "fashn:webhooks"
+    GROUP = "fashn-delivery"
+    DEAD_KEY = "fashn:webhooks:dead"
+    ATTEMPTS_KEY = "fashn:webhooks:attempts:{message_id}"
+    
+    # Результаты обработчика, при которых сообщение нужно обработать повторно
+    RETRY_RESULTS = ("in_progress",)
+    
+    def __init__(self):
+        # Определяем, какая конфигурация использовать
+        if os.getenv("RAILWAY_ENVIRONMENT") or os.getenv("RAILWAY_PROJECT_ID"):
+            from app import config_prod
+            self.settings = config_prod.settings
+        else:
+            self.settings = settings
+        
+        self.maxlen = self.settings.fashn_webhook_stream_maxlen
+        self.consumers_count = self.settings.fashn_webhook_consumers
+        self.claim_idle_ms = int(self.settings.fashn_webhook_claim_idle * 1000)
+        self.max_deliveries = self.settings.fashn_webhook_max_deliveries
+        self.batch_size = 10
+        
+        self.consumer_name = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._handler: Optional[Callable[[Dict[str, Any]], Awaitable[str]]] = None
+        self._tasks: List[asyncio.Task] = []
+        self._stats = {
+            "published": 0,
+            "peak_payload_bytes": 0,
+            "processed": 0,
+            "retried": 0,
+            "dead": 0,
+            "errors": 0,
+        }
+    
+    async def _client(self):
+        """Получить клиент Redis, подключившись при необходимости"""
+        if not redis_service.redis:
+            await redis_service.connect()
+        return redis_service.redis
+    
+    async def publish(self, payload: Dict[str, Any], raw_payload: Optional[bytes] = None) -> str:
+        """
+        Сохранить webhook в stream
+        
+        Args:
+            payload: Разобранные данные webhook
+            raw_payload: Исходное тело запроса - сохраняется без повторной
+                сериализации (base64 результаты занимают мегабайты)
+        
+        Returns:
+            str: ID сообщения в stream
+        """
+        client = await self._client()
+        message_id = await client.xadd(
+            self.STREAM_KEY,
+            {
+                "payload": raw_payload if raw_payload is not None else json.dumps(payload),
+                "prediction_id": str(payload.get("id"))
+            },
+            maxlen=self.maxlen,
+            approximate=True
+        )
+        self._stats["published"] += 1
+        if raw_payload is not None:
+            self._stats["peak_payload_bytes"] = max(self._stats["peak_payload_bytes"], len(raw_payload))
+        return message_id
+    
+    async def start(self, handler: Callable[[Dict[str, Any]], Awaitable[str]]):
+        """
+        Запустить потребителей группы
+        
+        Args:
+            handler: Обработчик webhook (возвращает статус доставки)
+        """
+        if self._tasks:
+            return
+        
+        client = await self._client()
+        try:
+            await client.xgroup_create(self.STREAM_KEY, self.GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            # Группа уже создана другим процессом
+            if "BUSYGROUP" not in str(e):
+                raise
+        
+        self._handler = handler
+        self._tasks = [
+            asyncio.create_task(self._consume(f"{self.consumer_name}-{index}"))
+            for index in range(self.consumers_count)
+        ]
+        logger.info(f"✅ Fashn webhook stream consumers started ({self.consumers_count})")
+    
+    async def stop(self):
+        """Остановить потребителей (неподтвержденные сообщения заберут другие)"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    async def _consume(self, consumer: str):
+        """Читать и обрабатывать сообщения группы"""
+        client = await self._client()
+        while True:
+            try:
+                # Сначала сообщения, зависшие у упавших или медленных потребителей
+                claimed = await client.xautoclaim(
+                    self.STREAM_KEY, self.GROUP, consumer,
+                    min_idle_time=self.claim_idle_ms, start_id="0-0", count=self.batch_size
+                )
+                for message_id, fields in claimed[1]:
+                    self._stats["retried"] += 1
+                    await self._handle(client, message_id, fields)
+                
+                entries = await client.xreadgroup(
+                    self.GROUP, consumer, {self.STREAM_KEY: ">"}, count=self.batch_size, block=1000
+                )
+                for _, messages in entries or []:
+                    for message_id, fields in messages:
+                        await self._handle(client, message_id, fields)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"Fashn webhook consumer {consumer} failed: {e}")
+                await asyncio.sleep(1)
+    
+    async def _handle(self, client, message_id: str, fields: Optional[Dict[str, str]]):
+        """Обработать одно сообщение и подтвердить его"""
+        if not fields:
+            # Сообщение удалено из stream (обрезка по maxlen)
+            await client.xack(self.STREAM_KEY, self.GROUP, message_id)
+            return
+        
+        attempts_key = self.ATTEMPTS_KEY.format(message_id=message_id)
+        try:
+            result = await self._handler(json.loads(fields["payload"]))
+        except Exception as e:
+            attempts = await client.incr(attempts_key)
+            await client.expire(attempts_key, 86400)
+            logger.error(
+                f"Fashn webhook {message_id} failed (attempt {attempts}/{self.max_deliveries}): {e}"
+            )
+            if attempts >= self.max_deliveries:
+                # Сообщение не обрабатывается - убираем его, чтобы не блокировать группу
+                async with redis_service.pipeline() as pipe:
+                    pipe.lpush(self.DEAD_KEY, fields["payload"])
+                    pipe.xack(self.STREAM_KEY, self.GROUP, message_id)
+                    pipe.delete(attempts_key)
+                self._stats["dead"] += 1
+            return
+        
+        if result in self.RETRY_RESULTS:
+            # Доставка идет в другом месте - проверим еще раз после claim_idle
+            return
+        
+        async with redis_service.pipeline() as pipe:
+            pipe.xack(self.STREAM_KEY, self.GROUP, message_id)
+            pipe.delete(attempts_key)
+        self._stats["processed"] += 1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Получить счетчики приема webhook'ов
+        
+        Returns:
+            Dict с количеством принятых, обработанных, повторных и отброшенных сообщений
+        """
+        stats: Dict[str, Any] = dict(self._stats)
+        stats["consumers"] = len(self._tasks)
+        return stats
+
+
+# Глобальный экземпляр
+fashn_webhook_stream = FashnWebhookStream()
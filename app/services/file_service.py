@@ -1,7 +1,9 @@
 # file_utils удален, используем прямую интеграцию с Cloudinary
-import cloudinary
-import cloudinary.uploader
+import io
+from app.services.cloudinary_executor import CloudinaryBusy, cloudinary_executor
+from app.services.tryon_cache import tryon_cache
 from app.utils.validators import image_validator
+from app.utils.image_processing import image_processor
 from app.models.photo import PhotoType
 from app.database.async_session import get_async_session
 from app.models.photo import UserPhoto
@@ -25,39 +27,38 @@ class FileService:
         """
         Загрузить фото пользователя в Cloudinary
         
+        Фото скачивается один раз: тот же буфер валидируется и после
+        поворота, уменьшения и перекодирования загружается в Cloudinary.
+        
         Returns:
             Tuple[cloudinary_url, public_id, error_message]
         """
         try:
-            # Валидируем фото
+            # Скачиваем и валидируем фото
             if photo_type == PhotoType.USER_PHOTO:
-                is_valid, error = await image_validator.validate_user_photo(photo_url)
+                image_data, error = await image_validator.load_user_photo(photo_url)
             else:
-                is_valid, error = await image_validator.validate_clothing_photo(photo_url)
+                image_data, error = await image_validator.load_clothing_photo(photo_url)
             
-            if not is_valid:
+            if image_data is None:
                 return None, None, error
             
             # Проверяем, настроен ли Cloudinary
-            from app.config import settings
-            if not settings.cloudinary_cloud_name or not settings.cloudinary_api_key:
+            if not cloudinary_executor.is_configured:
                 logger.warning("Cloudinary not configured, using fallback mode")
                 # Fallback режим - используем оригинальный URL от Telegram
                 public_id = f"telegram_{user_id}_{photo_type.value}_{int(time.time())}"
+                await tryon_cache.remember_photo_hash(photo_url, image_data)
                 return photo_url, public_id, None
             
-            # Настраиваем Cloudinary
-            cloudinary.config(
-                cloud_name=settings.cloudinary_cloud_name,
-                api_key=settings.cloudinary_api_key,
-                api_secret=settings.cloudinary_api_secret
-            )
+            # Поворачиваем по EXIF, уменьшаем и перекодируем перед загрузкой
+            image_data = await FileService.prepare_for_upload(image_data)
             
-            # Загружаем в Cloudinary
+            # Загружаем в Cloudinary (в пуле потоков, не блокируя event loop)
             folder = f"{folder_prefix}/{user_id}/{photo_type.value}"
             try:
-                result = cloudinary.uploader.upload(
-                    photo_url,
+                result = await cloudinary_executor.upload(
+                    io.BytesIO(image_data),
                     folder=folder,
                     resource_type="image",
                     quality="auto",
@@ -65,13 +66,20 @@ class FileService:
                 )
                 cloudinary_url = result["secure_url"]
                 public_id = result["public_id"]
+            except CloudinaryBusy as e:
+                logger.warning(f"Cloudinary upload rejected: {e}")
+                return None, None, "Сервис загрузки фото перегружен"
             except Exception as e:
                 logger.warning(f"Cloudinary upload failed: {e}, using fallback mode")
                 # Fallback режим - используем оригинальный URL от Telegram
                 public_id = f"telegram_{user_id}_{photo_type.value}_{int(time.time())}"
+                await tryon_cache.remember_photo_hash(photo_url, image_data)
                 return photo_url, public_id, None
             logger.info(f"Uploaded {photo_type} photo for user {user_id}")
             
+            # Хеш фото нужен для кеша результатов try-on
+            await tryon_cache.remember_photo_hash(cloudinary_url, image_data)
+            
             return cloudinary_url, public_id, None
             
         except Exception as e:
@@ -82,6 +90,30 @@ class FileService:
             public_id = f"telegram_{user_id}_{photo_type.value}_{int(time.time())}"
             return photo_url, public_id, None
     
+    @staticmethod
+    async def prepare_for_upload(image_data: bytes) -> bytes:
+        """
+        Подготовить фото к загрузке в пуле обработки изображений
+        
+        При ошибке или заполненной очереди возвращается исходное фото.
+        
+        Returns:
+            bytes: Повернутое, уменьшенное и перекодированное фото
+        """
+        try:
+            processed, info = await image_processor.normalize(image_data)
+        except Exception as e:
+            logger.warning(f"Image normalization skipped: {e}")
+            return image_data
+        
+        if info["changed"]:
+            logger.info(
+                f"Normalized photo {info['format']} {info['width']}x{info['height']} "
+                f"({info['bytes_in'] // 1024}KB) -> {info['output_format']} "
+                f"{info['output_width']}x{info['output_height']} ({info['bytes_out'] // 1024}KB)"
+            )
+        return processed
+    
     @staticmethod
     async def save_photo_to_database(
         session: AsyncSession,
@@ -103,7 +135,7 @@ class FileService:
         if old_photo:
             # Удаляем старое фото из Cloudinary
             try:
-                cloudinary.uploader.destroy(old_photo.cloudinary_public_id)
+                await cloudinary_executor.destroy(old_photo.cloudinary_public_id)
             except Exception as e:
                 logger.warning(f"Failed to delete old photo from Cloudinary: {e}")
             await session.delete(old_photo)
@@ -117,8 +149,8 @@ class FileService:
         )
         
         session.add(user_photo)
+        # id заполняется при flush, а expire_on_commit=False - повторно читать строку не нужно
         await session.commit()
-        await session.refresh(user_photo)
         
         logger.info(f"Saved {photo_type} photo to database for user {user_id}")
         return user_photo
@@ -143,7 +175,7 @@ class FileService:
             # Удаляем из Cloudinary
             if photo.cloudinary_public_id:
                 try:
-                    cloudinary.uploader.destroy(photo.cloudinary_public_id)
+                    await cloudinary_executor.destroy(photo.cloudinary_public_id)
                 except Exception as e:
                     logger.warning(f"Failed to delete photo from Cloudinary: {e}")
             
@@ -160,7 +192,7 @@ class FileService:
     async def get_photo_info(public_id: str) -> Optional[dict]:
         """Получить информацию о фото"""
         try:
-            result = cloudinary.api.resource(public_id)
+            result = await cloudinary_executor.resource(public_id)
             return {
                 "url": result["secure_url"],
                 "width": result["width"],
@@ -0,0 +1,325 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from app.config import settings
+from app.utils.metrics import metrics
+
+
+# Границы гистограммы задержки event loop (секунды)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+loop_lag = metrics.histogram("event_loop_lag_seconds", "Event loop scheduling lag", buckets=LAG_BUCKETS)
+slow_callbacks = metrics.counter(
+    "event_loop_slow_callbacks_total", "Callbacks that blocked the event loop", ("operation",)
+)
+
+# Операция, от имени которой выполняется код: обработчик aiogram или маршрут FastAPI.
+# Задачи, созданные внутри операции, наследуют значение.
+current_operation: ContextVar[Optional[str]] = ContextVar("loop_operation", default=None)
+
+_original_handle_run = asyncio.events.Handle._run
+
+# Каталог пакета app - по нему место блокировки ищется в коде приложения
+_APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class EventLoopMonitor:
+    """
+    Измерение задержки event loop и поиск блокирующих вызовов
+    
+    Фоновая задача засыпает на interval секунд и измеряет, насколько позже
+    она проснулась. Задержка показывает, сколько ждет любая готовая к
+    выполнению корутина, пока loop занят синхронным кодом.
+    
+    Кроме того, замеряется каждый callback loop (шаг задачи, таймер).
+    Это работает только в стандартном asyncio loop: uvloop ставится вместе
+    с uvicorn[standard], и aiogram включает его при импорте. Точки входа
+    вызывают use_profiled_event_loop() до создания loop; при запуске через
+    CLI uvicorn нужен --loop asyncio.
+    Если callback выполняется дольше slow_callback_threshold, сторожевой
+    поток снимает стек основного потока, пока тот еще заблокирован, и
+    вызов учитывается вместе с операцией (current_operation). Худшие
+    места доступны через get_offenders() и раз в summary_interval
+    секунд пишутся в лог.
+    """
+    
+    # Сколько разных мест блокировки хранить
+    MAX_OFFENDERS = 100
+    # Сколько кадров стека сохранять
+    STACK_DEPTH = 12
+    
+    def __init__(self):
+        # Определяем, какая конфигурация использовать
+        if os.getenv("RAILWAY_ENVIRONMENT") or os.getenv("RAILWAY_PROJECT_ID"):
+            from app import config_prod
+            self.settings = config_prod.settings
+        else:
+            self.settings = settings
+        
+        self.interval = self.settings.loop_monitor_interval
+        self.slow_callback_threshold = self.settings.loop_slow_callback_threshold
+        self.summary_interval = self.settings.loop_monitor_summary_interval
+        
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._watchdog_stop = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        # (handle, время начала) выполняющегося callback - читается сторожевым потоком
+        self._running: Optional[Tuple[asyncio.Handle, float]] = None
+        # (handle, стек, место, операция), снятые сторожевым потоком во время блокировки
+        self._captured: Optional[Tuple[asyncio.Handle, List[str], str, Optional[str]]] = None
+        self._offenders: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._stats = {"samples": 0, "lag_last": 0.0, "lag_max": 0.0, "slow_callbacks": 0}
+        self._window = {"lag_max": 0.0, "slow_callbacks": 0}
+    
+    async def start(self):
+        """Запустить измерение (повторный вызов ничего не делает)"""
+        if self._task is not None and not self._task.done():
+            return
+        
+        self._task = asyncio.create_task(self._run())
+        if self.slow_callback_threshold > 0:
+            if isinstance(asyncio.get_running_loop(), asyncio.BaseEventLoop):
+                self._install_profiler()
+            else:
+                # Callback'и uvloop выполняются в C и не замеряются
+                logger.warning(
+                    "Slow callback profiling requires the default asyncio loop (uvloop is active; "
+                    "call use_profiled_event_loop() or run uvicorn with --loop asyncio), measuring lag only"
+                )
+        logger.info(
+            f"Event loop monitor started (interval={self.interval}s, "
+            f"slow_callback_threshold={self.slow_callback_threshold}s)"
+        )
+    
+    async def stop(self):
+        """Остановить измерение"""
+        self._uninstall_profiler()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    def _install_profiler(self):
+        """Замерять callback'и loop и запустить сторожевой поток"""
+        monitor = self
+        
+        def timed_run(handle: asyncio.Handle):
+            started = time.perf_counter()
+            monitor._running = (handle, started)
+            try:
+                _original_handle_run(handle)
+            finally:
+                monitor._running = None
+                duration = time.perf_counter() - started
+                if duration >= monitor.slow_callback_threshold:
+                    monitor._record_slow(handle, duration)
+        
+        self._loop_thread_id = threading.get_ident()
+        asyncio.events.Handle._run = timed_run
+        
+        self._watchdog_stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+    
+    def _uninstall_profiler(self):
+        """Вернуть исходный Handle._run и остановить сторожевой поток"""
+        asyncio.events.Handle._run = _original_handle_run
+        if self._watchdog is not None:
+            self._watchdog_stop.set()
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+    
+    def _watch(self):
+        """Снять стек основного потока, если callback выполняется слишком долго"""
+        while not self._watchdog_stop.wait(self.slow_callback_threshold / 2):
+            running = self._running
+            if running is None:
+                continue
+            handle, started = running
+            if time.perf_counter() - started < self.slow_callback_threshold:
+                continue
+            captured = self._captured
+            if captured is not None and captured[0] is handle:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            frames = traceback.extract_stack(frame)
+            # Кадры loop до timed_run не интересны
+            for index in range(len(frames) - 1, -1, -1):
+                if frames[index].name == "timed_run" and frames[index].filename == __file__:
+                    frames = frames[index + 1:]
+                    break
+            if not frames:
+                continue
+            stack = traceback.format_list(frames[-self.STACK_DEPTH:])
+            self._captured = (
+                handle, [line.rstrip() for line in stack], self._location(frames), self._operation(handle)
+            )
+    
+    @staticmethod
+    def _operation(handle: asyncio.Handle) -> Optional[str]:
+        """Операция, в контексте которой выполняется callback"""
+        try:
+            return handle._context.get(current_operation)
+        except Exception:
+            return None
+    
+    @staticmethod
+    def _describe(handle: asyncio.Handle) -> str:
+        """Имя callback: корутина задачи или функция"""
+        callback = handle._callback
+        owner = getattr(callback, "__self__", None)
+        if isinstance(owner, asyncio.Task):
+            return owner.get_coro().__qualname__
+        return getattr(callback, "__qualname__", repr(callback))
+    
+    @staticmethod
+    def _location(frames: traceback.StackSummary) -> str:
+        """Самый глубокий кадр кода приложения ("файл:строка в функции")"""
+        for frame in reversed(frames):
+            if frame.filename.startswith(_APP_DIR + os.sep):
+                return f"{os.path.relpath(frame.filename, os.path.dirname(_APP_DIR))}:{frame.lineno} in {frame.name}"
+        frame = frames[-1]
+        return f"{frame.filename}:{frame.lineno} in {frame.name}"
+    
+    def _record_slow(self, handle: asyncio.Handle, duration: float):
+        """Учесть блокирующий callback"""
+        callback = self._describe(handle)
+        stack, location, operation = None, callback, None
+        captured = self._captured
+        if captured is not None and captured[0] is handle:
+            # Операция на момент блокировки (к концу callback ее могли уже сбросить)
+            _, stack, location, operation = captured
+            self._captured = None
+        operation = operation or self._operation(handle) or "unattributed"
+        key = (operation, location)
+        
+        offender = self._offenders.get(key)
+        if offender is None:
+            if len(self._offenders) >= self.MAX_OFFENDERS:
+                # Вытесняем место с наименьшим суммарным временем
+                del self._offenders[min(self._offenders, key=lambda k: self._offenders[k]["total_time"])]
+            offender = self._offenders[key] = {
+                "operation": operation,
+                "location": location,
+                "callback": callback,
+                "count": 0,
+                "total_time": 0.0,
+                "max_time": 0.0,
+                "stack": None,
+            }
+        offender["count"] += 1
+        offender["total_time"] += duration
+        offender["max_time"] = max(offender["max_time"], duration)
+        offender["last_at"] = time.time()
+        if stack:
+            offender["stack"] = stack
+        
+        self._stats["slow_callbacks"] += 1
+        self._window["slow_callbacks"] += 1
+        slow_callbacks.inc(operation)
+        logger.debug("Slow callback {} ({}) blocked the loop for {:.3f}s at {}", callback, operation, duration, location)
+    
+    async def _run(self):
+        """Периодически измерять задержку пробуждения и писать сводку"""
+        loop = asyncio.get_running_loop()
+        next_summary = loop.time() + self.summary_interval
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            lag = max(now - expected, 0.0)
+            loop_lag.observe(lag)
+            self._stats["samples"] += 1
+            self._stats["lag_last"] = lag
+            self._stats["lag_max"] = max(self._stats["lag_max"], lag)
+            self._window["lag_max"] = max(self._window["lag_max"], lag)
+            
+            if self.summary_interval > 0 and now >= next_summary:
+                next_summary = now + self.summary_interval
+                self._log_summary()
+    
+    def _log_summary(self):
+        """Записать в лог худшие блокирующие места за период"""
+        window, self._window = self._window, {"lag_max": 0.0, "slow_callbacks": 0}
+        if not window["slow_callbacks"]:
+            return
+        lines = [
+            f"{offender['total_time']:.2f}s total, {offender['count']}x, max {offender['max_time']:.3f}s - "
+            f"{offender['operation']} @ {offender['location']}"
+            for offender in self.get_offenders(limit=5)
+        ]
+        logger.warning(
+            "Event loop: {} slow callbacks, max lag {:.3f}s in the last {:.0f}s. Top offenders:\n{}",
+            window["slow_callbacks"], window["lag_max"], self.summary_interval, "\n".join(lines)
+        )
+    
+    def get_offenders(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Получить места, дольше всего блокировавшие loop
+        
+        Args:
+            limit: Сколько мест вернуть
+        
+        Returns:
+            List с операцией, местом в коде, числом вызовов, временем и стеком
+        """
+        offenders = sorted(self._offenders.values(), key=lambda item: -item["total_time"])[:limit]
+        return [
+            {
+                **offender,
+                "total_time": round(offender["total_time"], 3),
+                "max_time": round(offender["max_time"], 3),
+            }
+            for offender in offenders
+        ]
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Получить задержку event loop
+        
+        Returns:
+            Dict с последней и максимальной задержкой в секундах и числом блокирующих вызовов
+        """
+        return {
+            "samples": self._stats["samples"],
+            "lag_last": round(self._stats["lag_last"], 4),
+            "lag_max": round(self._stats["lag_max"], 4),
+            "slow_callbacks": self._stats["slow_callbacks"],
+            "slow_callback_threshold": self.slow_callback_threshold,
+            "profiling": self._watchdog is not None,
+            "running": self._task is not None and not self._task.done(),
+        }
+
+
+# Глобальный экземпляр
+loop_monitor = EventLoopMonitor()
+
+
+def use_profiled_event_loop() -> str:
+    """
+    Выбрать стандартный asyncio loop, если включено профилирование callback'ов
+    
+    aiogram при импорте ставит политику uvloop, а в uvloop callback'и не
+    замеряются. Вызывается точками входа до создания event loop.
+    
+    Returns:
+        str: Значение параметра loop для uvicorn ("asyncio" или "auto")
+    """
+    if loop_monitor.slow_callback_threshold <= 0:
+        return "auto"
+    asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
+    return "asyncio"
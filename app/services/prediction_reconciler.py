@@ -0,0 +1,241 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from loguru import logger
+
+from app.config import settings
+from app.services.fashn_service import fashn_service
+from app.services.redis_service import redis_service
+
+
+# Статусы Fashn, после которых результат больше не изменится
+TERMINAL_STATUSES = ("completed", "failed")
+
+
+class PredictionReconciler:
+    """
+    Опрос Fashn AI для генераций, по которым не пришел webhook
+    
+    Отправленные генерации регистрируются в sorted set с временем следующей
+    проверки. Фоновая задача периодически выбирает просроченные записи
+    небольшими пачками и запрашивает их статус (запросы проходят через общий
+    ограничитель скорости Fashn). Готовые результаты передаются в тот же
+    обработчик, что и webhook; повторная доставка исключается через claim().
+    """
+    
+    PENDING_KEY = "fashn:pending"
+    DELIVERED_KEY = "fashn_delivered:{prediction_id}"
+    CONTEXT_KEY = "fashn_prediction:{prediction_id}"
+    SWEEP_LOCK_KEY = "fashn:reconciler:lock"
+    
+    DELIVERED_TTL = 3600  # 1 час, как и контекст генерации
+    CLAIM_LEASE = 300  # Если доставка прервалась, ее можно повторить после этого времени
+    
+    def __init__(self):
+        # Определяем, какая конфигурация использовать
+        if os.getenv("RAILWAY_ENVIRONMENT") or os.getenv("RAILWAY_PROJECT_ID"):
+            from app import config_prod
+            self.settings = config_prod.settings
+        else:
+            self.settings = settings
+        
+        self.poll_after = self.settings.fashn_poll_after
+        self.poll_interval = self.settings.fashn_poll_interval
+        self.batch_size = self.settings.fashn_poll_batch_size
+        self.concurrency = self.settings.fashn_poll_concurrency
+        self.max_age = self.settings.fashn_poll_max_age
+        
+        self._deliver: Optional[Callable[[Dict[str, Any]], Awaitable[str]]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            "sweeps": 0,
+            "polled": 0,
+            "delivered": 0,
+            "duplicates": 0,
+            "still_pending": 0,
+            "timed_out": 0,
+            "expired": 0,
+            "errors": 0,
+            "last_batch": 0,
+        }
+    
+    async def _client(self):
+        """Получить клиент Redis, подключившись при необходимости"""
+        if not redis_service.redis:
+            await redis_service.connect()
+        return redis_service.redis
+    
+    async def track(self, prediction_id: str):
+        """Зарегистрировать отправленную генерацию для проверки опросом"""
+        client = await self._client()
+        await client.zadd(self.PENDING_KEY, {prediction_id: time.time() + self.poll_after})
+    
+    async def claim(self, prediction_id: str) -> Optional[str]:
+        """
+        Закрепить доставку результата за вызывающим
+        
+        Закрепление действует CLAIM_LEASE секунд: если доставка прервется
+        (падение процесса), ее сможет повторить webhook или опрос.
+        
+        Returns:
+            None - результат нужно доставить, "delivered" - уже доставлен,
+            "in_progress" - доставка выполняется в другом месте
+            (webhook и опрос не доставят результат дважды)
+        """
+        client = await self._client()
+        key = self.DELIVERED_KEY.format(prediction_id=prediction_id)
+        if await client.set(key, "in_progress", nx=True, ex=self.CLAIM_LEASE):
+            return None
+        
+        self._stats["duplicates"] += 1
+        return await client.get(key) or "in_progress"
+    
+    async def complete(self, prediction_id: str):
+        """Отметить результат как доставленный"""
+        async with redis_service.pipeline() as pipe:
+            pipe.set(self.DELIVERED_KEY.format(prediction_id=prediction_id), "delivered", ex=self.DELIVERED_TTL)
+            pipe.zrem(self.PENDING_KEY, prediction_id)
+    
+    async def release(self, prediction_id: str):
+        """Снять закрепление после неудачной доставки, чтобы ее можно было повторить"""
+        await redis_service.delete(self.DELIVERED_KEY.format(prediction_id=prediction_id))
+    
+    async def start(self, deliver: Callable[[Dict[str, Any]], Awaitable[str]]):
+        """
+        Запустить фоновый опрос
+        
+        Args:
+            deliver: Обработчик результата (тот же, что и для webhook)
+        """
+        if self._task and not self._task.done():
+            return
+        
+        self._deliver = deliver
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"✅ Fashn prediction reconciler started "
+            f"(poll after {self.poll_after}s, every {self.poll_interval}s)"
+        )
+    
+    async def stop(self):
+        """Остановить фоновый опрос"""
+        if self._task is None:
+            return
+        
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+    
+    async def _run(self):
+        """Периодически проверять зависшие генерации"""
+        while True:
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"Fashn prediction reconciler sweep failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+    
+    async def sweep(self) -> int:
+        """
+        Проверить одну пачку просроченных генераций
+        
+        Только один процесс выполняет проверку за интервал (блокировка в Redis).
+        
+        Returns:
+            int: Количество проверенных генераций
+        """
+        client = await self._client()
+        if not await client.set(self.SWEEP_LOCK_KEY, "1", nx=True, ex=max(1, int(self.poll_interval))):
+            return 0
+        
+        now = time.time()
+        prediction_ids = await client.zrangebyscore(
+            self.PENDING_KEY, 0, now, start=0, num=self.batch_size
+        )
+        self._stats["sweeps"] += 1
+        self._stats["last_batch"] = len(prediction_ids)
+        if not prediction_ids:
+            return 0
+        
+        contexts = await redis_service.mget(
+            [self.CONTEXT_KEY.format(prediction_id=prediction_id) for prediction_id in prediction_ids]
+        )
+        
+        expired: List[str] = []
+        to_poll = []
+        for prediction_id, raw_context in zip(prediction_ids, contexts):
+            if not raw_context:
+                # Контекст истек или результат уже доставлен - опрашивать нечего
+                expired.append(prediction_id)
+                continue
+            to_poll.append((prediction_id, json.loads(raw_context)))
+        
+        if expired:
+            self._stats["expired"] += len(expired)
+            await client.zrem(self.PENDING_KEY, *expired)
+        
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async def poll(prediction_id: str, context: Dict[str, Any]):
+            async with semaphore:
+                try:
+                    await self._poll_prediction(client, prediction_id, context)
+                except Exception as e:
+                    self._stats["errors"] += 1
+                    logger.error(f"Failed to reconcile Fashn prediction {prediction_id}: {e}")
+        
+        await asyncio.gather(*(poll(prediction_id, context) for prediction_id, context in to_poll))
+        return len(to_poll)
+    
+    async def _poll_prediction(self, client, prediction_id: str, context: Dict[str, Any]):
+        """Запросить статус генерации и доставить результат, если он готов"""
+        self._stats["polled"] += 1
+        success, message, status_data = await fashn_service.get_prediction_status(prediction_id)
+        
+        if success and status_data.get("status") in TERMINAL_STATUSES:
+            result = await self._deliver(status_data)
+            if result == "processed":
+                self._stats["delivered"] += 1
+                logger.info(f"Fashn prediction {prediction_id} delivered by polling")
+            return
+        
+        if not success:
+            self._stats["errors"] += 1
+            logger.warning(f"Failed to poll Fashn prediction {prediction_id}: {message}")
+        
+        started_at = context.get("start_time")
+        age = (datetime.now() - datetime.fromisoformat(started_at)).total_seconds() if started_at else 0
+        if age > self.max_age:
+            # Результата так и нет - сообщаем пользователю об ошибке тем же путем
+            self._stats["timed_out"] += 1
+            await self._deliver({
+                "id": prediction_id,
+                "status": "failed",
+                "error": {"name": "Timeout", "message": "Превышено время ожидания результата"}
+            })
+            return
+        
+        self._stats["still_pending"] += 1
+        await client.zadd(self.PENDING_KEY, {prediction_id: time.time() + self.poll_interval}, xx=True)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Получить счетчики опроса
+        
+        Returns:
+            Dict с количеством проверок, доставленных результатов и дубликатов
+        """
+        stats = dict(self._stats)
+        stats["running"] = self._task is not None and not self._task.done()
+        return stats
+
+
+# Глобальный экземпляр
+prediction_reconciler = PredictionReconciler()
@@ -1,8 +1,42 @@
 import redis.asyncio as redis
-from typing import Optional, Any
+from contextlib import asynccontextmanager
+from typing import Optional, Any, List, Dict, AsyncIterator
+from datetime import datetime
 import json
 import os
+import time
 from app.config import settings
+from app.utils.metrics import metrics
+
+
+redis_latency = metrics.histogram(
+    "redis_command_duration_seconds", "Redis command latency", ("command",)
+)
+
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    """Pipeline, измеряющий время выполнения"""
+    
+    async def execute(self, raise_on_error: bool = True):
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            redis_latency.observe(time.perf_counter() - started, "MULTI" if self.is_transaction else "PIPELINE")
+
+
+class InstrumentedRedis(redis.Redis):
+    """Клиент Redis, измеряющий время выполнения команд"""
+    
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            redis_latency.observe(time.perf_counter() - started, str(args[0]).upper())
+    
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
 
 
 class RedisService:
@@ -27,7 +61,7 @@ class RedisService:
         if not redis_url or "localhost" in redis_url or "127.0.0.1" in redis_url:
             raise ConnectionError("Redis URL not configured or points to localhost")
             
-        self.redis = redis.from_url(redis_url, decode_responses=True)
+        self.redis = InstrumentedRedis.from_url(redis_url, decode_responses=True)
     
     async def disconnect(self):
         """Отключение от Redis"""
@@ -64,17 +98,16 @@ class RedisService:
     async def set_json(self, key: str, value: Any, expire: Optional[int] = None) -> bool:
         """Установить JSON значение"""
         from loguru import logger
-        logger.info(f"set_json called: key={key}, value={value}, expire={expire}")
         
         if not self.redis:
-            logger.info("Redis not connected, attempting to connect...")
+            logger.debug("Redis not connected, attempting to connect...")
             await self.connect()
         
         try:
             json_value = json.dumps(value)
-            logger.info(f"JSON serialized: {json_value}")
             result = await self.redis.set(key, json_value, ex=expire)
-            logger.info(f"Redis SET result: {result}")
+            # Значение не логируем - оно может быть большим; аргументы форматируются только на DEBUG
+            logger.debug("set_json: key={}, bytes={}, expire={}, result={}", key, len(json_value), expire, result)
             return result
         except Exception as e:
             logger.error(f"Error in set_json: {e}")
@@ -94,6 +127,65 @@ class RedisService:
         
         return bool(await self.redis.exists(key))
     
+    @asynccontextmanager
+    async def pipeline(self, transaction: bool = True) -> AsyncIterator[redis.client.Pipeline]:
+        """
+        Сгруппировать несколько команд в один запрос к Redis
+        
+        Накопленные команды выполняются при выходе из блока. Если нужны
+        результаты команд, вызовите await pipe.execute() внутри блока.
+        
+        Args:
+            transaction: Выполнить команды атомарно (MULTI/EXEC)
+        """
+        if not self.redis:
+            await self.connect()
+        
+        async with self.redis.pipeline(transaction=transaction) as pipe:
+            yield pipe
+            if pipe.command_stack:
+                await pipe.execute()
+    
+    async def mget(self, keys: List[str]) -> List[Optional[str]]:
+        """Получить значения нескольких ключей одним запросом"""
+        if not keys:
+            return []
+        
+        if not self.redis:
+            await self.connect()
+        
+        return await self.redis.mget(keys)
+    
+    async def mset(self, mapping: Dict[str, Any], expire: Optional[int] = None) -> bool:
+        """Установить значения нескольких ключей одним запросом"""
+        if not mapping:
+            return True
+        
+        values = {
+            key: json.dumps(value) if isinstance(value, (dict, list)) else value
+            for key, value in mapping.items()
+        }
+        
+        if expire is None:
+            if not self.redis:
+                await self.connect()
+            return await self.redis.mset(values)
+        
+        async with self.pipeline() as pipe:
+            for key, value in values.items():
+                pipe.set(key, value, ex=expire)
+        return True
+    
+    async def delete_many(self, keys: List[str]) -> int:
+        """Удалить несколько ключей одним запросом"""
+        if not keys:
+            return 0
+        
+        if not self.redis:
+            await self.connect()
+        
+        return await self.redis.delete(*keys)
+    
     async def increment(self, key: str, amount: int = 1) -> int:
         """Увеличить значение на amount"""
         if not self.redis:
@@ -117,6 +209,31 @@ class RedisService:
         key = f"user:{user_id}:generations"
         return await self.increment(key, 1)
     
+    @staticmethod
+    def _user_key(user_id: int) -> str:
+        """Ключ hash с данными пользователя"""
+        return f"user:{user_id}:profile"
+    
+    @staticmethod
+    def _legacy_user_key(user_id: int) -> str:
+        """Старый ключ с данными пользователя в виде JSON строки"""
+        return f"user:{user_id}:data"
+    
+    @staticmethod
+    def _encode_fields(data: dict) -> dict:
+        """Сериализовать значения полей для записи в hash"""
+        return {field: json.dumps(value) for field, value in data.items()}
+    
+    @staticmethod
+    def _decode_field(value: Optional[str], default: Any = None) -> Any:
+        """Десериализовать значение поля из hash"""
+        if value is None:
+            return default
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            return value
+    
     async def get_user_data(self, user_id: int) -> Optional[dict]:
         """
         Получить все данные пользователя из Redis
@@ -127,12 +244,17 @@ class RedisService:
         Returns:
             dict: Данные пользователя или None если не найдены
         """
-        key = f"user:{user_id}:data"
-        return await self.get_json(key)
+        if not self.redis:
+            await self.connect()
+        
+        raw_data = await self.redis.hgetall(self._user_key(user_id))
+        if not raw_data:
+            return None
+        return {field: self._decode_field(value) for field, value in raw_data.items()}
 
     async def set_user_data(self, user_id: int, data: dict, expire: Optional[int] = None) -> bool:
         """
-        Сохранить данные пользователя в Redis
+        Сохранить данные пользователя в Redis (полностью заменяет запись)
         
         Args:
             user_id: Telegram ID пользователя
@@ -142,56 +264,126 @@ class RedisService:
         Returns:
             bool: True если успешно сохранено
         """
-        from loguru import logger
-        key = f"user:{user_id}:data"
-        logger.info(f"set_user_data called: key={key}, data={data}, expire={expire}")
-        
-        try:
-            result = await self.set_json(key, data, expire=expire)
-            logger.info(f"set_json result: {result}")
-            return result
-        except Exception as e:
-            logger.error(f"Error in set_user_data: {e}")
-            raise
+        key = self._user_key(user_id)
+        async with self.pipeline() as pipe:
+            pipe.delete(key)
+            if data:
+                pipe.hset(key, mapping=self._encode_fields(data))
+            if expire:
+                pipe.expire(key, expire)
+        return True
 
     async def update_user_field(self, user_id: int, field: str, value: Any) -> bool:
-        """Обновить конкретное поле пользователя"""
-        from loguru import logger
-        logger.info(f"update_user_field called: user_id={user_id}, field={field}, value={value}")
+        """Обновить конкретное поле пользователя (атомарно, одним HSET)"""
+        return await self.update_user_fields(user_id, {field: value})
+
+    async def update_user_fields(self, user_id: int, fields: dict) -> bool:
+        """Обновить несколько полей пользователя (атомарно, одним HSET)"""
+        if not fields:
+            return True
         
-        try:
-            user_data = await self.get_user_data(user_id) or {}
-            logger.info(f"Current user data: {user_data}")
-            
-            user_data[field] = value
-            logger.info(f"Updated user data: {user_data}")
-            
-            result = await self.set_user_data(user_id, user_data)
-            logger.info(f"set_user_data result: {result}")
-            return result
-        except Exception as e:
-            logger.error(f"Error in update_user_field: {e}")
-            raise
+        if not self.redis:
+            await self.connect()
+        
+        await self.redis.hset(self._user_key(user_id), mapping=self._encode_fields(fields))
+        return True
+
+    async def set_user_fields_if_missing(self, user_id: int, fields: dict) -> bool:
+        """
+        Установить поля пользователя, только если они еще не заданы
+        
+        Существующие значения (например, URL фото) не перезаписываются.
+        Все HSETNX выполняются одним запросом.
+        """
+        return await self.set_users_fields_if_missing({user_id: fields})
+
+    async def set_users_fields_if_missing(self, fields_by_user: Dict[int, dict]) -> bool:
+        """Установить отсутствующие поля сразу для нескольких пользователей одним запросом"""
+        if not fields_by_user:
+            return True
+        
+        async with self.pipeline(transaction=False) as pipe:
+            for user_id, fields in fields_by_user.items():
+                key = self._user_key(user_id)
+                for field, value in self._encode_fields(fields).items():
+                    pipe.hsetnx(key, field, value)
+        return True
 
     async def get_user_field(self, user_id: int, field: str, default: Any = None) -> Any:
         """Получить конкретное поле пользователя"""
-        user_data = await self.get_user_data(user_id)
-        if user_data:
-            return user_data.get(field, default)
-        return default
+        if not self.redis:
+            await self.connect()
+        
+        value = await self.redis.hget(self._user_key(user_id), field)
+        return self._decode_field(value, default)
+
+    async def get_user_fields(self, user_id: int, fields: List[str]) -> dict:
+        """
+        Получить несколько полей пользователя одним HMGET
+        
+        Returns:
+            dict: Поле -> значение (None для отсутствующих полей)
+        """
+        if not fields:
+            return {}
+        
+        if not self.redis:
+            await self.connect()
+        
+        values = await self.redis.hmget(self._user_key(user_id), fields)
+        return {field: self._decode_field(value) for field, value in zip(fields, values)}
+
+    async def migrate_user_data_to_hash(self, batch_size: int = 500) -> int:
+        """
+        Однократная миграция данных пользователей из JSON строк в hash
+        
+        Переносит все ключи user:{id}:data в user:{id}:profile. Существующие
+        поля hash не перезаписываются, поэтому миграция идемпотентна.
+        Повторный запуск после успешного завершения пропускается по флагу.
+        
+        Returns:
+            int: Количество перенесенных пользователей
+        """
+        from loguru import logger
+        
+        if not self.redis:
+            await self.connect()
+        
+        flag_key = "migrations:user_data_hash"
+        if await self.redis.exists(flag_key):
+            return 0
+        
+        migrated = 0
+        async for legacy_key in self.redis.scan_iter(match="user:*:data", count=batch_size):
+            try:
+                user_id = int(legacy_key.split(":")[1])
+                raw_value = await self.redis.get(legacy_key)
+                data = json.loads(raw_value) if raw_value else {}
+            except (ValueError, json.JSONDecodeError) as e:
+                logger.warning(f"Skipping invalid legacy user data {legacy_key}: {e}")
+                continue
+            
+            key = self._user_key(user_id)
+            async with self.pipeline() as pipe:
+                for field, value in self._encode_fields(data).items():
+                    pipe.hsetnx(key, field, value)
+                pipe.delete(legacy_key)
+            migrated += 1
+        
+        # Флаг ставится после завершения, чтобы прерванная миграция повторилась
+        await self.redis.set(flag_key, datetime.now().isoformat())
+        logger.info(f"Migrated {migrated} users from JSON to Redis hash")
+        return migrated
 
     async def clear_user_data(self, user_id: int) -> bool:
         """Полная очистка всех данных пользователя из Redis"""
         keys_to_delete = [
-            f"user:{user_id}:data",
+            self._user_key(user_id),
+            self._legacy_user_key(user_id),
             f"user:{user_id}:generations",  # старый ключ, если был
         ]
         
-        deleted_count = 0
-        for key in keys_to_delete:
-            if await self.exists(key):
-                await self.delete(key)
-                deleted_count += 1
+        deleted_count = await self.delete_many(keys_to_delete)
         
         from loguru import logger
         logger.info(f"Cleared {deleted_count} Redis keys for user {user_id}")
@@ -0,0 +1,300 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.methods import Response, SendChatAction, SendMediaGroup, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiohttp import ClientConnectorError
+from loguru import logger
+
+from app.config import settings
+from app.utils.cache import TTLCache
+
+
+# Приоритеты отправки: результаты генерации раньше уведомлений и ответов меню
+RESULT = 0
+NOTIFY = 1
+CHATTER = 2
+LANE_NAMES = {RESULT: "result", NOTIFY: "notify", CHATTER: "chatter"}
+
+_current_lane: ContextVar[int] = ContextVar("telegram_send_lane", default=CHATTER)
+
+# Описания 502/503/504 от шлюза Telegram: запрос не дошел до Bot API
+GATEWAY_ERRORS = ("bad gateway", "service unavailable", "gateway timeout")
+
+
+class TelegramSendScheduler(BaseRequestMiddleware):
+    """
+    Общий планировщик исходящих сообщений Telegram
+    
+    Подключается как middleware сессии бота, поэтому через него проходят все
+    отправки - и ответы обработчиков, и результаты из webhook сервера. Лимиты:
+    - на чат: token bucket с пополнением около одного сообщения в секунду в
+      личных чатах и 20 сообщений в минуту в группах и запасом на короткую
+      серию; альбом в личном чате стоит одно сообщение, в группе - число
+      фото, но не больше запаса bucket;
+    - глобально: token bucket (по умолчанию 30 сообщений в секунду), токены
+      выдаются в порядке приоритета (RESULT, NOTIFY, CHATTER).
+    При RetryAfter отправка всего бота приостанавливается на указанное время
+    и запрос повторяется. Сетевые ошибки и 5xx повторяются с задержкой,
+    но отправка нового сообщения - только если запрос точно не дошел до
+    Telegram (соединение не установлено, 502/503/504): иначе после таймаута
+    чтения пользователь получил бы сообщение дважды.
+    """
+    
+    # Пополнение (сообщений в секунду) и запас token bucket чата
+    PRIVATE_RATE = 1.0
+    PRIVATE_BURST = 3
+    GROUP_RATE = 20 / 60
+    GROUP_BURST = 3
+    
+    def __init__(self):
+        # Определяем, какая конфигурация использовать
+        if os.getenv("RAILWAY_ENVIRONMENT") or os.getenv("RAILWAY_PROJECT_ID"):
+            from app import config_prod
+            self.settings = config_prod.settings
+        else:
+            self.settings = settings
+        
+        self.rate = self.settings.telegram_global_rate
+        self.burst = self.settings.telegram_global_burst
+        self.max_retries = self.settings.telegram_send_max_retries
+        
+        self._bot: Optional[Bot] = None
+        
+        # Ограничение на чат
+        self._locks: Dict[Any, asyncio.Lock] = {}
+        self._chat_waiters: Dict[Any, int] = {}
+        # Token bucket чата: (токены, время пересчета); полный bucket не хранится
+        self._chat_buckets = TTLCache(max_size=100000, ttl=60)
+        
+        # Глобальный token bucket с очередью по приоритетам
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters: List[Tuple[int, int, float, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._pump_task: Optional[asyncio.Task] = None
+        
+        self._stats: Dict[str, Any] = {
+            "queue_depth": 0,
+            "queue_depth_peak": 0,
+            "retry_after": 0,
+            "retried_errors": 0,
+            "not_retried": 0,
+            "failed": 0,
+        }
+        self._lanes = {
+            name: {"sent": 0, "latency_total": 0.0, "latency_max": 0.0}
+            for name in LANE_NAMES.values()
+        }
+    
+    def bind(self, bot: Bot):
+        """Подключить планировщик к боту (один бот на процесс)"""
+        if self._bot is bot:
+            return
+        bot.session.middleware(self)
+        self._bot = bot
+    
+    async def get_bot(self, timeout: float = 30.0) -> Bot:
+        """Получить общий бот, дождавшись его создания"""
+        deadline = time.monotonic() + timeout
+        while self._bot is None:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Telegram bot is not started")
+            await asyncio.sleep(0.1)
+        return self._bot
+    
+    @contextmanager
+    def lane(self, priority: int):
+        """Отправлять сообщения внутри блока с указанным приоритетом"""
+        token = _current_lane.set(priority)
+        try:
+            yield
+        finally:
+            _current_lane.reset(token)
+    
+    @staticmethod
+    def _is_throttled(method: TelegramMethod) -> bool:
+        """Отправка сообщения в чат (учитывается в лимитах Telegram)"""
+        if isinstance(method, SendChatAction) or getattr(method, "chat_id", None) is None:
+            return False
+        return type(method).__name__.startswith(("Send", "Copy", "Forward", "Edit"))
+    
+    def _reserve_chat(self, chat_id: Any, weight: int) -> float:
+        """
+        Списать токены из bucket чата
+        
+        Токены могут уйти в минус - это долг, который гасится пополнением.
+        Вызывается под блокировкой чата.
+        
+        Returns:
+            float: Сколько секунд подождать до отправки
+        """
+        # id групп и каналов отрицательные или @username
+        if isinstance(chat_id, int) and chat_id > 0:
+            rate, burst, cost = self.PRIVATE_RATE, self.PRIVATE_BURST, 1
+        else:
+            rate, burst = self.GROUP_RATE, self.GROUP_BURST
+            cost = min(weight, burst)
+        
+        now = time.monotonic()
+        tokens, updated_at = self._chat_buckets.get(chat_id, (float(burst), now))
+        tokens = min(float(burst), tokens + (now - updated_at) * rate) - cost
+        self._chat_buckets.set(chat_id, (tokens, now))
+        return -tokens / rate if tokens < 0 else 0.0
+    
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if not self._is_throttled(method):
+            return await make_request(bot, method)
+        
+        chat_id = method.chat_id
+        weight = len(method.media) if isinstance(method, SendMediaGroup) else 1
+        priority = _current_lane.get()
+        enqueued_at = time.monotonic()
+        
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        self._chat_waiters[chat_id] = self._chat_waiters.get(chat_id, 0) + 1
+        self._stats["queue_depth"] += 1
+        self._stats["queue_depth_peak"] = max(self._stats["queue_depth_peak"], self._stats["queue_depth"])
+        dequeued = False
+        try:
+            async with lock:
+                delay = self._reserve_chat(chat_id, weight)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self._acquire(priority, weight)
+                self._stats["queue_depth"] -= 1
+                dequeued = True
+                
+                response = await self._request_with_retry(make_request, bot, method, priority, weight)
+        finally:
+            if not dequeued:
+                self._stats["queue_depth"] -= 1
+            # Блокировки неактивных чатов не храним
+            self._chat_waiters[chat_id] -= 1
+            if not self._chat_waiters[chat_id]:
+                del self._chat_waiters[chat_id]
+                del self._locks[chat_id]
+        
+        lane = self._lanes[LANE_NAMES[priority]]
+        latency = time.monotonic() - enqueued_at
+        lane["sent"] += 1
+        lane["latency_total"] += latency
+        lane["latency_max"] = max(lane["latency_max"], latency)
+        return response
+    
+    async def _request_with_retry(self, make_request, bot: Bot, method: TelegramMethod, priority: int, weight: int):
+        """Выполнить запрос, повторяя его после RetryAfter и временных ошибок"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    self._stats["failed"] += 1
+                    raise
+                # Flood control действует на весь бот - приостанавливаем все отправки
+                self._stats["retry_after"] += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                logger.warning(f"Telegram flood limit hit, pausing sends for {e.retry_after}s")
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if attempt == self.max_retries:
+                    self._stats["failed"] += 1
+                    raise
+                if not self._is_safe_to_retry(method, e):
+                    # Сообщение могло быть доставлено - повтор привел бы к дублю
+                    self._stats["not_retried"] += 1
+                    self._stats["failed"] += 1
+                    logger.warning(f"Telegram request {type(method).__name__} failed ({e}), not retrying")
+                    raise
+                self._stats["retried_errors"] += 1
+                delay = min(2 ** attempt, 30)
+                logger.warning(f"Telegram request failed ({e}), retrying in {delay}s")
+                await asyncio.sleep(delay)
+            await self._acquire(priority, weight)
+    
+    @staticmethod
+    def _is_safe_to_retry(method: TelegramMethod, error: Exception) -> bool:
+        """Можно ли повторить запрос, не рискуя отправить сообщение дважды"""
+        if type(method).__name__.startswith("Edit"):
+            # Повторное редактирование не создает новых сообщений
+            return True
+        if isinstance(error, TelegramServerError):
+            return any(status in error.message.lower() for status in GATEWAY_ERRORS)
+        # Сессия aiohttp оборачивает исходную ошибку: ошибка подключения - запрос не отправлен
+        return isinstance(error.__context__, ClientConnectorError)
+    
+    def _take_tokens(self, weight: float) -> bool:
+        """Взять токены из глобального bucket, если они есть"""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+        if now < self._paused_until or self._tokens < weight:
+            return False
+        self._tokens -= weight
+        return True
+    
+    async def _acquire(self, priority: int, weight: int):
+        """Дождаться глобальных токенов с учетом приоритета"""
+        weight = min(weight, self.burst)
+        if not self._waiters and self._take_tokens(weight):
+            return
+        
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), weight, future))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+    
+    async def _pump(self):
+        """Выдавать токены ожидающим по приоритету по мере пополнения bucket"""
+        while self._waiters:
+            _, _, weight, future = self._waiters[0]
+            if future.done():
+                # Ожидание отменено
+                heapq.heappop(self._waiters)
+                continue
+            if self._take_tokens(weight):
+                heapq.heappop(self._waiters)
+                future.set_result(None)
+                continue
+            wait = max(self._paused_until - time.monotonic(), (weight - self._tokens) / self.rate)
+            await asyncio.sleep(max(wait, 0.001))
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Получить метрики отправки
+        
+        Returns:
+            Dict с глубиной очереди, паузами flood control и задержками по приоритетам
+        """
+        stats = dict(self._stats)
+        stats["waiting_for_tokens"] = len(self._waiters)
+        stats["active_chats"] = len(self._locks)
+        stats["paused_for"] = round(max(0.0, self._paused_until - time.monotonic()), 2)
+        stats["lanes"] = {
+            name: {
+                "sent": lane["sent"],
+                "latency_avg": round(lane["latency_total"] / lane["sent"], 3) if lane["sent"] else 0.0,
+                "latency_max": round(lane["latency_max"], 3),
+            }
+            for name, lane in self._lanes.items()
+        }
+        return stats
+
+
+# Глобальный экземпляр
+telegram_sender = TelegramSendScheduler()
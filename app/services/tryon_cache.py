@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from app.config import settings
+from app.services.redis_service import redis_service
+from app.utils.image_hash import perceptual_hash
+from app.utils.image_processing import ImageProcessorBusy, image_processor
+
+
+# Параметры Fashn, от которых зависит результат генерации
+FASHN_RESULT_PARAMS = (
+    "fashn_model_name",
+    "fashn_category",
+    "fashn_segmentation_free",
+    "fashn_moderation_level",
+    "fashn_garment_photo_type",
+    "fashn_mode",
+    "fashn_seed",
+    "fashn_num_samples",
+    "fashn_output_format",
+    "fashn_return_base64",
+)
+
+
+class TryOnResultCache:
+    """
+    Кеш результатов try-on в Redis
+    
+    Ключ кеша - перцептивные хеши фото пользователя и одежды плюс параметры
+    Fashn из настроек. Хеши вычисляются при загрузке фото и хранятся по URL
+    фото. Записи живут cache_ttl секунд; при превышении max_entries
+    вытесняются самые старые.
+    """
+    
+    PHOTO_HASH_KEY = "photo_hash:{url_hash}"
+    RESULT_KEY = "tryon:result:{fingerprint}"
+    INDEX_KEY = "tryon:result:index"
+    STATS_KEY = "tryon:result:stats"
+    
+    PHOTO_HASH_TTL = 30 * 86400  # 30 дней
+    
+    def __init__(self):
+        # Определяем, какая конфигурация использовать
+        if os.getenv("RAILWAY_ENVIRONMENT") or os.getenv("RAILWAY_PROJECT_ID"):
+            from app import config_prod
+            self.settings = config_prod.settings
+        else:
+            self.settings = settings
+        
+        self.enabled = self.settings.tryon_cache_enabled
+        self.ttl = self.settings.tryon_cache_ttl
+        self.max_entries = self.settings.tryon_cache_max_entries
+        
+        self._stats = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0}
+    
+    @classmethod
+    def _photo_hash_key(cls, photo_url: str) -> str:
+        """Ключ хеша фото (URL Telegram содержит токен бота, поэтому хешируем)"""
+        url_hash = hashlib.sha1(photo_url.encode()).hexdigest()
+        return cls.PHOTO_HASH_KEY.format(url_hash=url_hash)
+    
+    async def remember_photo_hash(self, photo_url: str, image_data: bytes):
+        """Вычислить и сохранить перцептивный хеш загруженного фото"""
+        if not self.enabled:
+            return
+        try:
+            # Декодирование в общем ограниченном пуле обработки изображений
+            image_hash = await image_processor.run(perceptual_hash, image_data)
+        except ImageProcessorBusy as e:
+            # Без хеша фото просто не попадает в кеш результатов
+            logger.warning(f"Photo hash skipped: {e}")
+            return
+        except Exception as e:
+            logger.warning(f"Failed to compute photo hash: {e}")
+            return
+        try:
+            await redis_service.set(self._photo_hash_key(photo_url), image_hash, expire=self.PHOTO_HASH_TTL)
+        except Exception as e:
+            logger.warning(f"Failed to store photo hash: {e}")
+    
+    async def fingerprint(self, user_photo_url: str, clothing_photo_url: str) -> Optional[str]:
+        """
+        Получить ключ кеша для пары фото
+        
+        Returns:
+            str: Отпечаток запроса или None, если хеш какого-либо фото неизвестен
+        """
+        if not self.enabled:
+            return None
+        
+        person_hash, garment_hash = await redis_service.mget([
+            self._photo_hash_key(user_photo_url),
+            self._photo_hash_key(clothing_photo_url),
+        ])
+        if not person_hash or not garment_hash:
+            return None
+        
+        payload = {
+            "person": person_hash,
+            "garment": garment_hash,
+            "params": {name: getattr(self.settings, name) for name in FASHN_RESULT_PARAMS},
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    
+    async def get(self, fingerprint: Optional[str]) -> Optional[List[str]]:
+        """
+        Получить сохраненный результат
+        
+        Returns:
+            List[str]: URL результатов или None при промахе
+        """
+        if not fingerprint:
+            return None
+        
+        raw_value = await redis_service.get(self.RESULT_KEY.format(fingerprint=fingerprint))
+        counter = "hits" if raw_value else "misses"
+        self._stats[counter] += 1
+        await redis_service.redis.hincrby(self.STATS_KEY, counter, 1)
+        
+        return json.loads(raw_value) if raw_value else None
+    
+    async def set(self, fingerprint: Optional[str], output_urls: List[str]):
+        """Сохранить результат генерации и вытеснить лишние записи"""
+        if not fingerprint or not output_urls:
+            return
+        # base64 результаты слишком велики для кеша
+        if any(url.startswith("data:") for url in output_urls):
+            return
+        
+        async with redis_service.pipeline() as pipe:
+            pipe.set(self.RESULT_KEY.format(fingerprint=fingerprint), json.dumps(output_urls), ex=self.ttl)
+            pipe.zadd(self.INDEX_KEY, {fingerprint: time.time()})
+            # Записи с истекшим TTL убираем из индекса
+            pipe.zremrangebyscore(self.INDEX_KEY, 0, time.time() - self.ttl)
+            pipe.zcard(self.INDEX_KEY)
+            entries = (await pipe.execute())[-1]
+        self._stats["stored"] += 1
+        
+        overflow = entries - self.max_entries
+        if overflow > 0:
+            evicted = await redis_service.redis.zpopmin(self.INDEX_KEY, overflow)
+            await redis_service.delete_many(
+                [self.RESULT_KEY.format(fingerprint=member) for member, _ in evicted]
+            )
+            self._stats["evicted"] += len(evicted)
+            logger.debug(f"Evicted {len(evicted)} try-on results from cache")
+    
+    async def get_stats(self) -> Dict[str, Any]:
+        """
+        Получить счетчики кеша
+        
+        Returns:
+            Dict с попаданиями/промахами этого процесса и всех процессов (total_*)
+        """
+        stats: Dict[str, Any] = dict(self._stats)
+        async with redis_service.pipeline(transaction=False) as pipe:
+            pipe.hgetall(self.STATS_KEY)
+            pipe.zcard(self.INDEX_KEY)
+            total, entries = await pipe.execute()
+        
+        total_hits = int(total.get("hits", 0))
+        total_misses = int(total.get("misses", 0))
+        stats["total_hits"] = total_hits
+        stats["total_misses"] = total_misses
+        stats["hit_rate"] = round(total_hits / (total_hits + total_misses), 3) if total_hits + total_misses else 0.0
+        stats["entries"] = entries
+        stats["max_entries"] = self.max_entries
+        return stats
+
+
+# Глобальный экземпляр
+tryon_cache = TryOnResultCache()
@@ -0,0 +1,350 @@
+import asyncio
+import json
+import os
+import random
+import socket
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from app.config import settings
+from app.services.fashn_service import fashn_service
+from app.services.prediction_reconciler import prediction_reconciler
+from app.services.tryon_singleflight import tryon_singleflight
+from app.services.redis_service import redis_service
+from app.services.telegram_sender import telegram_sender, NOTIFY
+
+
+class TryOnQueue:
+    """
+    Очередь задач try-on в Redis с пулом асинхронных воркеров
+    
+    Обработчик команды ставит задачу в очередь и сразу отвечает пользователю,
+    а воркеры отправляют запросы в Fashn с ограничением параллельности
+    (на пользователя и глобально). Временные ошибки (429/5xx/сеть)
+    повторяются с экспоненциальной задержкой, после исчерпания попыток задача
+    попадает в dead-letter список. Задачи хранятся в Redis и переживают
+    перезапуск: задачи упавшего процесса возвращаются в очередь.
+    """
+    
+    QUEUE_KEY = "tryon:queue"
+    DELAYED_KEY = "tryon:delayed"
+    DEAD_KEY = "tryon:dead"
+    ACTIVE_KEY = "tryon:active"
+    JOB_KEY = "tryon:job:{job_id}"
+    USER_ACTIVE_KEY = "tryon:active:user:{user_id}"
+    PROCESSING_KEY = "tryon:processing:{worker_id}"
+    HEARTBEAT_KEY = "tryon:worker:{worker_id}"
+    
+    JOB_TTL = 86400  # 24 часа
+    HEARTBEAT_TTL = 30
+    ACTIVE_LEASE = 120  # Слот считается занятым не дольше этого времени
+    
+    def __init__(self):
+        # Определяем, какая конфигурация использовать
+        if os.getenv("RAILWAY_ENVIRONMENT") or os.getenv("RAILWAY_PROJECT_ID"):
+            from app import config_prod
+            self.settings = config_prod.settings
+        else:
+            self.settings = settings
+        
+        self.workers_count = self.settings.tryon_queue_workers
+        self.max_attempts = self.settings.tryon_queue_max_attempts
+        self.backoff_base = self.settings.tryon_queue_backoff_base
+        self.backoff_max = self.settings.tryon_queue_backoff_max
+        self.user_concurrency = self.settings.tryon_queue_user_concurrency
+        self.global_concurrency = self.settings.tryon_queue_global_concurrency
+        
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.bot = None
+        self._tasks: List[asyncio.Task] = []
+        self._running = False
+    
+    async def _client(self):
+        """Получить клиент Redis, подключившись при необходимости"""
+        if not redis_service.redis:
+            await redis_service.connect()
+        return redis_service.redis
+    
+    async def enqueue(
+        self,
+        user_id: int,
+        chat_id: int,
+        user_photo_url: str,
+        clothing_photo_url: str,
+        fingerprint: Optional[str] = None,
+        flight_key: Optional[str] = None
+    ) -> Tuple[str, int]:
+        """
+        Поставить задачу try-on в очередь
+        
+        Args:
+            user_id: Telegram ID пользователя
+            chat_id: ID чата для ответа
+            user_photo_url: URL фото пользователя
+            clothing_photo_url: URL фото одежды
+            fingerprint: Ключ кеша результатов (если известен)
+            flight_key: Ключ объединения одинаковых запросов
+        
+        Returns:
+            Tuple[job_id, queue_position]
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "user_id": user_id,
+            "chat_id": chat_id,
+            "user_photo_url": user_photo_url,
+            "clothing_photo_url": clothing_photo_url,
+            "fingerprint": fingerprint,
+            "flight_key": flight_key,
+            "attempts": 0,
+            "created_at": datetime.now().isoformat(),
+            "last_error": None,
+        }
+        
+        async with redis_service.pipeline() as pipe:
+            pipe.set(self.JOB_KEY.format(job_id=job_id), json.dumps(job), ex=self.JOB_TTL)
+            pipe.lpush(self.QUEUE_KEY, job_id)
+            _, queue_length = await pipe.execute()
+        
+        logger.info(f"Try-on job {job_id} queued for user {user_id}, position {queue_length}")
+        return job_id, queue_length
+    
+    async def start(self, bot):
+        """Запустить воркеры (вызывается при запуске бота)"""
+        if self._running:
+            return
+        
+        self.bot = bot
+        self._running = True
+        await self._recover_orphaned_jobs()
+        
+        self._tasks = [asyncio.create_task(self._heartbeat())]
+        for index in range(self.workers_count):
+            self._tasks.append(asyncio.create_task(self._worker(index)))
+        logger.info(f"✅ Try-on queue started with {self.workers_count} workers ({self.worker_id})")
+    
+    async def stop(self):
+        """Остановить воркеры (незавершенные задачи вернутся в очередь)"""
+        if not self._running:
+            return
+        
+        self._running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        
+        # Возвращаем задачи, которые не успели обработать
+        try:
+            client = await self._client()
+            processing_key = self.PROCESSING_KEY.format(worker_id=self.worker_id)
+            while await client.rpoplpush(processing_key, self.QUEUE_KEY):
+                pass
+            await client.delete(self.HEARTBEAT_KEY.format(worker_id=self.worker_id))
+        except Exception as e:
+            logger.error(f"Failed to return in-flight try-on jobs to queue: {e}")
+        
+        logger.info("Try-on queue stopped")
+    
+    async def get_stats(self) -> Dict[str, Any]:
+        """Получить размеры очередей"""
+        async with redis_service.pipeline(transaction=False) as pipe:
+            pipe.llen(self.QUEUE_KEY)
+            pipe.zcard(self.DELAYED_KEY)
+            pipe.zcard(self.ACTIVE_KEY)
+            pipe.llen(self.DEAD_KEY)
+            queued, delayed, active, dead = await pipe.execute()
+        
+        return {
+            "queued": queued,
+            "delayed": delayed,
+            "active": active,
+            "dead": dead,
+            "workers": self.workers_count if self._running else 0,
+        }
+    
+    async def _heartbeat(self):
+        """Подтверждать, что процесс жив (иначе его задачи вернут в очередь)"""
+        key = self.HEARTBEAT_KEY.format(worker_id=self.worker_id)
+        while self._running:
+            try:
+                client = await self._client()
+                await client.set(key, "1", ex=self.HEARTBEAT_TTL)
+            except Exception as e:
+                logger.error(f"Try-on queue heartbeat failed: {e}")
+            await asyncio.sleep(self.HEARTBEAT_TTL / 3)
+    
+    async def _recover_orphaned_jobs(self):
+        """Вернуть в очередь задачи процессов, которые перестали отвечать"""
+        client = await self._client()
+        recovered = 0
+        async for processing_key in client.scan_iter(match=self.PROCESSING_KEY.format(worker_id="*")):
+            worker_id = processing_key.split(":", 2)[2]
+            if await client.exists(self.HEARTBEAT_KEY.format(worker_id=worker_id)):
+                continue
+            while await client.rpoplpush(processing_key, self.QUEUE_KEY):
+                recovered += 1
+        
+        if recovered:
+            logger.warning(f"Recovered {recovered} orphaned try-on jobs")
+    
+    async def _promote_delayed_jobs(self, client):
+        """Перенести в очередь задачи, у которых истекла задержка повтора"""
+        due_jobs = await client.zrangebyscore(self.DELAYED_KEY, 0, time.time(), start=0, num=10)
+        for job_id in due_jobs:
+            # zrem гарантирует, что задачу перенесет только один воркер
+            if await client.zrem(self.DELAYED_KEY, job_id):
+                await client.rpush(self.QUEUE_KEY, job_id)
+    
+    async def _worker(self, index: int):
+        """Цикл воркера: взять задачу, обработать, подтвердить"""
+        processing_key = self.PROCESSING_KEY.format(worker_id=self.worker_id)
+        
+        while self._running:
+            try:
+                client = await self._client()
+                await self._promote_delayed_jobs(client)
+                
+                job_id = await client.brpoplpush(self.QUEUE_KEY, processing_key, timeout=1)
+                if not job_id:
+                    continue
+                
+                # При отмене задача остается в processing и вернется в очередь в stop()
+                try:
+                    await self._process_job(client, job_id)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Try-on job {job_id} failed unexpectedly: {e}")
+                await client.lrem(processing_key, 1, job_id)
+            
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Try-on worker {index} error: {e}")
+                await asyncio.sleep(1)
+    
+    async def _acquire_slot(self, job: Dict[str, Any]) -> bool:
+        """Занять слот с учетом глобального и пользовательского лимита"""
+        now = time.time()
+        user_key = self.USER_ACTIVE_KEY.format(user_id=job["user_id"])
+        
+        async with redis_service.pipeline() as pipe:
+            for key in (self.ACTIVE_KEY, user_key):
+                # Удаляем зависшие слоты упавших процессов
+                pipe.zremrangebyscore(key, 0, now - self.ACTIVE_LEASE)
+                pipe.zadd(key, {job["id"]: now})
+                pipe.zcard(key)
+                pipe.expire(key, self.ACTIVE_LEASE)
+            results = await pipe.execute()
+        
+        global_active, user_active = results[2], results[6]
+        if global_active <= self.global_concurrency and user_active <= self.user_concurrency:
+            return True
+        
+        await self._release_slot(job)
+        return False
+    
+    async def _release_slot(self, job: Dict[str, Any]):
+        """Освободить слот задачи"""
+        async with redis_service.pipeline() as pipe:
+            pipe.zrem(self.ACTIVE_KEY, job["id"])
+            pipe.zrem(self.USER_ACTIVE_KEY.format(user_id=job["user_id"]), job["id"])
+    
+    async def _process_job(self, client, job_id: str):
+        """Отправить задачу в Fashn и обработать результат"""
+        job_key = self.JOB_KEY.format(job_id=job_id)
+        raw_job = await client.get(job_key)
+        if not raw_job:
+            logger.warning(f"Try-on job {job_id} not found, skipping")
+            return
+        job = json.loads(raw_job)
+        
+        if not await self._acquire_slot(job):
+            # Лимит параллельности исчерпан - откладываем задачу ненадолго
+            await client.zadd(self.DELAYED_KEY, {job_id: time.time() + 1})
+            return
+        
+        try:
+            job["attempts"] += 1
+            start_time = datetime.now()
+            success, message, prediction_id, retryable = await fashn_service.submit_tryon_request_detailed(
+                user_photo_url=job["user_photo_url"],
+                clothing_photo_url=job["clothing_photo_url"],
+                user_id=job["user_id"]
+            )
+        finally:
+            await self._release_slot(job)
+        
+        if success and prediction_id:
+            # Сохраняем контекст для webhook обработки
+            await redis_service.set_json(
+                f"fashn_prediction:{prediction_id}",
+                {
+                    "user_id": job["user_id"],
+                    "start_time": start_time.isoformat(),
+                    "model_name": fashn_service.model_name,
+                    "mode": fashn_service.settings.fashn_mode,
+                    "user_photo_url": job["user_photo_url"],
+                    "clothing_photo_url": job["clothing_photo_url"],
+                    "fingerprint": job.get("fingerprint"),
+                    "flight_key": job.get("flight_key")
+                },
+                expire=3600  # 1 час
+            )
+            # Если webhook не придет, результат будет получен опросом статуса
+            await prediction_reconciler.track(prediction_id)
+            await client.delete(job_key)
+            await self._notify(
+                job["chat_id"],
+                f"✅ <b>Запрос отправлен в Fashn AI!</b>\n\n{message}\n\nОжидайте результат через webhook..."
+            )
+            logger.info(f"Try-on job {job_id} submitted, prediction ID: {prediction_id}")
+            return
+        
+        job["last_error"] = message
+        if retryable and job["attempts"] < self.max_attempts:
+            delay = min(self.backoff_base * 2 ** (job["attempts"] - 1), self.backoff_max)
+            delay += random.uniform(0, delay / 2)
+            async with redis_service.pipeline() as pipe:
+                pipe.set(job_key, json.dumps(job), ex=self.JOB_TTL)
+                pipe.zadd(self.DELAYED_KEY, {job_id: time.time() + delay})
+            logger.warning(
+                f"Try-on job {job_id} failed (attempt {job['attempts']}/{self.max_attempts}), "
+                f"retrying in {delay:.1f}s: {message}"
+            )
+            return
+        
+        # Неповторяемая ошибка или попытки исчерпаны - в dead-letter
+        job["failed_at"] = datetime.now().isoformat()
+        async with redis_service.pipeline() as pipe:
+            pipe.delete(job_key)
+            pipe.lpush(self.DEAD_KEY, json.dumps(job))
+        logger.error(f"Try-on job {job_id} moved to dead-letter after {job['attempts']} attempts: {message}")
+        await self._notify(job["chat_id"], f"❌ <b>Ошибка Fashn AI</b>\n\n{message}")
+        
+        # Ожидавшие тот же результат тоже получают ошибку
+        try:
+            for subscriber in await tryon_singleflight.finish(job.get("flight_key")):
+                await self._notify(subscriber["chat_id"], f"❌ <b>Ошибка Fashn AI</b>\n\n{message}")
+        except Exception as e:
+            logger.warning(f"Failed to notify coalesced chats for job {job_id}: {e}")
+    
+    async def _notify(self, chat_id: int, text: str):
+        """Отправить сообщение пользователю"""
+        if self.bot is None:
+            return
+        try:
+            with telegram_sender.lane(NOTIFY):
+                await self.bot.send_message(chat_id=chat_id, text=text)
+        except Exception as e:
+            logger.error(f"Failed to notify chat {chat_id} about try-on job: {e}")
+
+
+# Глобальный экземпляр
+tryon_queue = TryOnQueue()
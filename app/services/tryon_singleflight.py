@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from app.config import settings
+from app.services.redis_service import redis_service
+
+
+# Занять генерацию (leader) или подписаться на уже идущую (follower)
+_JOIN_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    return 'leader'
+end
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return 'duplicate'
+end
+if redis.call('SADD', KEYS[2], ARGV[1]) == 0 then
+    return 'duplicate'
+end
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return 'follower'
+"""
+
+
+class TryOnSingleFlight:
+    """
+    Объединение одинаковых запросов try-on (single-flight) между процессами
+    
+    Первый запрос с данным отпечатком входных фото становится ведущим и
+    отправляется в Fashn; одинаковые запросы, пришедшие пока он выполняется,
+    подписываются на него. Когда приходит результат, finish() снимает
+    блокировку и возвращает подписчиков, чтобы разослать им тот же результат.
+    """
+    
+    LOCK_KEY = "tryon:flight:{key}"
+    SUBSCRIBERS_KEY = "tryon:flight:{key}:subscribers"
+    
+    LEADER = "leader"
+    FOLLOWER = "follower"
+    DUPLICATE = "duplicate"
+    
+    def __init__(self):
+        # Определяем, какая конфигурация использовать
+        if os.getenv("RAILWAY_ENVIRONMENT") or os.getenv("RAILWAY_PROJECT_ID"):
+            from app import config_prod
+            self.settings = config_prod.settings
+        else:
+            self.settings = settings
+        
+        self.ttl = self.settings.tryon_singleflight_ttl
+        
+        self._join_script = None
+        self._stats = {"leaders": 0, "followers": 0, "duplicates": 0, "fanned_out": 0}
+    
+    @staticmethod
+    def make_key(fingerprint: Optional[str], user_photo_url: str, clothing_photo_url: str) -> str:
+        """
+        Ключ объединения запросов
+        
+        Используется отпечаток из кеша результатов; если хеши фото неизвестны,
+        объединяются только запросы с теми же URL фото.
+        """
+        if fingerprint:
+            return fingerprint
+        return hashlib.sha256(f"{user_photo_url}|{clothing_photo_url}".encode()).hexdigest()
+    
+    @staticmethod
+    def _member(user_id: int, chat_id: int) -> str:
+        """Сериализовать подписчика"""
+        return json.dumps({"chat_id": chat_id, "user_id": user_id}, sort_keys=True)
+    
+    async def join(self, key: str, user_id: int, chat_id: int) -> str:
+        """
+        Присоединиться к генерации
+        
+        Returns:
+            str: LEADER - нужно отправить запрос в Fashn,
+                 FOLLOWER - результат придет от уже идущей генерации,
+                 DUPLICATE - этот чат уже ждет результат
+        """
+        if not redis_service.redis:
+            await redis_service.connect()
+        if self._join_script is None:
+            self._join_script = redis_service.redis.register_script(_JOIN_SCRIPT)
+        
+        role = await self._join_script(
+            keys=[self.LOCK_KEY.format(key=key), self.SUBSCRIBERS_KEY.format(key=key)],
+            args=[self._member(user_id, chat_id), self.ttl]
+        )
+        self._stats[f"{role}s"] += 1
+        return role
+    
+    async def finish(self, key: Optional[str]) -> List[Dict[str, Any]]:
+        """
+        Завершить генерацию и получить подписчиков для рассылки результата
+        
+        Returns:
+            List[Dict]: Подписчики (chat_id, user_id), кроме ведущего
+        """
+        if not key:
+            return []
+        
+        subscribers_key = self.SUBSCRIBERS_KEY.format(key=key)
+        async with redis_service.pipeline() as pipe:
+            pipe.smembers(subscribers_key)
+            pipe.delete(self.LOCK_KEY.format(key=key), subscribers_key)
+            members, _ = await pipe.execute()
+        
+        subscribers = [json.loads(member) for member in members]
+        if subscribers:
+            self._stats["fanned_out"] += len(subscribers)
+            logger.info(f"Try-on result for {key[:12]} fanned out to {len(subscribers)} waiting chats")
+        return subscribers
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Получить счетчики объединения запросов"""
+        return dict(self._stats)
+
+
+# Глобальный экземпляр
+tryon_singleflight = TryOnSingleFlight()
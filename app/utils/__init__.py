@@ -1,3 +1,8 @@
 from .validators import ImageValidator
+from .image_processing import ImageProcessor
+from .cache import TTLCache
+from .image_hash import perceptual_hash
+from .input_files import Base64InputFile
+from .logging_setup import setup_logging, sampled
 
-__all__ = ["ImageValidator"]
+__all__ = ["ImageValidator", "ImageProcessor", "TTLCache", "perceptual_hash", "Base64InputFile", "setup_logging", "sampled"]
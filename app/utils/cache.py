@@ -0,0 +1,63 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class TTLCache:
+    """Локальный LRU кеш с ограничением размера и временем жизни записей"""
+    
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0):
+        """
+        Args:
+            max_size: Максимальное количество записей
+            ttl: Время жизни записи в секундах
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Получить значение (просроченные записи удаляются)"""
+        entry = self._items.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._items[key]
+            self.misses += 1
+            return default
+        
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+    
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Сохранить значение, вытесняя самые старые записи при переполнении"""
+        self._items[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+    
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Удалить запись и вернуть ее значение"""
+        entry = self._items.pop(key, None)
+        return default if entry is None else entry[1]
+    
+    def clear(self):
+        """Очистить кеш"""
+        self._items.clear()
+    
+    def __len__(self) -> int:
+        return len(self._items)
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Получить статистику кеша"""
+        return {
+            "size": len(self._items),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
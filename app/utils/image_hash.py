@@ -0,0 +1,32 @@
+import io
+from PIL import Image
+
+
+def perceptual_hash(data: bytes, hash_size: int = 16) -> str:
+    """
+    Вычислить перцептивный хеш изображения (difference hash)
+    
+    Хеш не меняется при повторном сжатии и изменении размера, поэтому одно и
+    то же фото, загруженное заново, дает тот же хеш.
+    
+    Args:
+        data: Содержимое изображения
+        hash_size: Размер стороны сетки (хеш имеет hash_size^2 бит)
+    
+    Returns:
+        str: Хеш в виде hex строки
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        # Для JPEG декодируем сразу в уменьшенном размере
+        image.draft("L", (hash_size * 8, hash_size * 8))
+        pixels = list(
+            image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS).getdata()
+        )
+    
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    
+    return f"{value:0{hash_size * hash_size // 4}x}"
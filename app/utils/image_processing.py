@@ -0,0 +1,315 @@
+import asyncio
+import io
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from loguru import logger
+from PIL import Image, ImageOps
+
+from app.config import settings
+from app.utils.metrics import metrics
+
+
+image_processing_latency = metrics.histogram(
+    "image_processing_duration_seconds", "Image processing time in the worker pool", ("operation",)
+)
+image_processing_wait = metrics.histogram(
+    "image_processing_queue_wait_seconds", "Time an image job waited for a free worker"
+)
+
+# Тег EXIF с ориентацией снимка
+EXIF_ORIENTATION = 0x0112
+
+
+def probe_image(data: bytes) -> Dict[str, Any]:
+    """
+    Прочитать формат и размеры изображения по заголовку
+    
+    Image.open читает только заголовок файла и не декодирует пиксели.
+    
+    Args:
+        data: Содержимое изображения
+    
+    Returns:
+        Dict с форматом, шириной и высотой
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        width, height = image.size
+        return {"format": image.format, "width": width, "height": height}
+
+
+def normalize_image(
+    data: bytes,
+    max_side: int,
+    output_format: str = "JPEG",
+    quality: int = 90
+) -> Tuple[bytes, Dict[str, Any]]:
+    """
+    Повернуть изображение по EXIF, уменьшить и перекодировать
+    
+    Изображение, которое не нужно поворачивать и уменьшать и которое уже
+    в нужном формате, возвращается без изменений. Если перекодирование
+    без изменения размеров не уменьшило файл, тоже возвращается оригинал.
+    
+    Args:
+        data: Содержимое изображения
+        max_side: Максимальная длина большей стороны (px)
+        output_format: Формат результата (JPEG или WEBP)
+        quality: Качество сжатия результата
+    
+    Returns:
+        Tuple[image_bytes, info] - info содержит исходные и итоговые формат, размеры и объем
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        source_format = image.format
+        width, height = image.size
+        orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+        info = {
+            "format": source_format,
+            "width": width,
+            "height": height,
+            "bytes_in": len(data),
+        }
+        
+        needs_resize = max(width, height) > max_side
+        needs_rotation = orientation not in (None, 1)
+        unchanged = {
+            **info,
+            "output_format": source_format,
+            "output_width": width,
+            "output_height": height,
+            "bytes_out": len(data),
+            "changed": False,
+        }
+        if not needs_resize and not needs_rotation and source_format == output_format:
+            return data, unchanged
+        
+        if needs_resize:
+            # Для JPEG декодируем сразу в уменьшенном размере (не меньше max_side)
+            image.draft(image.mode, (max_side, max_side))
+        result = ImageOps.exif_transpose(image)
+    
+    if needs_resize:
+        result.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=3.0)
+    
+    has_alpha = result.mode in ("RGBA", "LA") or (result.mode == "P" and "transparency" in result.info)
+    if output_format == "JPEG" and has_alpha:
+        # JPEG без прозрачности - кладем изображение на белый фон
+        rgba = result.convert("RGBA")
+        result = Image.new("RGB", rgba.size, (255, 255, 255))
+        result.paste(rgba, mask=rgba.getchannel("A"))
+    elif output_format == "WEBP" and has_alpha:
+        result = result.convert("RGBA")
+    elif result.mode not in ("RGB", "L"):
+        result = result.convert("RGB")
+    
+    buffer = io.BytesIO()
+    save_options = {"quality": quality}
+    if output_format == "JPEG":
+        save_options["optimize"] = True
+    result.save(buffer, format=output_format, **save_options)
+    output = buffer.getvalue()
+    
+    if not needs_resize and not needs_rotation and len(output) >= len(data):
+        return data, unchanged
+    
+    return output, {
+        **info,
+        "output_format": output_format,
+        "output_width": result.width,
+        "output_height": result.height,
+        "bytes_out": len(output),
+        "changed": True,
+    }
+
+
+class ImageProcessorBusy(Exception):
+    """Очередь пула обработки изображений заполнена"""
+
+
+class ImageProcessor:
+    """
+    Ограниченный пул для CPU-нагруженной работы с Pillow
+    
+    Чтение заголовков, поворот, уменьшение и перекодирование изображений
+    выполняются в пуле потоков (Pillow отпускает GIL при декодировании,
+    масштабировании и сжатии) или процессов, чтобы не останавливать
+    event loop. Одновременно выполняется не больше max_workers задач,
+    ждать может не больше max_queue; при заполненной очереди задача
+    сразу отклоняется с ImageProcessorBusy. Задача, не уложившаяся в
+    timeout, занимает слот, пока воркер ее не завершит.
+    """
+    
+    def __init__(self):
+        # Определяем, какая конфигурация использовать
+        if os.getenv("RAILWAY_ENVIRONMENT") or os.getenv("RAILWAY_PROJECT_ID"):
+            from app import config_prod
+            self.settings = config_prod.settings
+        else:
+            self.settings = settings
+        
+        self.backend = self.settings.image_pool_backend
+        self.max_workers = self.settings.image_pool_max_workers
+        self.max_queue = self.settings.image_pool_max_queue
+        self.timeout = self.settings.image_processing_timeout
+        self.max_side = self.settings.image_max_side
+        self.output_format = self.settings.image_output_format.upper()
+        self.quality = self.settings.image_output_quality
+        
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "timeouts": 0,
+            "waiting": 0,
+            "running": 0,
+            "queue_depth_peak": 0,
+            "wait_time_total": 0.0,
+            "normalized": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+        }
+    
+    def _ensure_started(self):
+        """Создать пул при первом использовании"""
+        if self._executor is None:
+            if self.backend == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="image"
+                )
+            self._slots = asyncio.Semaphore(self.max_workers)
+            logger.info(f"Image processor started ({self.backend}, max_workers={self.max_workers})")
+    
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Выполнить функцию обработки изображения в пуле
+        
+        Args:
+            func: Функция уровня модуля (для пула процессов она передается по имени)
+        
+        Returns:
+            Результат функции
+        
+        Raises:
+            ImageProcessorBusy: Если очередь заполнена
+            asyncio.TimeoutError: Если задача не завершилась за timeout
+        """
+        self._ensure_started()
+        stats = self._stats
+        if stats["waiting"] >= self.max_queue:
+            stats["rejected"] += 1
+            raise ImageProcessorBusy(f"Image processing queue is full ({self.max_queue})")
+        
+        stats["submitted"] += 1
+        stats["waiting"] += 1
+        stats["queue_depth_peak"] = max(
+            stats["queue_depth_peak"], stats["waiting"] + stats["running"]
+        )
+        
+        enqueued_at = time.monotonic()
+        try:
+            await self._slots.acquire()
+        finally:
+            stats["waiting"] -= 1
+        
+        stats["running"] += 1
+        started = time.monotonic()
+        stats["wait_time_total"] += started - enqueued_at
+        image_processing_wait.observe(started - enqueued_at)
+        name = func.__name__
+        loop = asyncio.get_running_loop()
+        try:
+            job = self._executor.submit(partial(func, *args, **kwargs))
+        except Exception:
+            self._release(self._slots, started, name)
+            stats["failed"] += 1
+            raise
+        # Слот освобождается, только когда воркер действительно завершил задачу
+        slots = self._slots
+        job.add_done_callback(lambda _: self._release_threadsafe(loop, slots, started, name))
+        
+        try:
+            result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(job)), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            stats["timeouts"] += 1
+            stats["failed"] += 1
+            logger.warning(f"Image job {name} timed out after {self.timeout}s")
+            raise
+        except Exception:
+            stats["failed"] += 1
+            raise
+        
+        stats["completed"] += 1
+        return result
+    
+    def _release(self, slots: asyncio.Semaphore, started: float, name: str):
+        """Освободить слот завершившейся задачи"""
+        self._stats["running"] -= 1
+        slots.release()
+        image_processing_latency.observe(time.monotonic() - started, name)
+    
+    def _release_threadsafe(
+        self, loop: asyncio.AbstractEventLoop, slots: asyncio.Semaphore, started: float, name: str
+    ):
+        """Освободить слот из потока пула"""
+        try:
+            loop.call_soon_threadsafe(self._release, slots, started, name)
+        except RuntimeError:
+            # Loop уже закрыт (остановка приложения)
+            pass
+    
+    async def probe(self, data: bytes) -> Dict[str, Any]:
+        """Прочитать формат и размеры изображения"""
+        return await self.run(probe_image, data)
+    
+    async def normalize(self, data: bytes) -> Tuple[bytes, Dict[str, Any]]:
+        """
+        Подготовить изображение к загрузке
+        
+        Поворот по EXIF, уменьшение до max_side и перекодирование в
+        output_format с настроенным качеством.
+        
+        Returns:
+            Tuple[image_bytes, info]
+        """
+        output, info = await self.run(normalize_image, data, self.max_side, self.output_format, self.quality)
+        self._stats["bytes_in"] += info["bytes_in"]
+        self._stats["bytes_out"] += info["bytes_out"]
+        if info["changed"]:
+            self._stats["normalized"] += 1
+        return output, info
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Получить метрики пула обработки изображений
+        
+        Returns:
+            Dict со счетчиками задач, глубиной очереди и объемом до/после обработки
+        """
+        stats = dict(self._stats)
+        stats["backend"] = self.backend
+        stats["max_workers"] = self.max_workers
+        stats["max_queue"] = self.max_queue
+        stats["queue_depth"] = stats["waiting"] + stats["running"]
+        return stats
+    
+    def shutdown(self):
+        """Остановить пул"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._slots = None
+            logger.info("Image processor stopped")
+
+
+# Глобальный экземпляр
+image_processor = ImageProcessor()
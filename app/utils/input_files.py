@@ -0,0 +1,44 @@
+import binascii
+from typing import TYPE_CHECKING, AsyncGenerator, Dict, Optional
+
+from aiogram.types import InputFile
+
+if TYPE_CHECKING:
+    from aiogram.client.bot import Bot
+
+
+class Base64InputFile(InputFile):
+    """
+    Файл для отправки в Telegram из data URI (data:image/png;base64,...)
+    
+    Base64 декодируется порциями во время отправки, поэтому в памяти
+    одновременно находится только одна порция декодированных данных,
+    а не все изображение.
+    """
+    
+    # Счетчики для всех отправленных файлов (размер порций ограничен chunk_size)
+    stats: Dict[str, int] = {"files": 0, "bytes": 0, "peak_chunk_bytes": 0}
+    
+    def __init__(self, data_uri: str, filename: Optional[str] = None, chunk_size: int = 48 * 1024):
+        """
+        Args:
+            data_uri: Строка вида data:image/png;base64,...
+            filename: Имя файла для Telegram
+            chunk_size: Размер декодированной порции (кратен 3 байтам)
+        """
+        super().__init__(filename=filename, chunk_size=chunk_size - chunk_size % 3)
+        self.data_uri = data_uri
+        # Данные начинаются после первой запятой; строку не копируем
+        self.offset = data_uri.index(",") + 1
+    
+    async def read(self, bot: "Bot") -> AsyncGenerator[bytes, None]:
+        # 4 символа base64 = 3 байта, поэтому порции декодируются независимо
+        step = self.chunk_size // 3 * 4
+        stats = self.stats
+        stats["files"] += 1
+        
+        for start in range(self.offset, len(self.data_uri), step):
+            chunk = binascii.a2b_base64(self.data_uri[start:start + step])
+            stats["bytes"] += len(chunk)
+            stats["peak_chunk_bytes"] = max(stats["peak_chunk_bytes"], len(chunk))
+            yield chunk
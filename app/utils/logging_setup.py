@@ -0,0 +1,130 @@
+import asyncio
+import os
+import queue
+import random
+import sys
+import threading
+from typing import Dict, Optional, TextIO
+
+from loguru import logger
+
+from app.config import settings
+
+
+TEXT_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | "
+    "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
+)
+
+
+def _get_settings():
+    """Получить настройки в зависимости от окружения"""
+    if os.getenv("RAILWAY_ENVIRONMENT") or os.getenv("RAILWAY_PROJECT_ID"):
+        from app import config_prod
+        return config_prod.settings
+    return settings
+
+
+def parse_module_levels(default_level: str, module_levels: str) -> Dict[str, str]:
+    """
+    Разобрать уровни логирования по модулям
+    
+    Args:
+        default_level: Уровень для всех модулей
+        module_levels: Строка вида "aiogram.event=WARNING,app.services.redis_service=DEBUG"
+    
+    Returns:
+        Dict для фильтра loguru: префикс модуля -> уровень ("" - все модули)
+    """
+    levels = {"": default_level.upper()}
+    for item in module_levels.split(","):
+        module, _, level = item.strip().partition("=")
+        if module and level:
+            levels[module.strip()] = level.strip().upper()
+    return levels
+
+
+class BackgroundStream:
+    """
+    Поток вывода, пишущий записи в фоновом потоке
+    
+    Запись только кладет готовую строку в ограниченную очередь, поэтому
+    медленный stdout не блокирует цикл событий. При переполнении очереди
+    записи отбрасываются и считаются в dropped.
+    """
+    
+    def __init__(self, stream: TextIO, max_queue: int):
+        self._stream = stream
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+    
+    def isatty(self) -> bool:
+        """Цветной вывод - только для терминала"""
+        return self._stream.isatty()
+    
+    def write(self, message: str):
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+    
+    def _run(self):
+        """Писать записи из очереди в поток вывода"""
+        while True:
+            message = self._queue.get()
+            try:
+                if message is None:
+                    return
+                self._stream.write(message)
+                self._stream.flush()
+            except Exception:
+                pass
+            finally:
+                self._queue.task_done()
+    
+    async def complete(self):
+        """Дождаться записи всех поставленных в очередь записей (logger.complete())"""
+        await asyncio.get_running_loop().run_in_executor(None, self._queue.join)
+    
+    def stop(self):
+        """Дописать очередь и остановить поток (logger.remove())"""
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+
+def setup_logging():
+    """
+    Настроить логирование приложения
+    
+    - запись в stdout через BackgroundStream - вызывающий код не ждет вывода;
+    - уровни по модулям (LOG_MODULE_LEVELS) поверх общего LOG_LEVEL;
+    - текстовый или JSON формат (LOG_FORMAT=json) с полями из logger.bind().
+    Уровень обработчика равен минимальному из настроенных, поэтому ленивые
+    аргументы (logger.opt(lazy=True)) ниже него не вычисляются.
+    """
+    current_settings = _get_settings()
+    levels = parse_module_levels(current_settings.log_level, current_settings.log_module_levels)
+    min_level = min(levels.values(), key=lambda name: logger.level(name).no)
+    
+    logger.remove()
+    logger.add(
+        BackgroundStream(sys.stdout, current_settings.log_queue_size),
+        level=min_level,
+        filter=levels,
+        format=TEXT_FORMAT,
+        serialize=current_settings.log_format == "json",
+        backtrace=False,
+        diagnose=False,
+    )
+
+
+def sampled(rate: float) -> bool:
+    """
+    Решить, писать ли запись из часто вызываемого кода
+    
+    Args:
+        rate: Доля записей, которые нужно писать (1.0 - все, 0 - ни одной)
+    """
+    return rate >= 1.0 or random.random() < rate
@@ -0,0 +1,184 @@
+import bisect
+import math
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple, Union
+
+# Границы гистограмм длительности по умолчанию (секунды)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+GaugeValue = Union[float, Dict[Tuple[str, ...], float]]
+
+
+def _escape(value: str) -> str:
+    """Экранировать значение метки для текстового формата Prometheus"""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    """Сформировать блок меток {name="value",...}"""
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    """Число в текстовом формате Prometheus"""
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Счетчик с метками"""
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+    
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Гистограмма с метками
+    
+    Наблюдение - поиск корзины и два сложения, поэтому его можно
+    вызывать на каждом запросе; накопительные значения считаются только
+    при выгрузке метрик.
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Метки -> [количество по корзинам (последняя - +Inf), сумма]
+        self._series: Dict[Tuple[str, ...], list] = {}
+    
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+    
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        """Измерить длительность блока"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                bucket_labels = _labels(self.labelnames, labels, f'le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """
+    Показатель, вычисляемый при выгрузке метрик
+    
+    Функция возвращает число или словарь "значения меток -> число". Так
+    текущее состояние (глубина очередей, занятые соединения) берется из
+    get_stats() сервисов и ничего не стоит, пока метрики не запрашивают.
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], GaugeValue],
+        labelnames: Sequence[str] = ()
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        value = self.callback()
+        values = value if isinstance(value, dict) else {(): value}
+        for labels, number in values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(number)}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Реестр метрик приложения в текстовом формате Prometheus
+    
+    Метрики регистрируются модулями при импорте; повторная регистрация с
+    тем же именем возвращает существующую метрику.
+    """
+    
+    def __init__(self):
+        self._metrics: Dict[str, Union[Counter, Histogram, Gauge]] = {}
+    
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        if name not in self._metrics:
+            self._metrics[name] = Counter(name, documentation, labelnames)
+        return self._metrics[name]
+    
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        if name not in self._metrics:
+            self._metrics[name] = Histogram(name, documentation, labelnames, buckets)
+        return self._metrics[name]
+    
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], GaugeValue],
+        labelnames: Sequence[str] = ()
+    ) -> Gauge:
+        self._metrics[name] = Gauge(name, documentation, callback, labelnames)
+        return self._metrics[name]
+    
+    def render(self) -> str:
+        """Выгрузить все метрики"""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                # Ошибка одного показателя не должна ломать выгрузку остальных
+                continue
+        return "\n".join(lines) + "\n"
+
+
+# Глобальный реестр
+metrics = MetricsRegistry()
@@ -1,8 +1,7 @@
 import httpx
-from typing import Optional, Tuple
-from PIL import Image
-import io
+from typing import Any, Dict, Optional, Tuple
 from loguru import logger
+from app.utils.image_processing import ImageProcessorBusy, image_processor, probe_image
 
 
 class ImageValidator:
@@ -59,84 +58,186 @@ class ImageValidator:
             return False, "Ошибка при проверке изображения"
     
     @classmethod
-    async def validate_image_content(cls, url: str) -> Tuple[bool, str]:
+    async def fetch_image(cls, url: str) -> Tuple[Optional[bytes], str]:
         """
-        Валидирует содержимое изображения
+        Загружает изображение одним GET запросом в потоковом режиме
+        
+        Загрузка прерывается, как только превышен MAX_FILE_SIZE, поэтому
+        отдельный HEAD запрос для проверки размера не нужен.
         
         Args:
             url: URL изображения
             
         Returns:
-            Tuple[is_valid, error_message]
+            Tuple[image_bytes, error_message]
         """
+        too_large_error = f"Файл слишком большой (максимум {cls.MAX_FILE_SIZE // (1024*1024)}MB)"
+        
         try:
             async with httpx.AsyncClient() as client:
-                response = await client.get(url, timeout=30.0)
-                
-                if response.status_code != 200:
-                    return False, "Не удалось загрузить изображение"
-                
-                if len(response.content) > cls.MAX_FILE_SIZE:
-                    return False, f"Файл слишком большой (максимум {cls.MAX_FILE_SIZE // (1024*1024)}MB)"
-                
-                # Проверяем содержимое изображения
-                try:
-                    image = Image.open(io.BytesIO(response.content))
+                async with client.stream("GET", url, timeout=30.0) as response:
+                    if response.status_code != 200:
+                        return None, f"Изображение недоступно (код: {response.status_code})"
                     
-                    logger.info(f"Image format: {image.format}")
-                    logger.info(f"Image size: {image.size}")
-                    logger.info(f"Image mode: {image.mode}")
+                    content_type = response.headers.get("content-type", "")
+                    # Telegram API часто возвращает application/octet-stream для изображений
+                    is_telegram_file = "api.telegram.org" in url
+                    is_image_content_type = content_type.startswith("image/")
+                    is_octet_stream = content_type == "application/octet-stream"
                     
-                    # Проверяем формат
-                    if image.format not in cls.ALLOWED_FORMATS:
-                        logger.error(f"Unsupported format: {image.format}, allowed: {cls.ALLOWED_FORMATS}")
-                        return False, f"Неподдерживаемый формат. Разрешены: {', '.join(cls.ALLOWED_FORMATS)}"
+                    if not is_image_content_type and not (is_octet_stream and is_telegram_file):
+                        logger.error(f"Invalid content type: {content_type}")
+                        return None, "Файл не является изображением"
                     
-                    # Проверяем размеры
-                    width, height = image.size
-                    if width < cls.MIN_DIMENSIONS[0] or height < cls.MIN_DIMENSIONS[1]:
-                        return False, f"Изображение слишком маленькое (минимум {cls.MIN_DIMENSIONS[0]}x{cls.MIN_DIMENSIONS[1]}px)"
+                    content_length = response.headers.get("content-length")
+                    if content_length and int(content_length) > cls.MAX_FILE_SIZE:
+                        return None, too_large_error
                     
-                    if width > cls.MAX_DIMENSIONS[0] or height > cls.MAX_DIMENSIONS[1]:
-                        return False, f"Изображение слишком большое (максимум {cls.MAX_DIMENSIONS[0]}x{cls.MAX_DIMENSIONS[1]}px)"
+                    buffer = bytearray()
+                    async for chunk in response.aiter_bytes():
+                        buffer.extend(chunk)
+                        if len(buffer) > cls.MAX_FILE_SIZE:
+                            logger.warning(f"Image download aborted: size limit exceeded for {url}")
+                            return None, too_large_error
                     
-                    logger.info("Image content validation passed")
-                    return True, ""
+                    return bytes(buffer), ""
                     
-                except Exception as e:
-                    logger.error(f"Error processing image content: {e}")
-                    return False, "Поврежденное изображение"
-                
         except Exception as e:
-            logger.error(f"Error validating image content {url}: {e}")
-            return False, "Ошибка при проверке содержимого изображения"
+            logger.error(f"Error downloading image {url}: {e}")
+            return None, "Не удалось загрузить изображение"
     
     @classmethod
-    async def validate_user_photo(cls, url: str) -> Tuple[bool, str]:
+    def check_image_info(cls, info: Dict[str, Any]) -> Tuple[bool, str]:
         """
-        Валидирует фото пользователя для try-on
+        Проверяет формат и размеры изображения
         
         Args:
-            url: URL фото пользователя
+            info: Формат и размеры из probe_image
             
         Returns:
             Tuple[is_valid, error_message]
         """
-        # Базовая валидация URL
-        is_valid, error = await cls.validate_image_url(url)
-        if not is_valid:
-            return False, error
+        image_format = info["format"]
+        width, height = info["width"], info["height"]
+        logger.info(f"Image format: {image_format}, size: {width}x{height}")
         
-        # Валидация содержимого
-        is_valid, error = await cls.validate_image_content(url)
-        if not is_valid:
-            return False, error
+        # Проверяем формат
+        if image_format not in cls.ALLOWED_FORMATS:
+            logger.error(f"Unsupported format: {image_format}, allowed: {cls.ALLOWED_FORMATS}")
+            return False, f"Неподдерживаемый формат. Разрешены: {', '.join(cls.ALLOWED_FORMATS)}"
         
-        # Дополнительные проверки для фото пользователя
-        # (можно добавить проверку на наличие лица, позы и т.д.)
+        # Проверяем размеры
+        if width < cls.MIN_DIMENSIONS[0] or height < cls.MIN_DIMENSIONS[1]:
+            return False, f"Изображение слишком маленькое (минимум {cls.MIN_DIMENSIONS[0]}x{cls.MIN_DIMENSIONS[1]}px)"
+        
+        if width > cls.MAX_DIMENSIONS[0] or height > cls.MAX_DIMENSIONS[1]:
+            return False, f"Изображение слишком большое (максимум {cls.MAX_DIMENSIONS[0]}x{cls.MAX_DIMENSIONS[1]}px)"
         
         return True, ""
     
+    @classmethod
+    def validate_image_bytes(cls, data: bytes) -> Tuple[bool, str]:
+        """
+        Валидирует формат и размеры изображения по заголовку
+        
+        Разбор выполняется в текущем потоке; в event loop используйте
+        validate_image_bytes_async.
+        
+        Args:
+            data: Содержимое изображения
+            
+        Returns:
+            Tuple[is_valid, error_message]
+        """
+        if len(data) > cls.MAX_FILE_SIZE:
+            return False, f"Файл слишком большой (максимум {cls.MAX_FILE_SIZE // (1024*1024)}MB)"
+        
+        try:
+            info = probe_image(data)
+        except Exception as e:
+            logger.error(f"Error processing image content: {e}")
+            return False, "Поврежденное изображение"
+        
+        return cls.check_image_info(info)
+    
+    @classmethod
+    async def validate_image_bytes_async(cls, data: bytes) -> Tuple[bool, str]:
+        """
+        Валидирует формат и размеры изображения в пуле обработки изображений
+        
+        Args:
+            data: Содержимое изображения
+            
+        Returns:
+            Tuple[is_valid, error_message]
+        """
+        if len(data) > cls.MAX_FILE_SIZE:
+            return False, f"Файл слишком большой (максимум {cls.MAX_FILE_SIZE // (1024*1024)}MB)"
+        
+        try:
+            info = await image_processor.probe(data)
+        except ImageProcessorBusy as e:
+            logger.warning(f"Image validation rejected: {e}")
+            return False, "Сервис обработки фото перегружен"
+        except Exception as e:
+            logger.error(f"Error processing image content: {e}")
+            return False, "Поврежденное изображение"
+        
+        return cls.check_image_info(info)
+    
+    @classmethod
+    async def load_validated_image(cls, url: str) -> Tuple[Optional[bytes], str]:
+        """
+        Загружает изображение один раз и валидирует его
+        
+        Полученный буфер можно сразу передать в загрузчик файлов,
+        чтобы не скачивать изображение повторно.
+        
+        Args:
+            url: URL изображения
+            
+        Returns:
+            Tuple[image_bytes, error_message]
+        """
+        data, error = await cls.fetch_image(url)
+        if data is None:
+            return None, error
+        
+        is_valid, error = await cls.validate_image_bytes_async(data)
+        if not is_valid:
+            return None, error
+        
+        logger.info("Image validation passed")
+        return data, ""
+    
+    @classmethod
+    async def validate_image_content(cls, url: str) -> Tuple[bool, str]:
+        """
+        Валидирует содержимое изображения
+        
+        Args:
+            url: URL изображения
+            
+        Returns:
+            Tuple[is_valid, error_message]
+        """
+        data, error = await cls.load_validated_image(url)
+        return data is not None, error
+    
+    @classmethod
+    async def validate_user_photo(cls, url: str) -> Tuple[bool, str]:
+        """
+        Валидирует фото пользователя для try-on
+        
+        Args:
+            url: URL фото пользователя
+            
+        Returns:
+            Tuple[is_valid, error_message]
+        """
+        data, error = await cls.load_user_photo(url)
+        return data is not None, error
+    
     @classmethod
     async def validate_clothing_photo(cls, url: str) -> Tuple[bool, str]:
         """
@@ -148,20 +249,48 @@ class ImageValidator:
         Returns:
             Tuple[is_valid, error_message]
         """
-        # Базовая валидация URL
-        is_valid, error = await cls.validate_image_url(url)
-        if not is_valid:
-            return False, error
+        data, error = await cls.load_clothing_photo(url)
+        return data is not None, error
+    
+    @classmethod
+    async def load_user_photo(cls, url: str) -> Tuple[Optional[bytes], str]:
+        """
+        Загружает и валидирует фото пользователя одним запросом
         
-        # Валидация содержимого
-        is_valid, error = await cls.validate_image_content(url)
-        if not is_valid:
-            return False, error
+        Args:
+            url: URL фото пользователя
+            
+        Returns:
+            Tuple[image_bytes, error_message]
+        """
+        data, error = await cls.load_validated_image(url)
+        if data is None:
+            return None, error
+        
+        # Дополнительные проверки для фото пользователя
+        # (можно добавить проверку на наличие лица, позы и т.д.)
+        
+        return data, ""
+    
+    @classmethod
+    async def load_clothing_photo(cls, url: str) -> Tuple[Optional[bytes], str]:
+        """
+        Загружает и валидирует фото одежды одним запросом
+        
+        Args:
+            url: URL фото одежды
+            
+        Returns:
+            Tuple[image_bytes, error_message]
+        """
+        data, error = await cls.load_validated_image(url)
+        if data is None:
+            return None, error
         
         # Дополнительные проверки для фото одежды
         # (можно добавить проверку на белый фон, четкость и т.д.)
         
-        return True, ""
+        return data, ""
 
 
 # Глобальный экземпляр
@@ -17,11 +17,20 @@ sys.path.insert(0, str(project_root))
 from dotenv import load_dotenv
 load_dotenv()
 
+# Настраиваем логирование
+from app.utils.logging_setup import setup_logging
+setup_logging()
+
 # Импортируем webhook handlers
-from app.bot.webhook_handlers import setup_webhook_routes
+from app.bot.webhook_handlers import setup_webhook_routes, webhook_handler
+from app.bot.telegram_webhook import setup_telegram_routes, telegram_webhook
+from app.monitoring import setup_monitoring_routes
 
 # Импортируем Telegram бот
 from app.bot.bot import start_bot
+from app.services.fashn_service import fashn_service
+from app.services.cloudinary_executor import cloudinary_executor
+from app.utils.image_processing import image_processor
 
 # Создаем FastAPI приложение
 app = FastAPI(
@@ -32,6 +41,8 @@ app = FastAPI(
 
 # Настраиваем маршруты для webhook'ов
 setup_webhook_routes(app)
+setup_telegram_routes(app)
+setup_monitoring_routes(app)
 
 @app.get("/")
 async def root():
@@ -51,9 +62,9 @@ async def health():
     }
 
 async def startup():
-    """Запуск Telegram бота в фоне"""
+    """Запуск Telegram бота в фоне (long polling, если webhook Telegram не настроен)"""
     try:
-        logger.info("🤖 Starting Telegram bot in background...")
+        logger.info("🤖 Starting Telegram bot in background (long polling)...")
         await start_bot()
     except Exception as e:
         logger.error(f"❌ Error starting Telegram bot: {e}")
@@ -61,7 +72,25 @@ async def startup():
 @app.on_event("startup")
 async def startup_event():
     """Запускаем Telegram бот при старте FastAPI"""
-    asyncio.create_task(startup())
+    await fashn_service.start()
+    await webhook_handler.start()
+    if telegram_webhook.enabled:
+        try:
+            await telegram_webhook.start()
+        except Exception as e:
+            logger.error(f"❌ Error starting Telegram webhook: {e}")
+    else:
+        asyncio.create_task(startup())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Закрываем общие соединения при остановке FastAPI"""
+    await webhook_handler.stop()
+    if telegram_webhook.enabled:
+        await telegram_webhook.stop()
+    await fashn_service.close()
+    cloudinary_executor.shutdown()
+    image_processor.shutdown()
 
 if __name__ == "__main__":
     import uvicorn
@@ -79,10 +108,14 @@ if __name__ == "__main__":
     
     logger.info(f"🚀 Starting webhook server on port {port}")
     
+    # Монитор event loop замеряет callback'и только в стандартном asyncio loop
+    from app.services.loop_monitor import use_profiled_event_loop
+    event_loop = use_profiled_event_loop()
     uvicorn.run(
         "app.webhook_server:app",
         host="0.0.0.0",
         port=port,
         reload=settings.debug,
-        log_level="info"
+        log_level="info",
+        loop=event_loop
     )
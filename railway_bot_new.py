@@ -23,12 +23,8 @@ sys.path.insert(0, str(project_root))
 from app import config_prod
 
 # Настраиваем логирование для production
-logger.remove()
-logger.add(
-    sys.stdout,
-    format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
-    level="INFO"
-)
+from app.utils.logging_setup import setup_logging
+setup_logging()
 
 async def main():
     """Главная функция запуска бота"""
@@ -52,4 +48,7 @@ async def main():
         raise
 
 if __name__ == "__main__":
+    # Монитор event loop замеряет callback'и только в стандартном asyncio loop
+    from app.services.loop_monitor import use_profiled_event_loop
+    use_profiled_event_loop()
     asyncio.run(main())
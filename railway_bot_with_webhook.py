@@ -23,12 +23,8 @@ sys.path.insert(0, str(project_root))
 from app import config_prod
 
 # Настраиваем логирование для production
-logger.remove()
-logger.add(
-    sys.stdout,
-    format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
-    level="INFO"
-)
+from app.utils.logging_setup import setup_logging
+setup_logging()
 
 async def main():
     """Главная функция запуска бота с webhook сервером"""
@@ -42,15 +38,23 @@ async def main():
         logger.info(f"RAILWAY_ENVIRONMENT: {os.getenv('RAILWAY_ENVIRONMENT', 'Not set')}")
         logger.info(f"FASHN_API_KEY: {'✅ Set' if os.getenv('FASHN_API_KEY') else '❌ Missing'}")
         logger.info(f"FASHN_WEBHOOK_URL: {os.getenv('FASHN_WEBHOOK_URL', 'Not set')}")
+        logger.info(f"TELEGRAM_WEBHOOK_URL: {os.getenv('TELEGRAM_WEBHOOK_URL', 'Not set (long polling)')}")
         
         # Импортируем FastAPI и webhook handlers
         from fastapi import FastAPI
-        from app.bot.webhook_handlers import setup_webhook_routes
+        from app.bot.webhook_handlers import setup_webhook_routes, webhook_handler
+        from app.bot.telegram_webhook import setup_telegram_routes, telegram_webhook
+        from app.monitoring import setup_monitoring_routes
+        from app.services.fashn_service import fashn_service
+        from app.services.cloudinary_executor import cloudinary_executor
+        from app.utils.image_processing import image_processor
         import uvicorn
         
         # Создаем FastAPI приложение
         app = FastAPI(title="Virtual Try-On Bot with Webhooks")
         setup_webhook_routes(app)
+        setup_telegram_routes(app)
+        setup_monitoring_routes(app)
         
         @app.get("/")
         async def root():
@@ -60,17 +64,35 @@ async def main():
         async def health():
             return {"status": "healthy", "service": "bot_with_webhooks"}
         
-        # Запускаем Telegram бот в фоне
+        # Long polling используется, только если webhook Telegram не настроен
         async def start_bot_background():
             try:
                 from app.bot.bot import start_bot
-                logger.info("🤖 Starting Telegram bot in background...")
+                logger.info("🤖 Starting Telegram bot in background (long polling)...")
                 await start_bot()
             except Exception as e:
                 logger.error(f"❌ Error starting Telegram bot: {e}")
         
-        # Запускаем бот в фоне
-        asyncio.create_task(start_bot_background())
+        @app.on_event("startup")
+        async def startup_event():
+            await fashn_service.start()
+            await webhook_handler.start()
+            if telegram_webhook.enabled:
+                try:
+                    await telegram_webhook.start()
+                except Exception as e:
+                    logger.error(f"❌ Error starting Telegram webhook: {e}")
+            else:
+                asyncio.create_task(start_bot_background())
+        
+        @app.on_event("shutdown")
+        async def shutdown_event():
+            await webhook_handler.stop()
+            if telegram_webhook.enabled:
+                await telegram_webhook.stop()
+            await fashn_service.close()
+            cloudinary_executor.shutdown()
+            image_processor.shutdown()
         
         # Запускаем webhook сервер
         port = int(os.getenv("PORT", 8080))
@@ -90,4 +112,7 @@ async def main():
         raise
 
 if __name__ == "__main__":
+    # Монитор event loop замеряет callback'и только в стандартном asyncio loop
+    from app.services.loop_monitor import use_profiled_event_loop
+    use_profiled_event_loop()
     asyncio.run(main())
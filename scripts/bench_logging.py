@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк стоимости логирования на одно обновление
+
+Каждое обновление проходит через то, что логирует бот: LoggingMiddleware,
+AILoggingService.log_ai_request и RedisService.set_json (Redis заменен
+заглушкой, чтобы измерялось только логирование). Сравниваются:
+- before: прежняя реализация (f-строки, json.dumps полного запроса,
+  три INFO строки в set_json) с синхронным выводом уровня INFO;
+- after: текущий код с setup_logging() (BackgroundStream, LOG_LEVEL=INFO)
+  при разных LOG_UPDATE_SAMPLE_RATE.
+
+Запуск из корня проекта:
+    python scripts/bench_logging.py [--updates 20000] [--output /dev/null]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+# Добавляем корневую директорию проекта в путь
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+os.environ.setdefault("BOT_TOKEN", "123456:ABCdefGhIJKlmnoPQRstuVWXyz012345678")
+
+from aiogram.types import Chat, Message, User
+from loguru import logger
+
+from app.bot.middleware.logging import LoggingMiddleware
+from app.services.ai_logging_service import AILoggingService
+from app.services.redis_service import RedisService
+from app.utils import logging_setup
+
+
+# Данные, похожие на реальный запрос try-on и запись пользователя
+REQUEST_DATA = {
+    "model_image": "https://res.cloudinary.com/demo/image/upload/users/1/user_photo/" + "a" * 120,
+    "garment_image": "https://res.cloudinary.com/demo/image/upload/users/1/clothing_photo/" + "b" * 120,
+    "category": "auto",
+    "mode": "balanced",
+    "num_samples": 1,
+}
+USER_DATA = {
+    "id": 1,
+    "username": "user",
+    "first_name": "User",
+    "generation_count": 3,
+    "photos": [f"https://res.cloudinary.com/demo/{i}" for i in range(10)],
+}
+
+
+class _NullRedis:
+    """Заглушка клиента Redis: SET всегда успешен"""
+    
+    async def set(self, key, value, ex=None):
+        return True
+
+
+async def _handler(event, data):
+    return None
+
+
+def _message(user_id: int) -> Message:
+    """Текстовое сообщение пользователя"""
+    return Message(
+        message_id=user_id,
+        date=datetime.now(),
+        chat=Chat(id=user_id, type="private"),
+        from_user=User(id=user_id, is_bot=False, first_name="User", username="user"),
+        text="/try_on",
+    )
+
+
+async def legacy_update(message: Message):
+    """Логирование одного обновления до изменений"""
+    user = message.from_user
+    logger.info(f"User {user.id} ({user.username}, {user.first_name}) sent message: {message.text[:100]}")
+    await _handler(message, {})
+    logger.debug(f"Handler completed successfully for user {user.id}")
+    
+    log_data = {
+        "user_id": user.id,
+        "service_name": "fashn",
+        "request_data": REQUEST_DATA,
+        "start_time": datetime.now().isoformat(),
+        "timestamp": datetime.now().isoformat()
+    }
+    logger.info(f"AI Request: {json.dumps(log_data, ensure_ascii=False)}")
+    
+    key = f"user:{user.id}"
+    logger.info(f"set_json called: key={key}, value={USER_DATA}, expire=3600")
+    json_value = json.dumps(USER_DATA)
+    logger.info(f"JSON serialized: {json_value}")
+    logger.info(f"Redis SET result: {True}")
+
+
+async def current_update(message: Message, middleware: LoggingMiddleware, redis: RedisService):
+    """Логирование одного обновления текущим кодом"""
+    await middleware(_handler, message, {})
+    await AILoggingService.log_ai_request(message.from_user.id, "fashn", REQUEST_DATA, datetime.now())
+    await redis.set_json(f"user:{message.from_user.id}", USER_DATA, expire=3600)
+
+
+async def measure(label: str, messages, update) -> float:
+    """Прогнать обновления и вернуть микросекунды на обновление"""
+    started = time.perf_counter()
+    for message in messages:
+        await update(message)
+    elapsed = time.perf_counter() - started
+    # Дописываем очередь вывода, чтобы следующий замер начинался с пустой
+    await logger.complete()
+    per_update = elapsed / len(messages) * 1e6
+    print(f"{label:<40} {per_update:8.1f} us/update", file=sys.__stderr__)
+    return per_update
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Per-update logging cost before and after")
+    parser.add_argument("--updates", type=int, default=20000, help="Number of simulated updates")
+    parser.add_argument("--output", default=os.devnull, help="Where log records are written")
+    args = parser.parse_args()
+    
+    messages = [_message(i + 1) for i in range(args.updates)]
+    output = open(args.output, "w")
+    
+    # До: синхронный вывод уровня INFO, как в прежних точках входа
+    logger.remove()
+    logger.add(output, format=logging_setup.TEXT_FORMAT, level="INFO")
+    await measure("before (sync sink, f-strings, INFO)", messages, legacy_update)
+    
+    # После: setup_logging() пишет в sys.stdout через BackgroundStream
+    redis = RedisService()
+    redis.redis = _NullRedis()
+    sys.stdout = output
+    try:
+        for rate in (1.0, 0.1):
+            current_settings = logging_setup._get_settings()
+            current_settings.log_level = "INFO"
+            current_settings.log_module_levels = ""
+            current_settings.log_format = "text"
+            logging_setup.setup_logging()
+            middleware = LoggingMiddleware()
+            middleware.sample_rate = rate
+            await measure(
+                f"after (background sink, sample {rate})",
+                messages,
+                lambda message: current_update(message, middleware, redis)
+            )
+        logger.remove()
+    finally:
+        sys.stdout = sys.__stdout__
+        output.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())